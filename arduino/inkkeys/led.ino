@@ -49,6 +49,7 @@ void animateLeds(int a, int s, int d, int br, uint32_t c, int i) {
   // A new animation is called.
   if (a != animation) {
     leds.clear();
+    leds.setBrightness(100);
     leds.show();
     steps = s;
     stepsRemaining = s;
@@ -70,6 +71,7 @@ void animateLeds(int a, int s, int d, int br, uint32_t c, int i) {
       animation = 0;
       stepDelay = 0;
       leds.clear();
+      leds.setBrightness(100); //The blink animation changes it
       leds.show();
     } else {
       // Call the animation function.
@@ -80,6 +82,9 @@ void animateLeds(int a, int s, int d, int br, uint32_t c, int i) {
         case 2:
           ledBlink();
           break;
+        case 3:
+          ledRainbow();
+          break;
        
       }
     } 
@@ -109,6 +114,15 @@ void ledBlink() {
   leds.show();
 }
 
+// 3 - Rainbow rotating once per iteration at the given brightness
+void ledRainbow() {
+  int i = steps - stepsRemaining;
+  for (int j = 0; j < N_LED; j++) {
+    leds.setPixelColor(j, dimmedColor(hue2rgb((long)i*256/steps + j*256/N_LED), brightness));
+  }
+  leds.show();
+}
+
 // Process the next step of any animation in progress.
 void processAnimation() {
   if (animation > 0) {
@@ -13,6 +13,9 @@ byte serialBufferCount = 0;
 //State while receiving an image
 unsigned short expectingImageData = 0;
 unsigned short imageDataTargetX, imageDataTargetY, imageDataTargetWidth, imageDataCurrentY;
+bool imageDataCompressed = false; //Image data is PackBits encoded ("C" instead of "D" command)
+byte packbitsLiteral = 0;         //Number of literal bytes still to come in the current PackBits block
+byte packbitsRun = 0;             //Number of repetitions of the next byte in the current PackBits block
 
 //Output an error message with index
 void printErrorWithIndex(const char * msg, byte i) {
@@ -245,7 +248,8 @@ void processAssignCommand() {
   }
 }
 
-void processDisplayCommand() {
+//Called if the serial input finds a command starting with "D" (raw image data follows) or "C" (compressed image data follows)
+void processDisplayCommand(bool compressed) {
   if (serialBufferCount < 3 || serialBuffer[1] != ' ') {
     Serial.println("E: Bad format.");
     return;
@@ -278,6 +282,9 @@ void processDisplayCommand() {
   unsigned short imageDataTargetHeight = atoi(serialBuffer + i);
   expectingImageData = imageDataTargetWidth*imageDataTargetHeight/8;
   imageDataCurrentY = imageDataTargetY;
+  imageDataCompressed = compressed;
+  packbitsLiteral = 0;
+  packbitsRun = 0;
   //Serial.print("E: Ready for image - ");
   //Serial.print(expectingImageData);
   //Serial.print(" bytes - ");
@@ -306,6 +313,7 @@ void processInfoCommand() {
   Serial.println(display.hasPartialUpdate);
   Serial.print("hasFastPartialUpdate: ");
   Serial.println(display.hasFastPartialUpdate);
+  Serial.println("CAPS RLE LEDP RAINBOW");
   
   Serial.println("Done");
 }
@@ -321,6 +329,32 @@ void processLEDCommand() {
   leds.show();
 }
 
+//Called if the serial input finds a command starting with "P", which only sets some LEDs: "P i rrggbb i rrggbb ..."
+void processPixelCommand() {
+  if (serialBufferCount < 4 || serialBuffer[1] != ' ') {
+    Serial.println("E: Bad format.");
+    return;
+  }
+  char *p = serialBuffer + 1;
+  while (*p == ' ') {
+    char *end;
+    long i = strtol(p, &end, 10);
+    if (end == p || *end != ' ' || i < 0 || i >= N_LED) {
+      Serial.println("E: Bad format.");
+      break;
+    }
+    p = end;
+    long color = strtol(p, &end, 16);
+    if (end == p) {
+      Serial.println("E: Bad format.");
+      break;
+    }
+    leds.setPixelColor(i, color);
+    p = end;
+  }
+  leds.show();
+}
+
 void processRefreshCommand() {
   if (serialBufferCount != 3 || serialBuffer[1] != ' ' || (serialBuffer[2] != 'p' && serialBuffer[2] != 'f' && serialBuffer[2] != 'o' && serialBuffer[2] != 'r')) {
     Serial.println("E: Bad format.");
@@ -427,6 +461,43 @@ void processAnimateCommand() {
   animateLeds(a, s, d, br, c, i);
 }
 
+//Store a byte of image data and write the row to the display once it is complete
+void receiveImageByte(char c) {
+  if (serialBufferCount < serialBufferSize) {
+    serialBuffer[serialBufferCount] = c;
+    serialBufferCount++;
+  }
+  expectingImageData--;
+  if (serialBufferCount * 8 >= imageDataTargetWidth) {
+    display.writeImage(serialBuffer, imageDataTargetX, imageDataCurrentY, imageDataTargetWidth, 1, false, false, false);
+    //display.writeImageAgain(serialBuffer, imageDataTargetX, imageDataCurrentY, imageDataTargetWidth, 1, false, false, false);
+    serialBufferCount = 0;
+    imageDataCurrentY++;
+  }
+}
+
+//Decode PackBits compressed image data. Each block starts with a header n: 0..127 means that n+1 literal bytes follow,
+//-1..-127 means that the next byte is repeated 1-n times and -128 is ignored. Blocks may span multiple rows.
+void receiveCompressedImageByte(char c) {
+  if (packbitsLiteral > 0) {
+    packbitsLiteral--;
+    receiveImageByte(c);
+  } else if (packbitsRun > 0) {
+    for (; packbitsRun > 0 && expectingImageData > 0; packbitsRun--)
+      receiveImageByte(c);
+  } else {
+    int8_t n = (int8_t)c;
+    if (n >= 0)
+      packbitsLiteral = n + 1;
+    else if (n != -128)
+      packbitsRun = 1 - n;
+  }
+  if (expectingImageData == 0) {
+    packbitsLiteral = 0;
+    packbitsRun = 0;
+  }
+}
+
 //Read from Serial in and react to enter (carriage return)
 void handleSerialInput() { 
   if (Serial.available() > 0) {
@@ -444,7 +515,10 @@ void handleSerialInput() {
             break;
           case 'D':
             //Serial.println("E: processDisplayCommand()");
-            processDisplayCommand();
+            processDisplayCommand(false);
+            break;
+          case 'C': //Compressed image
+            processDisplayCommand(true);
             break;
           case 'I': //Request device info
             //Serial.println("E: processInfoCommand()");
@@ -454,8 +528,12 @@ void handleSerialInput() {
             //Serial.println("E: processLEDCommand()");
             processLEDCommand();
             break;
+          case 'P': //Set some LEDs
+            processPixelCommand();
+            break;
           case 'N': //Animate LEDS
             processAnimateCommand();
+            break;
           case 'R': //Trigger refresh
             //Serial.println("E: processRefreshCommand()");
             processRefreshCommand();
@@ -471,29 +549,17 @@ void handleSerialInput() {
       //Command was handled. Reset buffer
       serialBufferCount = 0;
       
+    } else if (expectingImageData > 0) {
+      //Part of a transferred image
+      if (imageDataCompressed)
+        receiveCompressedImageByte(c);
+      else
+        receiveImageByte(c);
     } else {
-      //Just a normal character or part of a transferred image. Store it in the buffer.
+      //Just a normal character. Store it in the buffer.
       if (serialBufferCount < serialBufferSize) {
         serialBuffer[serialBufferCount] = c;
         serialBufferCount++;
-        if (expectingImageData > 0) {
-          //Serial.print("E: Image Byte ");
-          //Serial.println(c, HEX);
-          expectingImageData--;
-          if (serialBufferCount * 8 >= imageDataTargetWidth) {
-            display.writeImage(serialBuffer, imageDataTargetX, imageDataCurrentY, imageDataTargetWidth, 1, false, false, false);
-            //display.writeImageAgain(serialBuffer, imageDataTargetX, imageDataCurrentY, imageDataTargetWidth, 1, false, false, false);
-            serialBufferCount = 0;
-            imageDataCurrentY++;
-            if (expectingImageData == 0) {
-              //Serial.println("Image Written");
-            }
-          } else {
-            //Serial.print(" / imageDataTargetWidth: ");
-            //Serial.println(imageDataTargetWidth);
-            //Serial.println("----------------");
-          }
-        } 
       }
     }
   }
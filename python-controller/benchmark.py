@@ -0,0 +1,126 @@
+#Measures what switching between modes costs, using a simulated device instead of the real hardware.
+#The simulated device behaves like the firmware on a 115200 baud connection, including the time the e-ink display needs
+#to refresh, so the numbers are close to what you would see with the real keyboard.
+#
+#Usage: python3 benchmark.py [--cycles N] [--baud B] [--no-reset] [--instant] [--raw]
+#
+#For each mode, the first activation (nothing cached yet) and the average of the following ones are reported:
+#- render:   Time spent rendering icons and text with PIL
+#- pack:     Time spent converting images to the 1-bit format of the display
+#- transfer: Time the serial line is busy with data sent to the device
+#- refresh:  Time the display needs to refresh
+#- switch:   Total time from leaving the previous mode until the new one is visible
+#- bytes / commands: Data sent to the device
+
+import os
+import sys
+import time
+import argparse
+from collections import Counter
+
+os.chdir(os.path.dirname(os.path.abspath(__file__))) #Icons and fonts are loaded relative to this directory
+
+from inkkeys import *
+from modes import *
+
+parser = argparse.ArgumentParser(description="Benchmark mode switches against a simulated inkkeys device.")
+parser.add_argument("--cycles", type=int, default=5, help="Number of times all modes are activated")
+parser.add_argument("--baud", type=int, default=115200, help="Simulated baud rate")
+parser.add_argument("--no-reset", action="store_true", help="Do not reset the display between modes (the controller does)")
+parser.add_argument("--instant", action="store_true", help="Do not simulate transfer and refresh times, only count them")
+parser.add_argument("--raw", action="store_true", help="Simulate a firmware without any of the optional features (i.e. compressed image data)")
+args = parser.parse_args()
+
+PHASES = ["render", "pack", "transfer", "refresh", "switch"]
+
+#Adds up the time spent in a function of the device
+class Timed:
+    def __init__(self, timings, phase, function):
+        self.timings = timings
+        self.phase = phase
+        self.function = function
+
+    def __call__(self, *args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return self.function(*args, **kwargs)
+        finally:
+            self.timings[self.phase] += time.perf_counter() - start
+
+timings = Counter()
+sim = SimulatedSerial(baudrate=args.baud, realtime=not args.instant, capabilities=() if args.raw else (CapabilityCode.RLE.value, CapabilityCode.LED_PIXELS.value, CapabilityCode.RAINBOW.value))
+device = Device()
+device.debug = False
+device.renderIcon = Timed(timings, "render", device.renderIcon)
+device.renderText = Timed(timings, "render", device.renderText)
+device.packImage = Timed(timings, "pack", device.packImage)
+
+#Keep track of the refreshes requested by a mode, so we know when it is visible
+refreshes = []
+updateDisplay = device.updateDisplay
+def trackedUpdateDisplay(*args, **kwargs):
+    future = updateDisplay(*args, **kwargs)
+    refreshes.append(future)
+    return future
+device.updateDisplay = trackedUpdateDisplay
+
+device.attach(sim)
+if not device.requestInfo(3):
+    print("The simulated device did not answer.")
+    sys.exit(1)
+device.resetDisplay().result()
+
+bundle = ModeBundle.load("modes.json", "modes.bundle")
+modes = [bundle.mode("Blender"), ModeGimp(), ModeFallback(), ModeMiniFallback()]
+
+def modeName(mode):
+    return mode.name if isinstance(mode, BundledMode) else type(mode).__name__
+
+results = {modeName(mode): [] for mode in modes}
+
+# Switch from the previous mode to the next one, the same way the controller does, and wait until it is visible
+def switch(previous, mode):
+    timings.clear()
+    sim.resetStats()
+    refreshes.clear()
+    start = time.perf_counter()
+    if previous != None:
+        previous.deactivate(device)
+        if not args.no_reset:
+            device.playAnimation(Pulse(0x0000ff, repeat=2))
+            refreshes.append(device.resetDisplay())
+    mode.activate(device)
+    for future in refreshes:
+        future.result()
+    timings["switch"] = time.perf_counter() - start
+    timings["transfer"] = sim.transferTime
+    timings["refresh"] = sim.refreshTime
+    return {"timings": dict(timings), "bytes": sim.bytesWritten, "commands": sum(sim.commands.values()), "byCommand": dict(sim.commandBytes)}
+
+previous = None
+for cycle in range(args.cycles):
+    for mode in modes:
+        results[modeName(mode)].append(switch(previous, mode))
+        previous = mode
+device.disconnect()
+
+def average(runs, get):
+    return sum(get(run) for run in runs)/len(runs) if runs else 0
+
+print(f"{args.cycles} cycles at {args.baud} baud" + (", no display reset" if args.no_reset else "") + (", instant" if args.instant else "") + (", uncompressed" if args.raw else ""))
+print(f"{'mode':<18}{'run':<7}" + "".join(f"{p+' ms':>12}" for p in PHASES) + f"{'bytes':>9}{'commands':>10}")
+for name, runs in results.items():
+    for label, selection in (("first", runs[:1]), ("cached", runs[1:])):
+        if not selection:
+            continue
+        line = f"{name:<18}{label:<7}"
+        for phase in PHASES:
+            line += f"{average(selection, lambda r: r['timings'].get(phase, 0))*1000:>12.1f}"
+        line += f"{average(selection, lambda r: r['bytes']):>9.0f}{average(selection, lambda r: r['commands']):>10.1f}"
+        print(line)
+
+byCommand = Counter()
+for runs in results.values():
+    for run in runs:
+        byCommand.update(run["byCommand"])
+print("Bytes sent by command: " + ", ".join(f"{code}: {count}" for code, count in sorted(byCommand.items())))
@@ -3,58 +3,100 @@ VID = 0x1B4F      #USB Vendor ID for a Pro Micro
 PID = 0x9206    #USB Product ID for a Pro Micro
 DEBUG = True     #More output on the command line
 HTTP_PORT = 8080
-
-from inkkeys import *        #Inkkeys module
-from processchecks import *  #Functions to check for active processes and windows
-from modes import *          #Definitions of the hotkey functions in different "modes"
-
-import time                         #Time functions
-from serial import SerialException  #Serial functions
-import serial.tools.list_ports      #Function to iterate over serial ports
-import re                           #Regular expressions process name matching
-import traceback                    #Print tracebacks if an error is thrown and caught
-import socket                       #Get the hostname of the computer
-
-import json
-import threading                    #Run an http server in a separate thread.
-from http.server import HTTPServer, BaseHTTPRequestHandler
-from json import JSONDecodeError
+TILE_CACHE_DIR = None #Directory to keep rendered display tiles across restarts, None = only keep them in memory
+PRERENDER = True #Render the display tiles of all modes in the background, so switching modes only has to send them
+MODE_DEFINITIONS = "modes.json" #Declarative modes, see inkkeys/bundle.py
+MODE_BUNDLE = "modes.bundle"    #Compiled form of MODE_DEFINITIONS, created again whenever the definitions, icons or font change
+ICON_DIRECTORY = "icons"
+ICON_ATLAS = "icons.atlas"      #All icons of ICON_DIRECTORY rotated and packed, updated whenever an icon changes, see inkkeys/iconatlas.py. None = decode each icon when it is used
+REFRESH_DELAY = 0.1 #Seconds to wait for more changes before refreshing the display, so quickly switching through several windows only refreshes once. None = refresh right away
+RECORD_FILE = None #Record all serial traffic to this file for replay.py, None = do not record
+TRACE_FILE = None #Write all timings and events to this file as json lines, None = no trace. Metrics are always available on http://localhost:HTTP_PORT/metrics
+
+import sys
+from startupprofile import *    #Run with --profile-startup to see how long each part of the startup takes
+startup = StartupProfile("--profile-startup" in sys.argv)
+
+#Heavy dependencies (PIL, psutil, Xlib, the serial port list) are only imported when they are needed, see the
+#comments in processchecks.py and inkkeys/device.py. Keep it that way when adding imports here.
+with startup.phase("import inkkeys"):
+    from inkkeys import *        #Inkkeys module
+with startup.phase("import processchecks"):
+    from processchecks import *  #Functions to check for active processes and windows
+with startup.phase("import modematcher"):
+    from modematcher import *    #Decides which mode to use
+with startup.phase("import modes"):
+    from modes import *          #Definitions of the hotkey functions in different "modes"
+with startup.phase("import portfinder"):
+    from portfinder import *     #Finds the serial port of the device
+with startup.phase("import prerender"):
+    from prerender import *      #Renders the tiles of all modes in the background
+with startup.phase("import deadlines"):
+    from deadlines import *      #Decides when the main loop has to run again
+
+with startup.phase("import standard library"):
+    import time                         #Time functions
+    from serial import SerialException  #Serial functions
+    import re                           #Regular expressions process name matching
+    import traceback                    #Print tracebacks if an error is thrown and caught
+    import socket                       #Get the hostname of the computer
+    import os
+
+    import asyncio                      #Event loop running the device, the http server and the modes
+    import json
+    from json import JSONDecodeError
 
 print("https://there.oughta.be/a/macro-keyboard")
 print('I will try to stay connected. Press Ctrl+c to quit.')
 
-class HttpHandler(BaseHTTPRequestHandler):  
-    def do_POST(self):
-        content_length = int(self.headers["Content-Length"])
-        post_data = self.rfile.read(content_length)
+#Minimal http server on the event loop. A POST with a json payload like {"status": "Error"} sets the device status.
+#A GET of /metrics returns the metrics of the controller and the device in the Prometheus text format.
+async def handleHttp(reader, writer):
+    try:
+        requestLine = await reader.readline()
+        headers = {}
+        while True:
+            line = await reader.readline()
+            if line in (b"\r\n", b"\n", b""):
+                break
+            name, _, value = line.decode("ISO-8859-1").partition(":")
+            headers[name.strip().lower()] = value.strip()
+        if requestLine.startswith(b"GET "):
+            if requestLine.split()[1:2] == [b"/metrics"]:
+                writer.write(b"HTTP/1.0 200 OK\r\nContent-type: text/plain; version=0.0.4\r\n\r\n" + metrics.render().encode())
+            else:
+                writer.write(b"HTTP/1.0 404 Not found\r\n\r\n")
+            await writer.drain()
+            return
+        if not requestLine.startswith(b"POST "):
+            writer.write(b"HTTP/1.0 501 Unsupported method\r\n\r\n")
+            return
+        content_length = int(headers.get("content-length", 0))
+        post_data = await reader.readexactly(content_length)
         if DEBUG:
             print(f"POST - {content_length} bytes received.")
         try:
             payload = json.loads(str(post_data, "utf-8"))
             if "status" in payload:
                 device.setStatus(payload["status"])
-
-            self.send_response(200)
-            self.send_header("Content-type", "text/plain")
-            self.end_headers()
+                device.wake()           #Let the main loop pass it on to the mode right away
         except JSONDecodeError as jde:
             print(jde)
             print(post_data)
-            self.send_response(200)
-            self.send_header("Content-type", "text/plain")
-            self.end_headers()
-
-def listenToHttp():
+        writer.write(b"HTTP/1.0 200 OK\r\nContent-type: text/plain\r\n\r\n")
+        await writer.drain()
+    except (asyncio.IncompleteReadError, ValueError, ConnectionError):
+        pass
+    finally:
+        writer.close()
+
+async def listenToHttp():
     print(f'Listening for http traffic on port {HTTP_PORT}')
     try:
-        httpd = HTTPServer(("0.0.0.0", HTTP_PORT), HttpHandler)
-        httpd.serve_forever()
+        return await asyncio.start_server(handleHttp, "0.0.0.0", HTTP_PORT)
     except OSError:
         print(f"Cannot bind http server on adress {HTTP_PORT}")
 
-httpThread = threading.Thread(target=listenToHttp, daemon=True)
-httpThread.start()
-
 
 
 ############################################################################################################
@@ -63,19 +105,31 @@ httpThread.start()
 #The logic of this is built around "modes". The modes themselves are defined in "modes.py", where you can
 #change key assignments, images, LED animations and their entire logic.
 
-#Below, you only define a list of modes (defined in "modes.py") that are active and set either a process
+#Below, you only define a list of modes (defined in "modes.py" or "modes.json") that are active and set either a process
 #(mode would be active whenever the process runs) or an active window (mode is active if the window has
 #the focus. The latter is a compiled regular expression pattern. Mode priority corresponds to the order in the
 #list, so the first mode with a matching process or active window will be activated.
+#Modes from "modes.py" are given as class, so they are only created when they are needed for the first time.
+
+iconAtlas = None
+if ICON_ATLAS != None:
+    with startup.phase("load " + ICON_ATLAS):
+        iconAtlas = IconAtlas.load(ICON_DIRECTORY, ICON_ATLAS)
+
+with startup.phase("load " + MODE_BUNDLE):
+    bundle = ModeBundle.load(MODE_DEFINITIONS, MODE_BUNDLE, iconAtlas)   #Modes from modes.json, use bundle.mode(name)
 
 modes = [\
-            {"mode": ModeBlender(), "activeWindow": re.compile("^Blender")}, \
-            {"mode": ModeGimp(), "activeWindow": re.compile("^GIMP.*")}, \
-            {"mode": ModeMiniFallback(), "hostname": re.compile("^Mac-Min.*")}, \
-            {"mode": ModeFallback()} \
+            {"mode": bundle.mode("Blender"), "activeWindow": re.compile("^Blender")}, \
+            {"mode": ModeGimp, "activeWindow": re.compile("^GIMP.*")}, \
+            {"mode": ModeMiniFallback, "hostname": re.compile("^Mac-Min.*")}, \
+            {"mode": ModeFallback} \
         ]
 
-hostname = socket.gethostname()
+with startup.phase("compile mode table"):
+    hostname = socket.gethostname()
+    processes = ProcessIndex({i["process"] for i in modes if "process" in i})    #Only keeps track of the processes used above
+    matcher = ModeMatcher(modes, hostname)  #Compiles the list above once, so picking a mode is cheap even with many modes
 
 ############################################################################################################
 
@@ -86,100 +140,187 @@ hostname = socket.gethostname()
 #If we found the device, successfully connected and retreived its information, we enter this work function,
 #which primarily consists of an infinite loop that only returns if we hit Ctrl+C (or kill the process).
 
-def work():
+async def work():
     mode = None             #Current mode of the device (i.e. key mappings for specific process).
-    pollInterval = 0        #Polling interval as requested by the module when the last call to "poll" was made
-    lastPoll = 0            #Keeps track of the last time the poll function of the mode instance was called
+    poller = ModePoller(device) #Calls the poll function of the mode as often as it asks for
     lastProcessList = 0     #Keeps track of the last time the list of processes was retrieved
     lastModeCheck = 0       #Keeps track of the last time the current window was checked and a decision about the mode was made
     activeWindow = None
-    
+
+    loop = asyncio.get_running_loop()
+    wakeup = asyncio.Event()    #Set to end the current sleep of the main loop early, i.e. when the active window changed or a key was pressed
+    device.wakeup = wakeup
+    windowEvents = []           #Active windows reported by the window watcher since the last mode check
+
+    def windowChanged(window):
+        windowEvents.append(window)
+        wakeup.set()
+
+    #If the platform can tell us when the focus changes, we do not need to ask for the active window all the time
+    watcher = WindowWatcher(lambda window: loop.call_soon_threadsafe(windowChanged, window), lambda: loop.call_soon_threadsafe(wakeup.set))
+    watching = watcher.start()
+    if watching:
+        windowEvents.append(watcher.lastWindow)    #The window that has the focus now, so the first mode is already the right one
+
     try:
         while True:     #Now we are in our main, infinite loop -------------------
             now = time.time() #Time of this iteration
-
-            if now - lastProcessList > 5.0:      # Only check the process list every 5 seconds.
-                processes = getActiveProcesses() # This is a surprisingly expensive and slow call, so don't overdo as it might prevent smooth LED animation (fixable by implementing a second thread) and burn more CPU resources than you might want from a background process
-                lastProcessList = now
-
-            if now - lastModeCheck > 0.5:       # Check active window and decide which mode to use. This can be done more regularly, but since the e-ink screen takes a moment to update, it does not make sense to check more frequently
+            checkMode = lastModeCheck == 0
+            deadlines = Deadlines()  #Times at which something needs to be done. The loop sleeps until the earliest one or until it is woken up.
+
+            if processes.names:                 # Only if any mode depends on a process
+                if now - lastProcessList > 5.0: # Only check the process list every 5 seconds.
+                    start = time.time()
+                    if await loop.run_in_executor(None, processes.update): # Only new processes are looked at, but this still runs in a separate thread to keep the LED animation smooth
+                        checkMode = True        # A process of one of the modes started or ended
+                    metrics.observe("process_scan_seconds", time.time() - start)
+                    lastProcessList = now
+                deadlines.add(lastProcessList + 5.0)
+
+            if watching and watcher.failed:     # Lost the connection to the X server, ask for the active window from now on
+                watching = False
+            if windowEvents:                    # The window watcher reported a new active window, react to it right away
+                window = windowEvents[-1]
+                windowEvents.clear()
+                checkMode = True
+            elif not watching and now - lastModeCheck > 0.5:   # Without a watcher, check active window regularly. This can be done more frequently, but since the e-ink screen takes a moment to update, it does not make sense to check more often
+                start = time.time()
                 window = getActiveWindow()      # Get the currently active window
+                metrics.observe("window_query_seconds", time.time() - start)
+                checkMode = True
+            else:
+                window = None
+
+            if checkMode:                       # Decide which mode to use
                 if window != None:              # Sometime getting the active window fails, then ignore it. (Some window managers allow having no window in focus)
                     if DEBUG and activeWindow != window:                   #Enable DEBUG to see the actual name of the current window if you need it to match your modules
                         print("Active window: " + str(window))
                     activeWindow = window
 
-                for i in modes:                 #Iterate over modes and use the first one that matches
-                    if ("process" in i and i["process"] in processes) or ("hostname" in i and i["hostname"].match(hostname)) or ("activeWindow" in i and i["activeWindow"].match(activeWindow)) or not ("process" in i or "activeWindow" in i or "hostname" in i):
-                        #Either the process for this mode is running or the active window matches the regular expression. This is the mode we will set now.
-                        if i["mode"] != mode:           # Do not set the mode again if we already have this one
-                            if mode != None:            
-                                mode.deactivate(device) # If there was a previous mode, call its deactivate function
-                                device.sendLedAnimation(2, 50, 20, b=255, iteration=2)
-                                device.resetDisplay()
-                            mode = i["mode"]            # Set new mode
-                            mode.activate(device)       # ...and call its activate function
-                            pollInterval = 0            # Reset the poll intervall to call mode.poll() at least once (see below)
-                        break
+                newMode = matcher.select(activeWindow, processes)  #The first mode in the list with a running process, a matching active window or hostname or without any condition
+                if newMode != None and newMode != mode: # Do not set the mode again if we already have this one
+                    start = time.time()
+                    if mode != None:
+                        mode.deactivate(device)     # If there was a previous mode, call its deactivate function
+                        device.playAnimation(Pulse(0x0000ff, repeat=2))
+                        device.resetDisplay()
+                    mode = newMode                  # Set new mode
+                    mode.activate(device)           # ...and call its activate function
+                    prerenderer.activated(mode)     # Modes used more often get their tiles rendered first
+                    metrics.observe("mode_switch_seconds", time.time() - start, mode=getattr(mode, "name", type(mode).__name__))
+                    poller.reset()                  # Call mode.poll() at least once (see below)
+                    startup.report("the first mode is active") # Only does something the first time and with --profile-startup
                 lastModeCheck = now
-
-            if pollInterval >= 0 and now - lastPoll > pollInterval:    #Regularly call the poll function of the mode if it requires regular polling
-                #The poll function returns the desired interval when it should be called next - or False if polling is not required in this mode
-                pollInterval = mode.poll(device)
-                lastPoll = now
-
-            #Now for the functions that need to be called very often and fast:
-            mode.animate(device)    #Used for LED animations
-            device.poll()           #Required for the callbacks that are associated with key presses reported via serial
-
-            #If the actions so far did take less than 1/30 seconds, sleep until 1/30s have passed as there is no need to exceed 30fps
-            timeTo30fps = time.time() - now + 0.0333
-            if timeTo30fps > 0:
-                time.sleep(timeTo30fps)
+            if not watching:
+                deadlines.add(lastModeCheck + 0.5)
+
+            deadlines.add(poller.update(mode, now))  #Regularly call the poll function of the mode if it requires regular polling, and right away when the status has been set via http
+
+            #Now for the functions that need to be called often and fast, but only as long as there is something to animate:
+            deadlines.add(animateMode(mode, device, now))   #Used for LED animations
+            animateIn = device.updateAnimation() #Keeps animations started with device.playAnimation going
+            if animateIn != None:
+                deadlines.add(now + animateIn)
+            refreshIn = device.updateRefresh()  #Sends collected images and display refreshes once they are due, see REFRESH_DELAY
+            if refreshIn != None:
+                deadlines.add(now + refreshIn)
+            if PRERENDER:
+                prerenderer.update()    #Renders missing tiles of all modes in the background after connecting, activating a mode for the first time or changing an icon
+            device.poll()           #Key presses are handled by the event loop as soon as they arrive, this only sends collected key assignments and reports serial errors
+
+            busy = time.time() - now
+            metrics.observe("loop_seconds", busy, trace=False)  #Only overruns go to the trace, see below
+            if busy > FRAME_TIME:
+                metrics.count("loop_overruns_total")
+                metrics.trace("loop_overrun", seconds=busy, mode=getattr(mode, "name", type(mode).__name__))
+
+            #Sleep until the next deadline. Key presses, focus changes, a new status or serial errors end the sleep early.
+            timeout = deadlines.timeout(now, time.time())   #Never more than 30 times per second
+            try:
+                await asyncio.wait_for(wakeup.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+            wakeup.clear()
                     #End of main loop -------------------------------------------
 
 
-    except KeyboardInterrupt:       #User pressed Ctrl+c
+    except asyncio.CancelledError:  #User pressed Ctrl+c
         #mqtt.disconnect()
-        print('Disconnected from device. Hit Ctrl+c again to quit before reconnect.')
+        print('Disconnected from device.')
+        raise
+    finally:
+        watcher.stop()
+        device.wakeup = None
 
 
 #Try connecting on the given port and work with it.
 #Will return false if connection fails or an unknown device is present.
 #If it succeeds, it will enter the main working loop forever. It will only return if an error occurs and return True to report that it was working with the correct device.
-def tryUsingPort(port):
+#info are the lines of the device info if the port finder has received them already.
+async def tryUsingPort(port, info=None):
+    connected = False
     try:
-        if device.connect(port):
+        with startup.phase("connect to " + port):
+            connected = await device.open(port, info)
+        if connected:
+            finder.connected(port)                  #Try this port first next time
+            metrics.count("connects_total")
+            prerenderer.start()                     #Tiles depend on the display, so look for missing ones right away
             print(f"Connected to controller on {socket.gethostname()}")
             device.resetDisplay()
-            work()  #Success, enter main loop
+            await work()  #Success, enter main loop
             device.disconnect()
             return True
     except SerialException as e:
         print("Serial error: ", e)
+        device.disconnect()
+    except asyncio.CancelledError:
+        device.disconnect()
+        raise
     except:
         #Something entirely unexpected happened. We will catch it nevertheless, so the device keeps working as this process will probably run in the background unsupervised. But we need to print a proper stacktrace, so we can debug the problem.
         if DEBUG:
             print(traceback.format_exc())
         print("Error: ", sys.exc_info()[0])
+        device.disconnect()
+    finally:
+        if connected:
+            finder.disconnected()                   #Start measuring the time until we are back
+            metrics.count("disconnects_total")
     return False
 
 # Instantiate the device
-device = Device()
+metrics = Metrics()             #Counters and timings of the controller and the device, served on /metrics
+if TRACE_FILE != None:
+    metrics.openTrace(TRACE_FILE)
+device = AsyncDevice(TileCache(directory=TILE_CACHE_DIR), metrics)
+if RECORD_FILE != None:
+    device.record(RECORD_FILE)
 device.debug = DEBUG
-try:
+device.refreshDelay = REFRESH_DELAY
+device.iconAtlas = iconAtlas
+finder = PortFinder(VID, PID, metrics)   #Searches the serial ports for the device and notices when it is plugged in
+prerenderer = Prerenderer(device, matcher.modes, os.path.join(TILE_CACHE_DIR, "activations.json") if TILE_CACHE_DIR != None else None)
+
+async def main():
+    with startup.phase("start http server"):
+        httpServer = await listenToHttp()   #Runs on the event loop alongside the device
+    finder.watch()              #Get notified about new serial ports from now on, if the system can do that
     while True:
         if SERIALPORT != None:  #Explicit port has been defined
-            tryUsingPort(SERIALPORT)
+            await tryUsingPort(SERIALPORT)
         else:                   #No explicit port defined. Search for the device
-            for port in serial.tools.list_ports.comports(): #Iterate over all serial ports
-                if port.vid != VID or port.pid != PID:
-                    continue                                #Skip if vendor or product ID do not match
-                if tryUsingPort(port.device):               #Try connecting to this device
+            with startup.phase("find serial port"):
+                ports = await finder.find() #Ports with matching vendor and product ID, the last good one first. Several candidates are probed in parallel.
+            for port, info in ports:
+                if await tryUsingPort(port, info):                #Try connecting to this device
                     break                                   #Connection was successful and inkkeys was found. If we reach this point, we do not need to search on another port. We got disconnected or some other kind of error, so skip the rest of the port list and start over.
-        print("I will retry in three seconds...")
-        time.sleep(3)
+        print("Waiting for the device...")
+        await finder.waitForChange()    #Returns as soon as a serial port appears (or after a while to try again anyway)
+
+try:
+    asyncio.run(main())
 except KeyboardInterrupt:       #User pressed Ctrl+c
     print('Ok, bye.')
-
-
+finally:
+    prerenderer.stop()          #Ends a pass that is still running in the background
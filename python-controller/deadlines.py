@@ -0,0 +1,61 @@
+from inkkeys.animation import FRAME_TIME
+
+#Decides when the main loop of the controller (see work() in controller.py) has to run again. Each part of the loop
+#adds the time at which it needs to be called next and the loop sleeps until the earliest of them or until something
+#wakes it up (a key press, a focus change, a new status or a serial error). It never runs more than 30 times per second.
+#Nothing due at all means sleeping until woken up, so an idle controller does not wake up.
+
+class Deadlines:
+
+    def __init__(self):
+        self.times = []
+
+    # Something needs to be done at this time. None means nothing is due.
+    def add(self, at):
+        if at != None:
+            self.times.append(at)
+
+    # Seconds to sleep at time current for a loop iteration that started at now, None to sleep until woken up
+    def timeout(self, now, current):
+        if not self.times:
+            return None
+        return max(max(min(self.times), now + FRAME_TIME) - current, 0)
+
+#Calls the poll function of the current mode as often as it asks for. poll() returns the seconds until it wants to be
+#called again or False (or None) if it does not need to be polled anymore. A new mode and a new status (set via http)
+#are always polled right away.
+class ModePoller:
+
+    def __init__(self, device):
+        self.device = device
+        self.interval = 0               #As returned by the last call of poll()
+        self.last = 0                   #Time of the last call of poll()
+        self.status = device.status     #Status of the device the mode has last seen
+
+    # Poll a new mode right away
+    def reset(self):
+        self.interval = 0
+
+    # Poll the mode if it is due. Returns the time of the next poll or None if there is none.
+    def update(self, mode, now):
+        if self.device.status != self.status:
+            self.interval = 0
+        if self.interval is False or self.interval == None:
+            return None
+        if now - self.last >= self.interval:
+            self.interval = mode.poll(self.device)
+            self.last = now
+            self.status = self.device.status
+        if self.interval is False or self.interval == None:
+            return None
+        return self.last + self.interval
+
+# Let the mode animate the LEDs. animate() returns the seconds until it wants to be called again or False if there is
+# nothing to animate, modes that return nothing are animated at 30fps. Returns the time of the next call or None.
+def animateMode(mode, device, now):
+    animateIn = mode.animate(device)
+    if animateIn is None:
+        return now + FRAME_TIME
+    if animateIn is False:
+        return None
+    return now + animateIn
@@ -1,3 +1,15 @@
 from .protocol import *
+from .tilecache import *
+from .metrics import *
+from .recorder import *
+from .framebuffer import *
+from .glyphs import *
+from .iconatlas import *
+from .compression import *
+from .leds import *
+from .animation import *
+from .refresh import *
 from .device import *
-
+from .bundle import *
+from .asyncdevice import *
+from .simulator import *
@@ -0,0 +1,254 @@
+from .protocol import *
+from .leds import *
+import time
+
+#Declarative LED animations and a player that runs them with as little help from the host as possible.
+#An animation describes what the LEDs should show over time. The AnimationPlayer plans how to get there: Effects the
+#firmware can run on its own (see led.ino) are sent as a single N command and the host only wakes up again when the
+#effect ends (or has to be restarted because the firmware counts its iterations in a byte). Only effects without a
+#firmware counterpart are streamed frame by frame, and static colors are sent once.
+#
+#Example: device.playAnimation(Sequence(Pulse(0x0000ff, repeat=3), Fade(0x00ff00, 0, 2.0)))
+
+FRAME_TIME = 1/30       #Interval of frames computed on the host when an animation has to be streamed
+
+#Animations built into the firmware, as used by the N command
+FIRMWARE_STOP = 0
+FIRMWARE_GREETING = 1   #Rainbow swirl fading in and out
+FIRMWARE_BLINK = 2      #Single color fading in and out
+FIRMWARE_RAINBOW = 3    #Rotating rainbow at constant brightness, only if the device reports CapabilityCode.RAINBOW
+
+MAX_ITERATIONS = 255    #The firmware stores the iterations in a byte...
+MAX_STEP_DELAY = 255    #...and the delay between steps as well
+
+# The firmware advances to the next step once more than the delay (in ms) has passed
+def stepTime(delay):
+    return (delay + 1)/1000
+
+def stepDelay(period, steps):
+    return max(0, min(MAX_STEP_DELAY, round(period*1000/steps) - 1))
+
+# Frame with one color for all LEDs or a list of colors (one per LED)
+def colorFrame(colors, n):
+    return ledFrame([colors] * n if isinstance(colors, int) else colors)
+
+def triangle(p):
+    return 1 - abs(2*p - 1)
+
+class Animation:
+    duration = None     #Length in seconds, None if it runs until something else is played
+    static = False      #True if the frame never changes, so it only has to be sent once
+
+    # N command arguments (animation, steps, delay, brightness, r, g, b) to run one period on the device, None if the
+    # firmware cannot do this
+    def firmware(self, device):
+        return None
+
+    # Length of one iteration of the firmware animation
+    def period(self):
+        return None
+
+    # Frame to show t seconds after the start, used if the animation has to be streamed. By default the LEDs stay as
+    # they are.
+    def frame(self, device, t):
+        return device.ledFrame
+
+# A fixed color (or list of colors)
+class Solid(Animation):
+    static = True
+
+    def __init__(self, colors, duration=None):
+        self.colors = colors
+        self.duration = duration
+
+    def frame(self, device, t):
+        return colorFrame(self.colors, device.nLeds)
+
+# Linear fades between frames, given as a list of (time, colors)
+class Keyframes(Animation):
+
+    def __init__(self, keyframes):
+        self.keyframes = sorted(keyframes, key=lambda keyframe: keyframe[0])
+        self.duration = self.keyframes[-1][0]
+
+    def frame(self, device, t):
+        frames = [(at, colorFrame(colors, device.nLeds)) for at, colors in self.keyframes]
+        for (t0, a), (t1, b) in zip(frames, frames[1:]):
+            if t < t1:
+                return blendFrames(a, b, (t - t0)/(t1 - t0))
+        return frames[-1][1]
+
+class Fade(Keyframes):
+
+    def __init__(self, start, end, duration):
+        super().__init__([(0, start), (duration, end)])
+
+# Breathing: The color fades in and out once per period. repeat=None keeps pulsing until something else is played.
+class Pulse(Animation):
+
+    def __init__(self, color, period=1.05, repeat=1, steps=50):
+        self.color = color
+        self.periodLength = period
+        self.repeat = repeat
+        self.steps = steps
+        self.duration = period*repeat if repeat != None else None
+
+    def firmware(self, device):
+        return (FIRMWARE_BLINK, self.steps, stepDelay(self.periodLength, self.steps), 0, (self.color >> 16) & 0xff, (self.color >> 8) & 0xff, self.color & 0xff)
+
+    def period(self):
+        return self.steps*stepTime(stepDelay(self.periodLength, self.steps))
+
+    def frame(self, device, t):
+        return dimFrame(colorFrame(self.color, device.nLeds), triangle((t % self.periodLength)/self.periodLength))
+
+# Rainbow swirl fading in and out, like the greeting of the device when it starts
+class RainbowPulse(Animation):
+
+    def __init__(self, period=8.0, repeat=1, steps=510):
+        self.periodLength = period
+        self.repeat = repeat
+        self.steps = steps
+        self.duration = period*repeat if repeat != None else None
+
+    def firmware(self, device):
+        return (FIRMWARE_GREETING, self.steps, stepDelay(self.periodLength, self.steps), 0, 0, 0, 0)
+
+    def period(self):
+        return self.steps*stepTime(stepDelay(self.periodLength, self.steps))
+
+    def frame(self, device, t):
+        p = (t % self.periodLength)/self.periodLength
+        return dimFrame(rainbowFrame(device.nLeds, p*self.steps/512), triangle(p))
+
+# All LEDs around the hue circle, rotating once per period
+class Rainbow(Animation):
+
+    def __init__(self, period=1.0, brightness=255, repeat=None, steps=64):
+        self.periodLength = period
+        self.brightness = brightness
+        self.repeat = repeat
+        self.steps = steps
+        self.duration = period*repeat if repeat != None else None
+
+    def firmware(self, device):
+        if CapabilityCode.RAINBOW.value not in device.capabilities:
+            return None
+        return (FIRMWARE_RAINBOW, self.steps, stepDelay(self.periodLength, self.steps), self.brightness, 0, 0, 0)
+
+    def period(self):
+        return self.steps*stepTime(stepDelay(self.periodLength, self.steps))
+
+    def frame(self, device, t):
+        return dimFrame(rainbowFrame(device.nLeds, t/self.periodLength), self.brightness/255)
+
+# Animations played one after another, the whole sequence repeat times (None = forever). A sequence that repeats forever
+# has to take some time, otherwise the player would start it over and over again without ever waiting.
+class Sequence(Animation):
+
+    def __init__(self, *animations, repeat=1):
+        self.animations = animations
+        self.repeat = repeat
+        length = None
+        if all(animation.duration != None for animation in animations):
+            length = sum(animation.duration for animation in animations)
+        if repeat == None and animations and length != None and length <= 0:
+            raise ValueError("A sequence that repeats forever needs a duration.")
+        self.duration = length*repeat if repeat != None and length != None else None
+
+#Turns an animation into N commands, single frames and streamed frames and runs them. update() has to be called
+#regularly (the controller does this in its main loop) and returns the time in seconds until it needs to be called again.
+class AnimationPlayer:
+
+    def __init__(self, device):
+        self.device = device
+        self.segments = []      #Planned parts of the current animation that have not been started yet, see plan()
+        self.current = None
+        self.start = 0          #Start time of the current segment
+        self.restart = None     #Time to start the firmware animation of the current segment again
+
+    # Split the animation into a list of (kind, animation) with kind being "firmware", "static" or "stream". A sequence
+    # that repeats forever ends with ("repeat", list of its own segments), which starts it over. Whatever would follow
+    # it is never played.
+    def plan(self, animation):
+        if isinstance(animation, Sequence):
+            parts = []
+            for part in animation.animations:
+                parts += self.plan(part)
+                if parts and parts[-1][0] == "repeat":
+                    break
+            if animation.repeat == None and parts and parts[-1][0] != "repeat":
+                parts.append(("repeat", parts))
+            return parts if animation.repeat == None else parts * animation.repeat
+        if animation.firmware(self.device) != None:
+            return [("firmware", animation)]
+        if animation.static:
+            return [("static", animation)]
+        return [("stream", animation)]
+
+    def play(self, animation, now=None):
+        self.stop()
+        if now == None:
+            now = time.time()
+        self.segments = list(self.plan(animation))  #A copy, repeating sequences start over with their planned segments
+        self.next(now)
+        return self.update(now)
+
+    def stop(self):
+        if self.current != None and self.current[0] == "firmware":
+            self.device.sendLedAnimation(FIRMWARE_STOP, 1)
+        self.current = None
+        self.segments = []
+
+    def playing(self):
+        return self.current != None
+
+    def next(self, now):
+        if self.current != None and self.current[0] == "firmware" and self.segments:
+            self.device.sendLedAnimation(FIRMWARE_STOP, 1)  #The device might still be running it. If nothing follows, it ends on its own.
+        self.current = None
+        while self.segments:
+            segment = self.segments.pop(0)
+            if segment[0] == "repeat":
+                self.segments = list(segment[1])
+                continue
+            self.current = segment
+            self.start = now
+            self.restart = None
+            if segment[0] == "static":
+                self.device.sendLedFrame(segment[1].frame(self.device, 0))
+            break
+
+    # Send whatever is due and return the seconds until the next call is needed or None if nothing is playing
+    def update(self, now=None):
+        if now == None:
+            now = time.time()
+        while self.current != None:
+            kind, animation = self.current
+            end = self.start + animation.duration if animation.duration != None else None
+            if end != None and now >= end:
+                if kind == "stream":
+                    self.device.sendLedFrame(animation.frame(self.device, animation.duration))  #Make sure a fade reaches its target
+                self.next(end)
+                continue
+            if kind == "firmware":
+                if self.restart == None or now >= self.restart:
+                    self.startFirmware(animation, now, end)
+                return (min(self.restart, end) if end != None else self.restart) - now
+            if kind == "static":
+                return end - now if end != None else None
+            self.device.sendLedFrame(animation.frame(self.device, now - self.start))
+            return FRAME_TIME
+        return None
+
+    # Send the N command for as many iterations as the firmware can count, restart it when they are done
+    def startFirmware(self, animation, now, end):
+        period = animation.period()
+        iterations = MAX_ITERATIONS
+        if end != None:
+            iterations = max(1, min(MAX_ITERATIONS, round((end - now)/period)))
+        if self.restart != None:
+            self.device.sendLedAnimation(FIRMWARE_STOP, 1)  #Sending the same animation again would not restart it
+        a, steps, delay, brightness, r, g, b = animation.firmware(self.device)
+        self.device.sendLedAnimation(a, steps, delay, brightness, r, g, b, iterations)
+        self.restart = now + iterations*period
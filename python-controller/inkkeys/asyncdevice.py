@@ -0,0 +1,179 @@
+from .device import *
+import sys
+import time
+import asyncio
+import serial
+from threading import Thread
+
+#Device for use with asyncio. Instead of polling the serial port, the event loop is notified when data arrives and
+#callbacks are called as soon as a line has been received. Outgoing data still goes through the prioritized writer
+#thread of the Transport, so writing never blocks the event loop either.
+#All the regular functions of Device (as used by the modes) keep working, while the functions that have to wait for the
+#device are available as coroutines: request_info(), update_display() and send_image().
+class AsyncDevice(Device):
+    loop = None
+    lines = None        #asyncio.Queue with lines while a request is waiting for them (see request_info), otherwise None
+    readerThread = None #Only used if the event loop cannot watch the serial port directly (i.e. on Windows)
+    ackTimer = None
+    wakeup = None       #asyncio.Event that is set whenever input has been handled or an error occured, so a loop waiting on it can react
+
+    def __init__(self, tileCache=None, metrics=None):
+        super().__init__(tileCache, metrics)
+        self.received = []  #Lines waiting for handleReceived
+
+    # Like Device.connect, the info is only requested if it is not given
+    async def open(self, dev, info=None):
+        print("Connecting to ", dev, ".")
+        self.attach(serial.Serial(dev, 115200, timeout=1, write_timeout=5))
+        if info != None:
+            self.parseInfo(info)
+        elif not await self.request_info(3):
+            self.disconnect()
+            return False
+        if self.testmode:
+            print("Connection to ", self.ser.name, " was successfull, but the device is running the hardware test firmware, which cannot be used for anything but testing. Please flash the proper inkkeys firmware to use it.")
+            self.disconnect()
+            return False
+        print("Connected to ", self.ser.name, ".")
+        return True
+
+    def attach(self, ser):
+        self.loop = asyncio.get_running_loop()
+        self.ser = ser
+        self.reset()
+        self.received = []
+        self.transport = Transport(ser, self.onLine, self.debug, reader=False, onError=lambda error: self.loop.call_soon_threadsafe(self.wake), metrics=self.metrics, recorder=self.recorder)
+        if self.canWatch(ser):
+            ser.timeout = 0     #Only read what is there, the event loop tells us when that is the case
+            self.loop.add_reader(ser.fileno(), self.readable)
+        else:
+            self.readerThread = Thread(target=self.readLoop, args=(self.transport,), daemon=True)
+            self.readerThread.start()
+
+    # The event loop can only watch file descriptors and not on Windows (neither loop there can do this for serial ports)
+    def canWatch(self, ser):
+        return sys.platform not in ['Windows', 'win32', 'cygwin'] and hasattr(ser, "fileno") and hasattr(self.loop, "add_reader")
+
+    def disconnect(self):
+        if self.ser != None and self.readerThread == None:
+            try:
+                self.loop.remove_reader(self.ser.fileno())
+            except (AttributeError, ValueError, OSError):
+                pass
+        self.readerThread = None
+        if self.ackTimer != None:
+            self.ackTimer.cancel()
+            self.ackTimer = None
+        super().disconnect()
+
+    # Called by the event loop when the serial port has data
+    def readable(self):
+        try:
+            data = self.ser.read(max(1, self.ser.in_waiting))
+        except (SerialException, OSError) as e:
+            self.loop.remove_reader(self.ser.fileno())
+            self.transport.stop(e)
+            return
+        self.transport.received(data)
+
+    # Fallback if the serial port cannot be watched by the event loop: Block on it in a thread and forward the data
+    def readLoop(self, transport):
+        while transport.running:
+            try:
+                data = transport.ser.read(max(1, transport.ser.in_waiting))
+            except (SerialException, OSError, TypeError) as e:
+                transport.stop(e)
+                break
+            if data:
+                self.loop.call_soon_threadsafe(transport.received, data)
+
+    # Lines that arrive together (i.e. a burst of jog dial steps) are collected and handled at once by handleReceived
+    def onLine(self, line):
+        if self.debug:
+            print("Received: " + decodeLine(line))
+        if self.lines != None:
+            self.lines.put_nowait(decodeLine(line))
+            return
+        self.received.append(line)
+        if len(self.received) == 1:
+            self.loop.call_soon(self.handleReceived)
+
+    def handleReceived(self):
+        lines = self.received
+        self.received = []
+        self.handleLines(lines)
+        self.wake()     #A callback might have changed something the main loop has to take care of
+
+    def wake(self):
+        if self.wakeup != None:
+            self.wakeup.set()
+
+    def displayIdle(self):
+        if self.loop != None:
+            self.loop.call_soon_threadsafe(self.wake)
+
+    # Lines are handled as soon as they arrive, so there is nothing left to do here except sending collected key
+    # assignments and reporting errors
+    def poll(self):
+        self.flushKeys()
+        self.transport.check()
+
+    # Returns the next line received from the device or None if there is none within timeout seconds
+    async def read_line(self, timeout):
+        self.transport.check()
+        try:
+            return await asyncio.wait_for(self.lines.get(), timeout)
+        except asyncio.TimeoutError:
+            return None
+
+    def sendToDevice(self, command, priority=None, ack=False, timeout=5):
+        future = super().sendToDevice(command, priority, ack, timeout)
+        if ack:
+            self.watchAcks()
+        return future
+
+    # Acknowledgements are usually resolved when data arrives. This makes sure they also time out if nothing arrives.
+    def watchAcks(self):
+        if self.ackTimer != None or self.transport == None:
+            return
+        def check():
+            self.ackTimer = None
+            if self.transport == None:
+                return
+            deadline = self.transport.expireAcks()
+            if self.transport.pendingAcks:
+                self.ackTimer = self.loop.call_later(max(0.05, deadline - time.time()) if deadline != None else 0.5, check)
+        self.ackTimer = self.loop.call_later(0.5, check)
+
+    async def request_info(self, timeout):
+        print("Requesting device info...")
+        self.lines = asyncio.Queue()
+        try:
+            start = time.time()
+            self.sendToDevice(CommandCode.INFO.value)
+            line = None
+            while line != "Inkkeys":
+                if line != None:
+                    print("Skipping: ", line)
+                line = await self.read_line(timeout - (time.time() - start))
+                if line == None:
+                    return False
+            print("Header found. Waiting for infos...")
+            while True:
+                line = await self.read_line(timeout - (time.time() - start))
+                if line == None:
+                    return False
+                if line == "Done":
+                    break
+                self.parseInfoLine(line)
+            self.printInfo()
+            return True
+        finally:
+            self.lines = None
+
+    async def update_display(self, fullRefresh=False, timeout=5, bufferData=False):
+        return await asyncio.wrap_future(self.updateDisplay(fullRefresh, timeout, bufferData))
+
+    # Send an image and wait until it has been written to the device
+    async def send_image(self, x, y, image):
+        return await asyncio.wrap_future(self.sendImage(x, y, image))
@@ -0,0 +1,198 @@
+from .protocol import *
+from .device import *
+import os
+import json
+import mmap
+import struct
+
+#Declarative modes: Instead of writing a class, a mode can be described in a json file like
+#
+#  {"Blender": {
+#      "title": {"text": "Blender", "inverted": true},
+#      "display": {"1": {"text": "<   Play/Pause   >"}, "2": {"icon": "icons/camera-reels.png"}},
+#      "keys": {"SW1_PRESS": ["KEYBOARD KEY_SPACE PRESS"], "SW1_RELEASE": ["KEYBOARD KEY_SPACE RELEASE"], "SW4_PRESS": []}
+#  }}
+#
+#The display entries take the arguments of sendTextFor or sendIconFor. Keys are names of KeyCode, events are written as
+#"<DeviceCode> <keycode> [<ActionCode> or increment]" or "DELAY <ms>".
+#
+#The definitions are compiled into a bundle: All assignment commands are formatted and all tiles are rendered and packed
+#once, so activating a mode only replays prepared data. The bundle is a single file that is memory mapped:
+#  "INKKEYS" + version byte, length of the index (4 bytes, little endian), index as json, packed tiles
+#The index holds the assignment commands and the position of the tiles for each mode as well as the display geometry,
+#the version of the rendering code (RENDER_VERSION) and the modification times of all files the bundle was made from.
+#ModeBundle.load compiles the bundle again whenever one of them changed.
+#Each bundle is only loaded once per path, so a mode class that takes its mode from a bundle (see ModeBlender in
+#modes.py) gets the bundle the controller already loaded.
+
+BUNDLE_MAGIC = b"INKKEYS\x01"
+BUNDLE_GEOMETRY = (128, 296, 20)    #dispW, dispH and bannerHeight of the inkkeys, used to render tiles without a device
+
+_keycodes = {DeviceCode.KEYBOARD: (KeyboardKeycode,), DeviceCode.CONSUMER: (ConsumerKeycode,), DeviceCode.MOUSE: (MouseKeycode, MouseAxisCode)}
+
+# Turn the text form of an event into what event() returns, i.e. "KEYBOARD KEY_SPACE PRESS" into "k44p"
+def parseEvent(text):
+    parts = text.split()
+    if parts[0] == "DELAY" and len(parts) == 2:
+        return event(DELAY, int(parts[1]))
+    device = DeviceCode[parts[0]]
+    keycode = None
+    for codes in _keycodes[device]:
+        if parts[1] in codes.__members__:
+            keycode = codes[parts[1]]
+    if keycode == None:
+        raise ValueError("Unknown key code " + parts[1] + " in event " + text)
+    if len(parts) == 2:
+        return event(device, keycode)
+    if parts[2].lstrip("-").isdecimal():
+        return event(device, keycode, int(parts[2]))
+    return event(device, keycode, ActionCode[parts[2]])
+
+# List of (function, arguments for sendTextFor or sendIconFor) of a definition, title first
+def displaySpecs(definition):
+    specs = [("title", definition["title"])] if "title" in definition else []
+    return specs + [(int(function) if function.isdecimal() else function, spec) for function, spec in definition.get("display", {}).items()]
+
+# Files a definition depends on, so a changed icon or font leads to a new bundle
+def dependencies(definitions, device):
+    files = {device.font}
+    for definition in definitions.values():
+        for function, spec in displaySpecs(definition):
+            if "icon" in spec:
+                files.add(spec["icon"])
+    return files
+
+# Render and encode everything that is needed to activate the modes in definitions and write it to path
+def compileModes(definitions, path, sources=(), geometry=BUNDLE_GEOMETRY, iconAtlas=None):
+    device = Device()
+    device.debug = False
+    device.iconAtlas = iconAtlas
+    device.dispW, device.dispH, device.bannerHeight = geometry
+    index = {"geometry": list(geometry), "renderer": RENDER_VERSION, "modes": {}}
+    blob = bytearray()
+    for name, definition in definitions.items():
+        keys = []
+        for key, events in definition.get("keys", {}).items():
+            code = KeyCode[key].value
+            keys.append([code, CommandCode.ASSIGN.value + " " + code + "".join(" " + parseEvent(e) for e in events)])
+        tiles = []
+        for function, spec in displaySpecs(definition):
+            if "icon" in spec:
+                x, y, w, h, data = device.iconTileFor(function, **spec)
+            else:
+                x, y, w, h, data = device.textTileFor(function, **spec)
+            tiles.append([x, y, w, h, len(blob), len(data)])
+            blob += data
+        index["modes"][name] = {"keys": keys, "tiles": tiles, "definition": definition}
+    index["sources"] = {source: TileCache.mtime(source) for source in set(sources) | dependencies(definitions, device)}
+    header = json.dumps(index).encode()
+    tmp = path + ".tmp"
+    with open(tmp, "wb") as f:
+        f.write(BUNDLE_MAGIC + struct.pack("<I", len(header)) + header + blob)
+    os.replace(tmp, path)
+
+class ModeBundle:
+    loaded = {}     #Bundles opened by load(), by path
+
+    def __init__(self, path):
+        with open(path, "rb") as f:
+            self.data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if self.data[:len(BUNDLE_MAGIC)] != BUNDLE_MAGIC:
+            self.data.close()
+            raise ValueError(path + " is not a mode bundle.")
+        start = len(BUNDLE_MAGIC) + 4
+        length, = struct.unpack("<I", self.data[len(BUNDLE_MAGIC):start])
+        self.index = json.loads(self.data[start:start+length])
+        self.tiles = memoryview(self.data)[start+length:]
+        self.modes = {}
+
+    # Open the bundle for the definitions in a json file, compiling it first if it is missing or outdated. A bundle
+    # that has been loaded before is returned again as long as it is up to date.
+    @staticmethod
+    def load(definitionsPath, path, iconAtlas=None):
+        bundle = ModeBundle.loaded.pop(path, None)
+        if bundle != None:
+            if not bundle.stale():
+                ModeBundle.loaded[path] = bundle
+                return bundle
+            try:
+                bundle.close()
+            except BufferError:
+                pass            #Modes created from it still use its tiles, so it stays open for them
+        try:
+            bundle = ModeBundle(path)
+            if not bundle.stale():
+                ModeBundle.loaded[path] = bundle
+                return bundle
+            bundle.close()  #The file is replaced, which Windows does not allow while it is mapped
+        except (OSError, ValueError):
+            pass
+        print("Compiling " + definitionsPath + " to " + path + ".")
+        with open(definitionsPath) as f:
+            definitions = json.load(f)
+        compileModes(definitions, path, sources=(definitionsPath,), iconAtlas=iconAtlas)
+        bundle = ModeBundle(path)
+        ModeBundle.loaded[path] = bundle
+        return bundle
+
+    # Only possible as long as no mode of the bundle has been created, their tiles are part of the mapped file
+    def close(self):
+        self.tiles.release()
+        self.data.close()
+        for path, bundle in list(ModeBundle.loaded.items()):
+            if bundle is self:
+                del ModeBundle.loaded[path]
+
+    # Rendered by other code or made from files that have changed since
+    def stale(self):
+        if self.index.get("renderer") != RENDER_VERSION:
+            return True
+        return any(TileCache.mtime(source) != mtime for source, mtime in self.index["sources"].items())
+
+    def names(self):
+        return list(self.index["modes"])
+
+    # The mode with the given name. Always the same instance, so the controller can tell if the mode changes.
+    def mode(self, name):
+        if name not in self.modes:
+            self.modes[name] = BundledMode(self, name)
+        return self.modes[name]
+
+#A mode from a ModeBundle. Activating it sends the prepared assignment commands and tiles as they are.
+class BundledMode:
+
+    def __init__(self, bundle, name):
+        entry = bundle.index["modes"][name]
+        self.name = name
+        self.geometry = tuple(bundle.index["geometry"])
+        self.keys = entry["keys"]
+        self.tiles = [(x, y, w, h, bundle.tiles[offset:offset+length]) for x, y, w, h, offset, length in entry["tiles"]]
+        self.definition = entry["definition"]
+
+    def activate(self, device):
+        for key, command in self.keys:
+            device.assignCommand(key, command)
+        if (device.dispW, device.dispH, device.bannerHeight) == self.geometry:
+            for tile in self.tiles:
+                device.sendPackedImage(*tile)
+        else:   #The tiles do not fit this device, so render them as a regular mode would
+            for function, spec in displaySpecs(self.definition):
+                if "icon" in spec:
+                    device.sendIconFor(function, **spec)
+                else:
+                    device.sendTextFor(function, **spec)
+        device.updateDisplay()
+
+    # Nothing of a bundled mode changes once it has been created, so a copy (see prerender.py) is the mode itself. The
+    # tiles could not be copied anyway, they are views of the memory mapped bundle.
+    def __deepcopy__(self, memo):
+        return self
+
+    def poll(self, device):
+        return False
+
+    def animate(self, device):
+        return device.fadeLeds()
+
+    def deactivate(self, device):
+        pass
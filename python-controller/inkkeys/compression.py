@@ -0,0 +1,72 @@
+import re
+
+#PackBits run-length encoding as used for compressed image data (see CommandCode.DISPLAY_COMPRESSED).
+#Each block starts with a header byte n (as signed char):
+#   0 ... 127:  The next n+1 bytes are copied as they are
+#  -1 ... -127: The next byte is repeated 1-n times
+#  -128:        Ignored
+#Blocks may span rows of the image. The decoder simply stops once it has the expected number of bytes.
+
+MAX_BLOCK = 128
+
+_runs = re.compile(rb"(.)\1{2,}", re.S) #Three or more identical bytes are worth a run
+
+def packbits(data):
+    data = bytes(data)
+    out = bytearray()
+
+    def literal(start, end):
+        while start < end:
+            n = min(MAX_BLOCK, end - start)
+            out.append(n - 1)
+            out.extend(data[start:start+n])
+            start += n
+
+    last = 0
+    for match in _runs.finditer(data):
+        start, end = match.span()
+        literal(last, start)
+        value = data[start]
+        length = end - start
+        while length > 0:
+            n = min(MAX_BLOCK, length)
+            if n == 1:
+                literal(end-1, end)
+            else:
+                out.append(257 - n)  #-(n-1) as unsigned byte
+                out.append(value)
+            length -= n
+        last = end
+    literal(last, len(data))
+    return bytes(out)
+
+# Streaming decoder, fed one byte at a time like the firmware does
+class PackBitsDecoder:
+
+    def __init__(self):
+        self.literal = 0    #Number of literal bytes still to come
+        self.run = 0        #Number of repetitions of the next byte
+
+    # Returns the decoded bytes for this input byte (possibly none)
+    def feed(self, byte):
+        if self.literal > 0:
+            self.literal -= 1
+            return bytes([byte])
+        if self.run > 0:
+            run = self.run
+            self.run = 0
+            return bytes([byte]) * run
+        if byte < 128:
+            self.literal = byte + 1
+        elif byte != 128:
+            self.run = 257 - byte
+        return b""
+
+def unpackbits(data, size=None):
+    decoder = PackBitsDecoder()
+    out = bytearray()
+    for byte in data:
+        out += decoder.feed(byte)
+        if size != None and len(out) >= size:
+            break
+    return bytes(out[:size] if size != None else out)
@@ -1,18 +1,33 @@
 from .protocol import *
+from .tilecache import *
+from .framebuffer import *
+from .glyphs import *
+from .iconatlas import *
+from .transport import *
+from .compression import *
+from .leds import *
+from .animation import *
+from .refresh import *
+from .metrics import *
+from .recorder import *
 import serial
 import time
-import io
-from threading import Lock
-from PIL import Image, ImageDraw, ImageOps, ImageFont
-from serial import SerialException  #Serial functions
+import math
+import queue
+from array import array
+from concurrent.futures import Future
 
-CHUNK_SIZE = 100
+_JOG = KeyCode.JOG.value.encode()
+
+JOG_VELOCITY_TIME = 0.2     #Time constant (seconds) of the jog dial speed in Device.jogVelocity
+JOG_COARSE_SPEED = 30       #Steps per second above which jogSteps switches to coarse steps
+
+RENDER_VERSION = 2          #Increment whenever renderText or renderPackedIcon draw tiles differently, so tiles that were cached or bundled before are rendered again
 
 class Device:
     ser = None
-    inbuffer = ""
-
-    awaitingResponseLock = Lock()
+    transport = None    #Background threads doing the actual serial communication
+    inbound = None      #Lines received from the device, waiting to be handled in the main thread
 
     testmode = False
     nLeds = 0
@@ -20,210 +35,439 @@ class Device:
     dispH = 0
     rotFactor = 0
     rotCircleSteps = 0
+    compressImages = True   #Send PackBits compressed image data if the device supports it and it is smaller
 
     bannerHeight = 20 #Defines the height of top and bottom banner
 
-    imageBuffer = []
+    font = "font/Munro.ttf" #Font used by sendTextFor
+    fontSize = 10
+    iconAtlas = None        #IconAtlas with the icons already rotated and packed, None = decode the PNG of every icon
+
+    imageBuffer = None      #ImageBuffer with the image data sent since the last buffered refresh, see updateDisplay
 
-    callbacks = {} #This object stores callback functions that react directly to a keypress reported via serial
+    refresher = None        #RefreshScheduler collecting images and refreshes, see refresh.py
+    refreshDelay = None     #Seconds to wait for more images and refresh requests before refreshing, None to send everything right away
+    refreshMaxDelay = 0.5   #...but refresh at the latest this many seconds after the first request
+    fullRefreshAfter = FULL_REFRESH_AFTER   #Partial refreshes before the next one is a full refresh, None to never do this on our own
+    partialRefreshes = 0    #Partial refreshes since the last full refresh or reset
+
+    shadow = None           #Framebuffer with the current content of the display memory, None if unknown (i.e. right after connecting)
+
+    recorder = None         #Recorder of all serial traffic, see record()
+
+    jogVelocity = 0.0       #Recent speed of the jog dial in steps per second, decaying with JOG_VELOCITY_TIME
+    jogTime = 0             #Time of the last jog dial step
 
     ledState = None         #Current LED status, so we can animate them over time
     ledTime = None          #Last time LEDs were set
+    ledFrame = None         #Last LED frame sent to the device, None if unknown (i.e. while a firmware animation runs)
+    player = None           #AnimationPlayer for animations started with playAnimation
 
     debug = True;
 
     status = False
 
-    def connect(self, dev):
+    def __init__(self, tileCache=None, metrics=None):
+        self.capabilities = set()   #Optional features of the firmware as reported by the info command
+        self.keymap = {}            #Assignment command the device has for each key, as far as we know
+        self.pendingKeys = {}       #Assignments that differ from the keymap and have not been sent yet
+        self.fonts = {}             #GlyphAtlas of each font by (path, size, modification time), so it is only rasterized once
+        self.callbacks = {}         #This object stores callback functions that react directly to a keypress reported via serial, keyed by the line as bytes
+        self.tileCache = tileCache if tileCache != None else TileCache()   #Packed tiles rendered by sendIconFor and sendTextFor
+        self.metrics = metrics if metrics != None else Metrics()          #Serial traffic and acknowledgement times, see metrics.py
+
+    # info are the lines of the info if they have been received already (see probePort), otherwise they are requested
+    def connect(self, dev, info=None):
         print("Connecting to ", dev, ".")
-        self.ser = serial.Serial(dev, 115200, timeout=1, write_timeout=5)
-        if not self.requestInfo(3):
+        self.attach(serial.Serial(dev, 115200, timeout=1, write_timeout=5))
+        if info != None:
+            self.parseInfo(info)
+        elif not self.requestInfo(3):
             self.disconnect()
             return False
         if self.testmode:
             print("Connection to ", self.ser.name, " was successfull, but the device is running the hardware test firmware, which cannot be used for anything but testing. Please flash the proper inkkeys firmware to use it.")
+            self.disconnect()
             return False
         print("Connected to ", self.ser.name, ".")
         return True
 
+    # Start communicating through an open serial port (or anything that behaves like one)
+    def attach(self, ser):
+        self.ser = ser
+        self.reset()
+        self.inbound = queue.Queue()
+        self.transport = Transport(ser, self.inbound.put, self.debug, metrics=self.metrics, recorder=self.recorder)
+
+    # Forget everything we assumed about the state of the device
+    def reset(self):
+        self.shadow = None
+        self.imageBuffer = None
+        if self.refresher != None:
+            self.refresher.cancel()
+        self.refresher = RefreshScheduler(self)
+        self.partialRefreshes = 0
+        self.capabilities = set()
+        self.keymap = {}    #The device might have anything assigned, so send everything once
+        self.pendingKeys = {}
+        self.ledFrame = None
+        self.player = AnimationPlayer(self)
+
+    # Record all serial traffic to a file from now on, also across reconnects. replay.py can play it back.
+    def record(self, path):
+        self.stopRecording()
+        self.recorder = Recorder(path)
+        if self.transport != None:
+            self.transport.recorder = self.recorder
+
+    def stopRecording(self):
+        if self.recorder != None:
+            self.recorder.close()
+            self.recorder = None
+        if self.transport != None:
+            self.transport.recorder = None
+
     def disconnect(self):
+        if self.recorder != None:
+            self.recorder.flush()
+        if self.transport != None:
+            self.transport.close()
+            self.transport = None
         if self.ser != None:
             self.ser.close()
             self.ser = None
 
-    def sendToDevice(self, command):
+    def sendToDevice(self, command, priority=None, ack=False, timeout=5):
+        self.flushKeys()    #Keep the order of commands
         if self.debug:
             print("Sending: " + command)
-        self.ser.write((command + "\n").encode())
+        if priority == None:
+            priority = PRIORITY_DISPLAY if command[:1] in (CommandCode.DISPLAY.value, CommandCode.REFRESH.value) else PRIORITY_CONTROL
+        label = command if command[:1] == CommandCode.REFRESH.value else command[:1]    #Refreshes are told apart by their type
+        return self.transport.send((command + "\n").encode(), priority, ack, timeout, label)
 
     def sendBinaryToDevice(self, data):
         if self.debug:
             print("Sending " + str(len(data)) + " bytes of binary data.")
+        self.transport.send(data, PRIORITY_DISPLAY, command="binary")
+
+    # Send the "D" command together with its image data, so nothing can be sent in between
+    # If the device supports it, the data is compressed whenever this makes it smaller
+    def sendImageToDevice(self, x, y, w, h, data):
+        code = CommandCode.DISPLAY.value
+        if self.compressImages and CapabilityCode.RLE.value in self.capabilities:
+            compressed = packbits(data)
+            if len(compressed) < len(data):
+                code = CommandCode.DISPLAY_COMPRESSED.value
+                data = compressed
+        command = code + " " + str(x) + " " + str(y) + " " + str(w) + " " + str(h)
+        if self.debug:
+            print("Sending: " + command)
+            print("Sending " + str(len(data)) + " bytes of binary data.")
+        return self.transport.send([(command + "\n").encode(), data], PRIORITY_DISPLAY, command=code)
+
+    # Returns the next line received from the device or None if there is none within timeout seconds
+    def readFromDevice(self, timeout=0):
+        line = self.readRawFromDevice(timeout)
+        return decodeLine(line) if line != None else None
+
+    # Same as readFromDevice, but the line is returned as bytes
+    def readRawFromDevice(self, timeout=0):
+        self.transport.check()
         try:
-            # Send binary data in chunks to prevent killing the serial connection
-            endIx = CHUNK_SIZE
-            startIx = 0
-            while (startIx < len(data)):
-                self.ser.write(data[startIx:endIx])
-                #if self.debug:
-                #    print(data[startIx:endIx].hex())
-                startIx = startIx + CHUNK_SIZE
-                endIx = endIx + CHUNK_SIZE
-            if self.debug:
-                print("Data sent.")
-        except SerialException as e:
-            print("Serial error: ", e)
-
-    def readFromDevice(self):
-        if self.ser.in_waiting > 0:
-            self.inbuffer += self.ser.read(self.ser.in_waiting).decode("ISO-8859-16").replace("\r", "")
-        chunks = self.inbuffer.split("\n", 1)
-        if len(chunks) > 1:
-            cmd = chunks[0]
-            self.inbuffer = chunks[1]
-            if self.debug:
-                print("Received: " + cmd)
-            return cmd
-        return None
+            line = self.inbound.get(timeout=timeout) if timeout > 0 else self.inbound.get_nowait()
+        except queue.Empty:
+            return None
+        if self.debug:
+            print("Received: " + decodeLine(line))
+        return line
 
+    # Handle everything that has been received since the last call
     def poll(self):
-        with self.awaitingResponseLock:
-            input = self.readFromDevice()
-        if input != None:
-            if input[0] == KeyCode.JOG.value and (input[1:].isdecimal() or (input[1] == '-' and input[2:].isdecimal())):
-                if KeyCode.JOG.value in self.callbacks:
-                    self.callbacks[KeyCode.JOG.value](int(input[1:]))
-            elif input in self.callbacks:
-                self.callbacks[input]()
+        self.flushKeys()
+        lines = []
+        line = self.readRawFromDevice()
+        while line != None:
+            lines.append(line)
+            line = self.readRawFromDevice()
+        self.handleLines(lines)
+
+    # Handle received lines in order. Consecutive jog dial steps are added up and reported with a single callback, so
+    # turning the dial quickly does not queue up more work than turning it slowly.
+    def handleLines(self, lines):
+        steps = 0
+        for line in lines:
+            jog = self.parseJog(line)
+            if jog != None:
+                steps += jog
+                continue
+            if steps != 0:
+                self.handleJog(steps)
+                steps = 0
+            self.handleInput(line)
+        if steps != 0:
+            self.handleJog(steps)
+
+    # Call the callback associated with a line (as bytes) received from the device. Key presses are a single lookup and
+    # jog dial steps ("R<n>") are parsed without decoding the line.
+    def handleInput(self, line):
+        if not line:
+            return
+        callback = self.callbacks.get(line)
+        if callback != None:
+            callback()
+            return
+        jog = self.parseJog(line)
+        if jog != None:
+            self.handleJog(jog)
+
+    # Steps reported by a jog dial line or None if the line is something else
+    def parseJog(self, line):
+        if line[:1] == _JOG and (line[2:] if line[1:2] == b"-" else line[1:]).isdigit():
+            return int(line[1:])
+        return None
+
+    def handleJog(self, steps):
+        now = time.time()
+        self.jogVelocity = self.jogVelocity*math.exp(-(now - self.jogTime)/JOG_VELOCITY_TIME) + abs(steps)/JOG_VELOCITY_TIME
+        self.jogTime = now
+        if _JOG in self.callbacks:
+            self.callbacks[_JOG](steps)
+
+    # Scale steps of the jog dial depending on how fast it is turned, for use in a jog dial callback. Below speed (steps
+    # per second) every step counts as fine, above it as coarse, i.e. to scroll through a long list quickly.
+    def jogSteps(self, steps, fine=1, coarse=10, speed=JOG_COARSE_SPEED):
+        return steps*(coarse if self.jogVelocity >= speed else fine)
 
     def registerCallback(self, cb, key):
-        self.callbacks[key.value] = cb
+        self.callbacks[key.value.encode()] = cb
 
     def clearCallback(self, key):
-        if key.value in self.callbacks:
-            del self.callbacks[key.value]
+        self.callbacks.pop(key.value.encode(), None)
 
     def clearCallbacks(self):
         self.callbacks = {}
 
+    # Assignments are collected and only those that differ from what the device already has are sent (see flushKeys)
     def assignKey(self, key, sequence):
-        self.sendToDevice(CommandCode.ASSIGN.value + " " + key.value + (" " + " ".join(sequence) if len(sequence) > 0 else ""))
+        self.assignCommand(key.value, CommandCode.ASSIGN.value + " " + key.value + (" " + " ".join(sequence) if len(sequence) > 0 else ""))
+
+    # Same as assignKey with a complete assignment command, i.e. assignCommand("2p", "A 2p k224p k30")
+    def assignCommand(self, key, command):
+        if self.keymap.get(key) == command:
+            self.pendingKeys.pop(key, None)   #Might have been changed and changed back before being sent
+        else:
+            self.pendingKeys[key] = command
+
+    # Send all changed assignments in a single write. This happens automatically with the next command or poll.
+    def flushKeys(self):
+        if not self.pendingKeys or self.transport == None:
+            return None
+        commands = list(self.pendingKeys.values())
+        self.keymap.update(self.pendingKeys)
+        self.pendingKeys = {}
+        if self.debug:
+            for command in commands:
+                print("Sending: " + command)
+        return self.transport.send("".join(command + "\n" for command in commands).encode(), PRIORITY_CONTROL, command=CommandCode.ASSIGN.value)
 
     def sendLed(self, colors):
-        self.sendToDevice(CommandCode.LED.value + " " + " ".join(colors))
+        self.sendLedFrame(ledFrame(int(color, 16) for color in colors))
+
+    # Send a frame (see leds.py) unless the LEDs already show it. If the device supports it and it is shorter, only the
+    # LEDs that changed are sent.
+    def sendLedFrame(self, frame):
+        if frame == self.ledFrame:
+            return None
+        previous = self.ledFrame
+        self.ledFrame = frame
+        if previous != None and len(previous) == len(frame) and CapabilityCode.LED_PIXELS.value in self.capabilities:
+            changed = changedLeds(previous, frame)
+            colors = encodeFrame(array("I", (frame[i] for i in changed))).split(" ")
+            command = CommandCode.LED_PIXELS.value + "".join(f" {i} {color}" for i, color in zip(changed, colors))
+            if len(command) < 2 + 7*len(frame):
+                return self.sendToDevice(command)
+        return self.sendToDevice(CommandCode.LED.value + " " + encodeFrame(frame))
+
+    # Play an animation (see animation.py), running as much of it as possible on the device itself
+    def playAnimation(self, animation):
+        return self.player.play(animation)
+
+    def stopAnimation(self):
+        self.player.stop()
+
+    # Keep the current animation going. Returns the seconds until this needs to be called again, None if nothing is playing.
+    def updateAnimation(self):
+        return self.player.update() if self.player != None else None
 
     def sendLedAnimation(self, animation, steps, delay=0, brightness=0, r=0, g=0, b=0, iteration=1):
+        self.ledFrame = None    #The animation changes the LEDs on its own
         self.sendToDevice(f"{CommandCode.ANIMATE.value} {animation} {steps} {delay} {brightness} {r} {g} {b} {iteration}")
 
     def requestInfo(self, timeout):
-        with self.awaitingResponseLock:
-            print("Requesting device info...")
-            start = time.time()
-            self.sendToDevice(CommandCode.INFO.value)
-            line = self.readFromDevice()
-            while line != "Inkkeys":
-                if time.time() - start > timeout:
-                    return False
-                if line == None:
-                    time.sleep(0.1)
-                    line = self.readFromDevice()
-                    continue
-                print("Skipping: ", line)
-                line = self.readFromDevice()
-            print("Header found. Waiting for infos...")
-            line = self.readFromDevice()
-            while line != "Done":
-                if time.time() - start > timeout:
-                    return False
-                if line == None:
-                    time.sleep(0.1)
-                    line = self.readFromDevice()
-                    continue
-                if line.startswith("TEST "):
-                    self.testmode = line[5] != "0"
-                elif line.startswith("N_LED "):
-                    self.nLeds = int(line[6:])
-                elif line.startswith("DISP_W "):
-                    self.dispW = int(line[7:])
-                elif line.startswith("DISP_H "):
-                    self.dispH = int(line[7:])
-                elif line.startswith("ROT_CIRCLE_STEPS "):
-                    self.rotCircleSteps = int(line[17:])
-                else:
-                    print("Skipping: ", line)
-                line = self.readFromDevice()
-            print("End of info received.")
-            print("Testmode: ", self.testmode)
-            print("Number of LEDs: ", self.nLeds)
-            print("Display width: ", self.dispW)
-            print("Display height: ", self.dispH)
-            print("Rotation circle steps: ", self.rotCircleSteps)
-            return True
+        print("Requesting device info...")
+        start = time.time()
+        self.sendToDevice(CommandCode.INFO.value)
+        line = self.readFromDevice(0.1)
+        while line != "Inkkeys":
+            if time.time() - start > timeout:
+                return False
+            if line == None:
+                line = self.readFromDevice(0.1)
+                continue
+            print("Skipping: ", line)
+            line = self.readFromDevice(0.1)
+        print("Header found. Waiting for infos...")
+        line = self.readFromDevice(0.1)
+        while line != "Done":
+            if time.time() - start > timeout:
+                return False
+            if line == None:
+                line = self.readFromDevice(0.1)
+                continue
+            self.parseInfoLine(line)
+            line = self.readFromDevice(0.1)
+        self.printInfo()
+        return True
+
+    # Store the info from lines that have been received before, without asking the device again
+    def parseInfo(self, lines):
+        for line in lines:
+            self.parseInfoLine(line)
+        self.printInfo()
+
+    # Store a line of the answer to the info command
+    def parseInfoLine(self, line):
+        if line.startswith("TEST "):
+            self.testmode = line[5] != "0"
+        elif line.startswith("N_LED "):
+            self.nLeds = int(line[6:])
+        elif line.startswith("DISP_W "):
+            self.dispW = int(line[7:])
+        elif line.startswith("DISP_H "):
+            self.dispH = int(line[7:])
+        elif line.startswith("ROT_CIRCLE_STEPS "):
+            self.rotCircleSteps = int(line[17:])
+        elif line.startswith("CAPS "):
+            self.capabilities = set(line[5:].split())
+        else:
+            print("Skipping: ", line)
+
+    def printInfo(self):
+        print("End of info received.")
+        print("Testmode: ", self.testmode)
+        print("Number of LEDs: ", self.nLeds)
+        print("Display width: ", self.dispW)
+        print("Display height: ", self.dispH)
+        print("Rotation circle steps: ", self.rotCircleSteps)
+        print("Capabilities: ", " ".join(sorted(self.capabilities)) or "none")
+
+    # Convert an image to the packed 1-bit payload expected by the "D" command
+    def packImage(self, image):
+        return image.convert("1").rotate(180).tobytes()
 
     # Send the image to the controller
     def sendImage(self, x, y, image):
+        w, h = image.size
+        return self.sendPackedImage(x, y, w, h, self.packImage(image))
+
+    # Send an already packed image to the controller. Returns a future that resolves once the data has been written.
+    # With a refreshDelay, the image is only sent with the next refresh (see refresh.py).
+    def sendPackedImage(self, x, y, w, h, data):
+        if self.refreshDelay != None and self.refresher != None:
+            return self.refresher.image(x, y, w, h, data)
+        return self.writePackedImage(x, y, w, h, data)
+
+    # Write packed image data to the device right away.
+    # Only the part that differs from the current display content is sent. If nothing differs, nothing is sent at all.
+    def writePackedImage(self, x, y, w, h, data):
         if self.debug:
             print(f"sendImage({x}, {y})")
-        self.imageBuffer.append({"x": x, "y": y, "image": image.copy()})
-        w, h = image.size
-        data = image.convert("1").rotate(180).tobytes()
-        self.sendToDevice(CommandCode.DISPLAY.value + " " + str(x) + " " + str(y) + " " + str(w) + " " + str(h))
-        self.sendBinaryToDevice(data)
-        return True
-
-    # Resends all of the images from the buffer to the controller so they can be buffered in the display.
+        if self.shadow != None:
+            region = self.shadow.diff(x, y, w, h, data)
+            if region == None:
+                if self.debug:
+                    print("Image unchanged, skipping.")
+                done = Future()
+                done.set_result(True)
+                return done
+            self.shadow.blit(x, y, w, h, data)
+            r0, r1, c0, c1 = region
+            rb = rowBytes(w)
+            if (r0, r1, c0, c1) != (0, h-1, 0, rb-1):
+                data = cropPacked(data, rb, r0, r1, c0, c1)
+                x = (x//8 + c0)*8
+                y = y + r0
+                w = (c1-c0+1)*8
+                h = r1-r0+1
+                if self.debug:
+                    print(f"Only sending changed area {x}/{y} {w}x{h}")
+        if self.imageBuffer == None and self.dispW > 0 and self.dispH > 0:
+            self.imageBuffer = ImageBuffer(self.dispW, self.dispH)
+        if self.imageBuffer != None:
+            self.imageBuffer.blit(x, y, w, h, data)
+        return self.sendImageToDevice(x, y, w, h, data)
+
+    # Resends all of the image data from the buffer to the controller so it can be buffered in the display.
+    # Only the rows written since the last time are sent, each run of rows with the same width as one image.
     def resendImageData(self):
         if self.debug:
             print("resendImageData()")
-        for part in self.imageBuffer:
-            image = part["image"]
-            x = part["x"]
-            y = part["y"]
-            w, h = image.size
-            data = image.convert("1").rotate(180).tobytes()
-            self.sendToDevice(CommandCode.DISPLAY.value + " " + str(x) + " " + str(y) + " " + str(w) + " " + str(h))
-            self.sendBinaryToDevice(data)
-        self.imageBuffer = []
-
-    # Blanks out the display
-    def resetDisplay(self):
-        self.sendToDevice(CommandCode.REFRESH.value + " " + RefreshTypeCode.RESET.value)
+        if self.imageBuffer == None:
+            return
+        for x, y, w, h, data in self.imageBuffer.regions():
+            self.sendImageToDevice(x, y, w, h, data)
+        self.imageBuffer.clear()
+
+    # Blanks out the display. Returns a future that resolves to True once the device confirmed it.
+    # With a refreshDelay and a known display content, the display is drawn white and refreshed with the next refresh
+    # instead, which is a lot faster than the reset of the firmware.
+    def resetDisplay(self, timeout=5):
+        if self.refresher != None:
+            if self.refreshDelay != None and self.shadow != None:
+                return self.refresher.clear(timeout)
+            self.refresher.discard()    #Images drawn so far would be blanked out anyway
+        if self.dispW > 0 and self.dispH > 0:
+            self.shadow = Framebuffer(self.dispW, self.dispH) #The display is cleared to white
+        self.partialRefreshes = 0
+        return self.sendToDevice(CommandCode.REFRESH.value + " " + RefreshTypeCode.RESET.value, ack=True, timeout=timeout)
 
     # Render the images on the display
+    # This does not wait for the display. It returns a future that resolves to True when the device reports that the
+    # refresh is done or to False if this does not happen within the timeout.
+    # With a refreshDelay, the refresh happens once it is due (see refresh.py). Buffering the data is not delayed.
     def updateDisplay(self, fullRefresh=False, timeout=5, bufferData=False):
-        with self.awaitingResponseLock:
-            if self.debug:
-                print(f"updateDisplay(fullRefresh={fullRefresh}, timeout={timeout})")
-            # Send the refresh command and wait for "ok" response until the timeout is up.
-            start = time.time()
-            self.sendToDevice(CommandCode.REFRESH.value + " " + (RefreshTypeCode.FULL.value if fullRefresh else RefreshTypeCode.PARTIAL.value))
-            line = self.readFromDevice()
-            while line != "ok":
-                if time.time() - start > timeout:
-                    if self.debug:
-                        print("Timed out...")
-                    return False
-                if line == None:
-                    time.sleep(0.1)
-                    line = self.readFromDevice()
-                    continue
-                line = self.readFromDevice()
-            # Resend all of the image data from the buffer to buffer in the display
-            if bufferData:
-                self.resendImageData()
-                self.sendToDevice(CommandCode.REFRESH.value + " " + RefreshTypeCode.OFF.value)
-                start = time.time()
-                line = self.readFromDevice()
-                while line != "ok":
-                    if time.time() - start > timeout:
-                        if self.debug:
-                            print("Timed out...")
-                        return False
-                    if line == None:
-                        time.sleep(0.1)
-                        line = self.readFromDevice()
-                        continue
-                    line = self.readFromDevice()
+        if self.refresher != None:
+            if self.refreshDelay != None and not bufferData:
+                return self.refresher.request(fullRefresh, timeout)
+            self.refresher.writeImages()
+        return self.refreshDisplay(fullRefresh, timeout, bufferData)
+
+    # Keep the refreshes going. Returns the seconds until this needs to be called again, None if nothing is waiting for time to pass.
+    def updateRefresh(self):
+        return self.refresher.update() if self.refresher != None else None
+
+    # Called when the device finished a refresh of the refresh scheduler, so whatever was collected in the meantime can be sent
+    def displayIdle(self):
+        pass
+
+    # Refresh the display right away. Every fullRefreshAfter partial refreshes, a full refresh is done instead.
+    def refreshDisplay(self, fullRefresh=False, timeout=5, bufferData=False):
+        if not fullRefresh and self.fullRefreshAfter != None and self.partialRefreshes >= self.fullRefreshAfter:
+            fullRefresh = True
+        self.partialRefreshes = 0 if fullRefresh else self.partialRefreshes + 1
+        if self.debug:
+            print(f"updateDisplay(fullRefresh={fullRefresh}, timeout={timeout})")
+        refreshed = self.sendToDevice(CommandCode.REFRESH.value + " " + (RefreshTypeCode.FULL.value if fullRefresh else RefreshTypeCode.PARTIAL.value), ack=True, timeout=timeout)
+        if not bufferData:
+            return refreshed
+        # Resend all of the image data from the buffer to buffer in the display
+        # The device handles commands in order, so this can be queued right away. It is received after the refresh is done.
+        self.resendImageData()
+        poweredOff = self.sendToDevice(CommandCode.REFRESH.value + " " + RefreshTypeCode.OFF.value, ack=True, timeout=timeout)
+        done = Future()
+        poweredOff.add_done_callback(lambda f: done.set_result(refreshed.done() and refreshed.result() and f.result()))
+        return done
 
     # Get the area for the image that is being sent.
     def getAreaFor(self, function):
@@ -256,33 +500,94 @@ class Device:
             image = image.resize((w, h))
         self.sendImage(x, y, image)
 
+    # Load and rasterize a font only once (and again when the file changes)
+    def getFont(self, path, size):
+        key = (path, size, self.tileCache.mtime(path))
+        font = self.fonts.get(key)
+        if font == None:
+            font = GlyphAtlas(path, size)
+            self.fonts[key] = font
+        return font
+
+    # Packed tile for a function from the cache or rendered, packed and cached first. Returns (x, y, w, h, data).
+    # With packed=True, render returns the packed data instead of an image.
+    def cachedTileFor(self, function, key, render, packed=False):
+        x, y, w, h = self.getAreaFor(function)
+        data = self.tileCache.get(key)
+        if data == None:
+            if packed:
+                data = render(w, h)
+            else:
+                image = render(w, h)
+                if (w, h) != image.size:
+                    image = image.resize((w, h))
+                data = self.packImage(image)
+            self.tileCache.put(key, data)
+        return x, y, w, h, data
+
+    def sendCachedFor(self, function, key, render):
+        self.sendPackedImage(*self.cachedTileFor(function, key, render))
+
     # Generate an image with text
     # TODO: Re-impliment text in place of icons. Currently only supports title
     def sendTextFor(self, function, text, subtext="", inverted=False):
         if self.debug:
             print(f"sendTextFor({function}, {text}, subtext={subtext}, inverted={inverted})")
-        x, y, w, h = self.getAreaFor(function)
-        font = ImageFont.truetype("font/Munro.ttf", 10)
-        fW, fH = font.getsize(text);
-        img = Image.new("1", (h, w), color=(0 if inverted else 1))
-        ImageDraw.Draw(img).text((h//2,(w-fH)//2), text, anchor="mt", font=font, fill=(1 if inverted else 0)) #Center the text on image
-        self.sendImageFor(function, img.rotate(270, expand=1))
+        self.sendPackedImage(*self.textTileFor(function, text, subtext, inverted))
+
+    def textTileFor(self, function, text, subtext="", inverted=False):
+        key = self.textTileKey(function, text, subtext, inverted)
+        return self.cachedTileFor(function, key, lambda w, h: self.renderText(w, h, text, subtext, inverted), packed=True)
+
+    def textTileKey(self, function, text, subtext="", inverted=False):
+        return self.tileCache.key("text", RENDER_VERSION, text, subtext, self.font, self.tileCache.mtime(self.font), self.fontSize, function, inverted, self.dispW, self.dispH, self.bannerHeight)
+
+    #PIL is imported by the render functions when a tile is not cached, so starting up with cached tiles does not need it
+    #Text is put together from the glyphs of the font and is already packed (see glyphs.py)
+    def renderText(self, w, h, text, subtext="", inverted=False):
+        return self.getFont(self.font, self.fontSize).renderPacked(w, h, text, inverted)
 
     # Generate and send the icon to the controller
     # TODO: Re-impliment marked/crossed overlays
     def sendIconFor(self, function, icon, inverted=False, centered=True, marked=False, crossed=False):
         if self.debug:
             print(f"sendIconFor({icon}, inverted={inverted}, centered={centered}, marked={marked}, crossed={crossed})")
-        x, y, w, h = self.getAreaFor(function)
+        self.sendPackedImage(*self.iconTileFor(function, icon, inverted, centered, marked, crossed))
+
+    def iconTileFor(self, function, icon, inverted=False, centered=True, marked=False, crossed=False):
+        key = self.iconTileKey(function, icon, inverted, centered, marked, crossed)
+        return self.cachedTileFor(function, key, lambda w, h: self.renderPackedIcon(w, h, function, icon, inverted, centered, marked, crossed), packed=True)
+
+    def iconTileKey(self, function, icon, inverted=False, centered=True, marked=False, crossed=False):
+        return self.tileCache.key("icon", RENDER_VERSION, icon, self.tileCache.mtime(icon), function, inverted, centered, marked, crossed, self.dispW, self.dispH, self.bannerHeight)
+
+    # Icons from the icon atlas are put into the packed tile as they are, others are drawn and packed with PIL
+    def renderPackedIcon(self, w, h, function, icon, inverted=False, centered=True, marked=False, crossed=False):
+        if self.iconAtlas != None:
+            mtime = self.tileCache.mtime(icon)
+            found = self.iconAtlas.icon(icon, mtime)
+            if found != None:
+                x, y = self.iconPosition(w, h, function, found[0], found[1])
+                return self.iconAtlas.renderPacked(w, h, icon, mtime, x, y, inverted)
+        image = self.renderIcon(w, h, function, icon, inverted, centered, marked, crossed)
+        if (w, h) != image.size:
+            image = image.resize((w, h))
+        return self.packImage(image)
+
+    # Position of the rotated icon with wi x hi pixels on the tile
+    def iconPosition(self, w, h, function, wi, hi):
+        if function < 6:
+            return (0, (h - wi)//2)
+        return ((w - hi), (h - wi)//2)
+
+    def renderIcon(self, w, h, function, icon, inverted=False, centered=True, marked=False, crossed=False):
+        from PIL import Image, ImageOps
         img = Image.new("1", (w, h), color=(0 if inverted else 1))
         imgIcon = Image.open(icon).convert("RGB").rotate(270, expand=True)
         if inverted:
             imgIcon = ImageOps.invert(imgIcon)
         wi, hi = imgIcon.size
-        if function < 6:
-            pos = (0, (h - wi)//2)
-        else:
-            pos = ((w - hi), (h - wi)//2)
+        pos = self.iconPosition(w, h, function, wi, hi)
         img.paste(imgIcon, pos)
 
         #if marked:
@@ -295,28 +600,27 @@ class Device:
         #    d.line([pos[0]+5, pos[1]+5, pos[0]+wi-5, pos[1]+hi-5], width=3)
         #    d.line([pos[0]+5, pos[1]+hi-5, pos[0]+wi-5, pos[1]+5], width=3)
 
-        self.sendImage(x, y, img)
+        return img
 
     # Set LEDs to a color.
     def setLeds(self, leds):
-        ledStr = ['{:06x}'.format(i) for i in leds]
         self.ledTime = time.time()
-        self.ledState = leds
-        self.sendLed(ledStr)
+        self.ledState = ledFrame(leds)
+        self.sendLedFrame(self.ledState)
 
+    # Fade out LEDs set with setLeds. Returns the seconds until this needs to be called again or False if there is nothing to fade.
     def fadeLeds(self):
         if self.ledState == None:
-            return
+            return False
         p = (3.5 - (time.time() - self.ledTime))/0.5 #Stay on for 3 seconds and then fade out over 0.5 seconds
         if p >= 1:
-            return
+            return self.ledTime + 3.0 - time.time()
         if p <= 0:
             self.ledState = None
-            self.sendLed(["000000" for i in range(self.nLeds)])
-            return
-        dimmedLeds = [(int((i & 0xff0000) * p) & 0xff0000) | (int((i & 0xff00) * p) & 0xff00) | (int((i & 0xff) * p) & 0xff) for i in self.ledState]
-        ledStr = ['{:06x}'.format(i) for i in dimmedLeds]
-        self.sendLed(ledStr)
+            self.sendLedFrame(ledFrame([0] * self.nLeds))
+            return False
+        self.sendLedFrame(dimFrame(self.ledState, p))
+        return FRAME_TIME
     
     def setStatus(self, status):
         self.status = status
@@ -0,0 +1,122 @@
+from array import array
+
+#Packed 1-bit copy of the display memory, laid out like the data of the "D" command: One row after another, each row
+#padded to full bytes, a set bit is white. The firmware (GxEPD2) aligns the x position of each image down to a multiple
+#of 8 and clips anything outside of the display, so we do exactly the same here to keep track of what the display shows.
+
+WHITE = 0xff
+
+# Number of bytes for a row with w pixels
+def rowBytes(w):
+    return (w + 7)//8
+
+# Cut the rows r0 to r1 and the bytes c0 to c1 (all inclusive) out of packed data with rb bytes per row
+def cropPacked(data, rb, r0, r1, c0, c1):
+    if c0 == 0 and c1 == rb-1:
+        return bytes(data[r0*rb:(r1+1)*rb])
+    mv = memoryview(data)
+    return b"".join(mv[r*rb+c0:r*rb+c1+1] for r in range(r0, r1+1))
+
+class Framebuffer:
+
+    def __init__(self, width, height, fill=WHITE):
+        self.width = width
+        self.height = height
+        self.stride = rowBytes(width)
+        self.data = bytearray([fill]) * (self.stride * height)
+
+    def fill(self, value=WHITE):
+        self.data[:] = bytes([value]) * len(self.data)
+
+    # Visible part of an image at x/y with w/h pixels. Returns the number of rows and bytes per row that actually end up on the display
+    def visible(self, x, y, w, h):
+        return max(0, min(h, self.height - y)), max(0, min(rowBytes(w), self.stride - x//8))
+
+    # Compare packed image data to the framebuffer. Returns None if nothing changes or the changed rows and bytes as
+    # tuple (firstRow, lastRow, firstByte, lastByte) relative to the image if anything needs to be sent.
+    def diff(self, x, y, w, h, data):
+        rb = rowBytes(w)
+        rows, cols = self.visible(x, y, w, h)
+        mv = memoryview(data)
+        fb = memoryview(self.data)
+        bx = x//8
+        r0 = None
+        r1 = None
+        c0 = cols
+        c1 = -1
+        for r in range(rows):
+            new = mv[r*rb:r*rb+cols]
+            offset = (y+r)*self.stride+bx
+            old = fb[offset:offset+cols]
+            if new == old:
+                continue
+            if r0 == None:
+                r0 = r
+            r1 = r
+            if c0 == 0 and c1 == cols-1:
+                continue    #Already spanning the full width, no need to check columns
+            for c in range(cols):
+                if new[c] != old[c]:
+                    c0 = min(c0, c)
+                    break
+            for c in range(cols-1, -1, -1):
+                if new[c] != old[c]:
+                    c1 = max(c1, c)
+                    break
+        if r0 == None:
+            return None
+        return (r0, r1, c0, c1)
+
+    # Copy packed image data into the framebuffer
+    def blit(self, x, y, w, h, data):
+        rb = rowBytes(w)
+        rows, cols = self.visible(x, y, w, h)
+        mv = memoryview(data)
+        bx = x//8
+        for r in range(rows):
+            offset = (y+r)*self.stride+bx
+            self.data[offset:offset+cols] = mv[r*rb:r*rb+cols]
+
+#Framebuffer that also remembers which part of each row was written since the last clear(), used by
+#Device.updateDisplay(bufferData=True) to send everything again after a refresh. Memory use is fixed no matter how many
+#images are written: The packed display content plus the first and last written byte of each row.
+class ImageBuffer(Framebuffer):
+
+    def __init__(self, width, height, fill=WHITE):
+        super().__init__(width, height, fill)
+        self.first = array("H", [self.stride]) * height    #First written byte of each row, stride if nothing was written
+        self.last = array("H", [0]) * height
+
+    def blit(self, x, y, w, h, data):
+        super().blit(x, y, w, h, data)
+        rows, cols = self.visible(x, y, w, h)
+        if cols == 0:
+            return
+        bx = x//8
+        for r in range(y, y+rows):
+            self.first[r] = min(self.first[r], bx)
+            self.last[r] = max(self.last[r], bx+cols-1)
+
+    def clear(self):
+        self.first[:] = array("H", [self.stride]) * self.height
+        self.last[:] = array("H", [0]) * self.height
+
+    # Written parts as (x, y, w, h, data) with consecutive rows of the same span in one region. Regions of full rows
+    # are a memoryview of the buffer without a copy, so they show whatever is in the buffer when they are sent.
+    def regions(self):
+        mv = memoryview(self.data)
+        r = 0
+        while r < self.height:
+            c0, c1 = self.first[r], self.last[r]
+            if c0 > c1:
+                r += 1
+                continue
+            r0 = r
+            while r+1 < self.height and self.first[r+1] == c0 and self.last[r+1] == c1:
+                r += 1
+            if c0 == 0 and c1 == self.stride-1:
+                data = mv[r0*self.stride:(r+1)*self.stride]
+            else:
+                data = cropPacked(self.data, self.stride, r0, r, c0, c1)
+            yield c0*8, r0, (c1-c0+1)*8, r-r0+1, data
+            r += 1
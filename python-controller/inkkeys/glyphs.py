@@ -0,0 +1,150 @@
+from .framebuffer import *
+from threading import Lock
+
+#Text for the display tiles without drawing it with PIL every time. A GlyphAtlas rasterizes each character of a font
+#only once into 1-bit columns, already rotated the way text ends up on the display, and keeps the advance width of each
+#character and the kerning of each pair. Rendering a label then only ORs these columns into the rows of the packed tile,
+#which is cheap enough for labels that change every second (clocks, counters, status text).
+#The tile is exactly what Device.renderText used to produce (see renderTextWithPIL): The text centered on a landscape
+#image, rotated by 270 and packed (which rotates by another 180 degrees). Altogether, the text runs from the bottom of
+#the tile to the top and the top of the letters faces the left edge.
+#The characters are placed like PIL places them within a string: Each one is drawn at the pen position rounded to full
+#pixels, the pen moves by the advance (in 1/64 pixels) plus the kerning of the pair, and the anchor of the text is
+#derived from the advance of the whole text and the bounding boxes of its characters (see renderPacked). All of these
+#numbers come from PIL itself (getlength, getbbox and the ink of each character drawn at its anchor).
+#Some characters are drawn differently by PIL depending on their neighbours (the hinting of a few glyphs of the Munro
+#fonts depends on the glyph before them, and an underscore next to a space is cut off). So every character is drawn
+#both ways between other characters when it is added to the atlas. Text with a character that does not match or with a
+#line break is drawn with PIL, so the tiles are the same either way. If PROBE does not match with the remaining
+#characters (a font PIL lays out in a way this does not cover), the atlas draws everything with PIL.
+#
+#Example: GlyphAtlas("font/Munro.ttf", 10).renderPacked(40, 296, "Default")
+
+PROBE = "".join(chr(code) for code in range(32, 127))   #All printable ASCII characters next to each other
+CONTEXTS = ["H{0}H", "o{0}o", " {0} ", "{0}{0}", "{0}"]    #Each character has to match PIL in these
+
+# Like PIL's PIXEL macro: A position in 1/64 pixels rounded to full pixels
+def pixel(position):
+    return ((position + 32) & -64) >> 6
+
+# Packed tile with the text drawn by PIL, like Device.renderText did before the atlas
+def renderTextWithPIL(font, w, h, text, inverted=False):
+    from PIL import Image, ImageDraw
+    fH = font.getmetrics()[0] + font.getbbox(text, anchor="ls")[3] if text else 0     #What font.getsize(text)[1] was
+    img = Image.new("1", (h, w), color=(0 if inverted else 1))
+    ImageDraw.Draw(img).text((h//2,(w-fH)//2), text, anchor="mt", font=font, fill=(1 if inverted else 0)) #Center the text on image
+    return img.rotate(270, expand=1).rotate(180).tobytes()
+
+class GlyphAtlas:
+
+    def __init__(self, path, size):
+        from PIL import ImageFont
+        self.font = ImageFont.truetype(path, size)
+        self.glyphs = {}    #(left, top, height, advance, columns, top and bottom of the box) for each character, see glyph()
+        self.kerning = {}   #Adjustment of the advance for each pair of characters, in 1/64 pixels
+        self.lock = Lock()  #Tiles are also rendered in the background, see prerender.py
+        self.unsafe = set() #Characters that are drawn with PIL, see glyph()
+        self.origin = (2*size, 2*size)
+        self.ascent = self.font.getmetrics()[0]
+        for char in PROBE:
+            self.glyph(char)
+        probe = "".join(char for char in PROBE if char not in self.unsafe)
+        self.exact = self.matches(probe) and self.matches(probe[::-1])
+
+    # Check that the atlas draws text exactly like PIL, on a tile that is larger than the text
+    def matches(self, text):
+        w = 4*self.font.size + 3
+        h = int(self.font.getlength(text)) + 4*self.font.size + 3
+        return self.compose(w, h, *self.layout(text)) == renderTextWithPIL(self.font, w, h, text)
+
+    # Rasterize a character the first time it is used. Each column of the glyph (along the text) is an integer with one
+    # bit per row, the top row of the glyph in the highest bit, which is the leftmost pixel once it is in the tile.
+    # left and top are the position of the ink relative to the pen on the baseline, the advance is in 1/64 pixels. The
+    # box is the top and bottom of the character as PIL uses it to anchor a text: The top when drawn (as "1") and the
+    # bottom when measured for the size of the text (as "L"), both counted upwards from the baseline.
+    def glyph(self, char):
+        glyph = self.glyphs.get(char)
+        if glyph != None:
+            return glyph
+        with self.lock:
+            advance = round(self.font.getlength(char, mode="1")*64)
+            boxTop = -self.font.getbbox(char, mode="1", anchor="ls")[1]
+            boxBottom = -self.font.getbbox(char, anchor="ls")[3]
+            img = self.draw(char)
+            box = img.getbbox()
+            left = top = height = 0
+            columns = []
+            if box != None:
+                x0, y0, x1, y1 = box
+                left = x0 - self.origin[0]
+                top = y0 - self.origin[1]
+                height = y1 - y0
+                pixels = img.load()
+                for column in range(x0, x1):
+                    columns.append(sum(1 << (y1 - 1 - row) for row in range(y0, y1) if pixels[column, row]))
+            glyph = (left, top, height, advance, columns, boxTop, boxBottom)
+            self.unsafe.add(char)   #Until it is known to match PIL
+            self.glyphs[char] = glyph
+        if all(self.matches(context.format(char)) for context in CONTEXTS):     #Adds the characters around it first
+            self.unsafe.discard(char)
+        return glyph
+
+    # Draw a character with its pen on the baseline at origin of an image that is large enough for it
+    def draw(self, text):
+        from PIL import Image, ImageDraw
+        size = self.font.size
+        img = Image.new("1", (4*size + self.origin[0], 4*size), 0)
+        ImageDraw.Draw(img).text(self.origin, text, font=self.font, fill=1, anchor="ls")
+        return img
+
+    def kern(self, a, b):
+        pair = a + b
+        adjustment = self.kerning.get(pair)
+        if adjustment == None:
+            adjustment = round(self.font.getlength(pair, mode="1")*64) - self.glyph(a)[3] - self.glyph(b)[3]
+            self.kerning[pair] = adjustment
+        return adjustment
+
+    # Position of each character as (pen position, glyph) and the advance of the whole text, all in 1/64 pixels
+    def layout(self, text):
+        placed = []
+        pen = 0
+        previous = None
+        for char in text:
+            glyph = self.glyph(char)
+            if previous != None:
+                pen += self.kern(previous, char)
+            placed.append((pen, glyph))
+            pen += glyph[3]
+            previous = char
+        return placed, pen
+
+    # Advance of the text in pixels
+    def length(self, text):
+        return self.layout(text)[1]/64
+
+    # Packed tile of w x h pixels with the text centered along it, exactly like renderTextWithPIL() would draw it
+    def renderPacked(self, w, h, text, inverted=False):
+        placed, length = self.layout(text)     #New characters are checked when they are added
+        if not self.exact or "\n" in text or not self.unsafe.isdisjoint(text):
+            return renderTextWithPIL(self.font, w, h, text, inverted)
+        return self.compose(w, h, placed, length, inverted)
+
+    # Tile with the characters as placed by layout()
+    def compose(self, w, h, placed, length, inverted=False):
+        ink = [0]*h         #Set bits for the pixels of the text in each row of the tile
+        if placed:
+            top = max([0] + [glyph[5] for _, glyph in placed])
+            bottom = min([0] + [glyph[6] for _, glyph in placed])
+            x0 = h//2 - pixel(length//2)                #Anchored in the middle of the advance...
+            baseline = (w - (self.ascent - bottom))//2 + top    #...and at the top of the text, placed like it was before
+            for pen, (left, glyphTop, height, advance, columns, boxTop, boxBottom) in placed:
+                shift = w - (baseline + glyphTop) - height      #Columns of the glyph become rows of the tile
+                x = x0 + pixel(pen) + left
+                for i, column in enumerate(columns):
+                    row = h - 1 - (x + i)
+                    if 0 <= row < h and column:
+                        ink[row] |= column << shift if shift >= 0 else column >> -shift
+        full = (1 << w) - 1
+        pad = rowBytes(w)*8 - w
+        return b"".join((((row & full) if inverted else (full ^ (row & full))) << pad).to_bytes(rowBytes(w), "big") for row in ink)
@@ -0,0 +1,134 @@
+from .tilecache import *
+from .framebuffer import *
+import os
+import json
+import mmap
+import struct
+
+#All icons of a directory in a single file, already rotated and converted to 1-bit, so showing an icon does not need to
+#open and decode a PNG. The atlas is memory mapped and an icon is a slice of it, found by its path ("icons/alarm.png").
+#The file looks like a mode bundle (see bundle.py):
+#  "INKICON" + version byte, length of the index (4 bytes, little endian), index as json, packed icons
+#The index holds for each icon the modification time of the PNG, the size of the rotated icon and the position of its
+#packed data, once as it is and once inverted. The data is packed like Device.packImage would pack the rotated icon.
+#IconAtlas.load compares the modification times with the directory and builds the atlas again if anything changed.
+#Only new and changed icons are decoded for this, all others are copied from the previous atlas.
+#
+#Example: python3 -c "from inkkeys import *; IconAtlas.load('icons', 'icons.atlas')"
+
+ICON_ATLAS_MAGIC = b"INKICON\x01"
+
+# Rotated icon as it is drawn by Device.renderIcon, packed (set bits are white). Returns (w, h, data, inverted data).
+def packIcon(path):
+    from PIL import Image, ImageOps
+    icon = Image.open(path).convert("RGB").rotate(270, expand=True)
+    w, h = icon.size
+    return w, h, icon.convert("1").rotate(180).tobytes(), ImageOps.invert(icon).convert("1").rotate(180).tobytes()
+
+# Write an atlas of all PNG files in directory to path. Icons with the same modification time as in previous (an
+# IconAtlas or None) are taken from there. previous is closed before the new atlas replaces the file it has mapped.
+def compileIcons(directory, path, previous=None):
+    index = {"icons": {}}
+    blob = bytearray()
+    for name in sorted(os.listdir(directory)):
+        if not name.lower().endswith(".png"):
+            continue
+        icon = os.path.join(directory, name)
+        mtime = TileCache.mtime(icon)
+        if previous != None and previous.mtime(icon) == mtime:
+            w, h, data, inverted = previous.icon(icon, mtime)
+        else:
+            try:
+                w, h, data, inverted = packIcon(icon)
+            except OSError as e:
+                print("Could not add " + icon + " to the icon atlas: ", e)
+                continue
+        index["icons"][icon] = [mtime, w, h, len(blob), len(data)]
+        blob += data
+        blob += inverted
+        data = inverted = None      #Views of previous, which cannot be closed while they exist
+    index["directory"] = [directory, TileCache.mtime(directory)]
+    header = json.dumps(index).encode()
+    tmp = path + ".tmp"
+    with open(tmp, "wb") as f:
+        f.write(ICON_ATLAS_MAGIC + struct.pack("<I", len(header)) + header + blob)
+    if previous != None:
+        previous.close()            #A mapped file cannot be replaced on Windows
+    os.replace(tmp, path)
+
+class IconAtlas:
+
+    def __init__(self, path):
+        with open(path, "rb") as f:
+            self.data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if self.data[:len(ICON_ATLAS_MAGIC)] != ICON_ATLAS_MAGIC:
+            self.data.close()
+            raise ValueError(path + " is not an icon atlas.")
+        start = len(ICON_ATLAS_MAGIC) + 4
+        length, = struct.unpack("<I", self.data[len(ICON_ATLAS_MAGIC):start])
+        self.index = json.loads(self.data[start:start+length])
+        self.icons = self.index["icons"]
+        self.packed = memoryview(self.data)[start+length:]
+
+    # Open the atlas for the icons in directory, building it first if it is missing or outdated
+    @staticmethod
+    def load(directory, path):
+        previous = None
+        try:
+            previous = IconAtlas(path)
+            if not previous.stale(directory):
+                return previous
+        except (OSError, ValueError):
+            pass
+        print("Compiling " + directory + " to " + path + ".")
+        compileIcons(directory, path, previous)
+        return IconAtlas(path)
+
+    # Icons were added, removed or changed. Adding or removing a file changes the modification time of the directory.
+    def stale(self, directory):
+        if self.index["directory"] != [directory, TileCache.mtime(directory)]:
+            return True
+        return any(TileCache.mtime(icon) != entry[0] for icon, entry in self.icons.items())
+
+    def mtime(self, icon):
+        entry = self.icons.get(icon)
+        return entry[0] if entry != None else None
+
+    # (w, h, data, inverted data) of an icon without copying it or None if the atlas does not have this version of it
+    def icon(self, icon, mtime):
+        entry = self.icons.get(icon)
+        if entry == None or entry[0] != mtime:
+            return None
+        _, w, h, offset, length = entry
+        return w, h, self.packed[offset:offset+length], self.packed[offset+length:offset+2*length]
+
+    # Packed tile of w x h pixels with the icon at x/y, like Device.renderIcon would draw it. None if the atlas does not
+    # have this version of the icon.
+    def renderPacked(self, w, h, icon, mtime, x, y, inverted=False):
+        found = self.icon(icon, mtime)
+        if found == None:
+            return None
+        wi, hi, data, invertedData = found
+        if inverted:
+            data = invertedData
+        rb = rowBytes(wi)
+        full = (1 << w) - 1
+        background = 0 if inverted else full
+        shift = x                       #The tile is packed upside down, so the icon ends x pixels before the end of the row...
+        mask = ((1 << wi) - 1) << shift if shift >= 0 else ((1 << wi) - 1) >> -shift
+        mask &= full
+        rows = [background]*h
+        top = h - y - hi                #...and hi rows above the y pixels at the bottom
+        for r in range(max(0, -top), min(hi, h - top)):
+            row = int.from_bytes(data[r*rb:(r+1)*rb], "big") >> (rb*8 - wi)
+            row = row << shift if shift >= 0 else row >> -shift
+            rows[top + r] = (background & ~mask) | (row & mask)
+        pad = rowBytes(w)*8 - w
+        return b"".join((row << pad).to_bytes(rowBytes(w), "big") for row in rows)
+
+    def close(self):
+        self.packed.release()
+        self.data.close()
+
+    def __len__(self):
+        return len(self.icons)
@@ -0,0 +1,60 @@
+import sys
+from array import array
+from colorsys import hsv_to_rgb
+
+#LED frames: The colors of all LEDs as an array('I') of 0xrrggbb values.
+#The functions below work on whole frames at once, using byte level operations of Python (translate, slicing, hex)
+#instead of handling every LED and every channel in Python code, which is what makes animations at 30fps expensive.
+
+WHEEL_SIZE = 360    #Resolution of the precomputed hue wheel used by rainbowFrame
+
+_wheel = None
+
+def ledFrame(leds):
+    return leds if isinstance(leds, array) and leds.typecode == "I" else array("I", leds)
+
+# The channels of each LED as bytes in the order r, g, b
+def frameRGB(frame):
+    data = frame.tobytes()
+    n = len(frame)
+    step = frame.itemsize
+    rgb = bytearray(3*n)
+    if sys.byteorder == "little":
+        rgb[0::3], rgb[1::3], rgb[2::3] = data[2::step], data[1::step], data[0::step]
+    else:
+        rgb[0::3], rgb[1::3], rgb[2::3] = data[step-3::step], data[step-2::step], data[step-1::step]
+    return rgb
+
+# Hex representation as used by the LED command, i.e. "ff0000 00ff00 0000ff"
+def encodeFrame(frame):
+    return frameRGB(frame).hex(" ", 3) if len(frame) > 0 else ""
+
+# Scale the brightness of all channels by p (0...1)
+def dimFrame(frame, p):
+    table = bytes(int(v*p) & 0xff for v in range(256))
+    return array("I", frame.tobytes().translate(table))     #The unused fourth byte is 0 and stays 0
+
+# Mix of two frames of the same size, p = 0 is the first one, p = 1 the second one
+def blendFrames(a, b, p):
+    p = max(0.0, min(1.0, p))
+    return array("I", bytes(int(x + (y - x)*p) for x, y in zip(a.tobytes(), b.tobytes())))
+
+# Packed colors around the hue circle at full saturation and brightness, twice in a row, so slices can wrap around
+def hueWheel():
+    global _wheel
+    if _wheel == None:
+        wheel = array("I", ((int(r*255) << 16) | (int(g*255) << 8) | int(b*255) for r, g, b in (hsv_to_rgb(i/WHEEL_SIZE, 1, 1) for i in range(WHEEL_SIZE))))
+        _wheel = wheel + wheel
+    return _wheel
+
+# n LEDs spread evenly around the hue circle, rotated by phase (one full rotation per 1.0)
+def rainbowFrame(n, phase):
+    wheel = hueWheel()
+    start = int(phase * WHEEL_SIZE) % WHEEL_SIZE
+    if n > 0 and WHEEL_SIZE % n == 0:
+        return wheel[start:start+WHEEL_SIZE:WHEEL_SIZE//n]
+    return array("I", (wheel[start + i*WHEEL_SIZE//n] for i in range(n)))
+
+# Indices of the LEDs that differ between two frames of the same size
+def changedLeds(old, new):
+    return [i for i, (a, b) in enumerate(zip(old, new)) if a != b]
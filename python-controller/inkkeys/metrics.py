@@ -0,0 +1,114 @@
+import json
+import time
+from threading import Lock
+
+#Counters and timings of what the controller and the device are doing, so a controller running unattended can be
+#watched. render() returns everything in the Prometheus text format (the controller serves it on /metrics) and if a
+#trace file is opened, every timing and event is also written to it as a line of json.
+#Updates come from the main thread as well as from the transport threads, so all of them take a lock. They are cheap
+#enough to be used on every command and every iteration of the main loop.
+#
+#Example: metrics.count("serial_bytes_total", 12, direction="out", command="A")
+#         metrics.observe("mode_switch_seconds", 0.25, mode="ModeGimp")
+
+METRICS_PREFIX = "inkkeys_"
+DURATION_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)   #Upper bounds in seconds
+
+#Type and description of each metric, used for the HELP and TYPE lines. Metrics without an entry are still reported.
+METRICS = {
+    "serial_bytes_total": ("counter", "Bytes sent to (out) or received from (in) the device by command"),
+    "serial_messages_total": ("counter", "Commands sent to (out) or lines received from (in) the device by command"),
+    "ack_seconds": ("histogram", "Time from writing a command until the device answered with ok, by command"),
+    "ack_timeouts_total": ("counter", "Commands the device did not acknowledge in time, by command"),
+    "late_acks_total": ("counter", "Acknowledgements that arrived after their command had already timed out"),
+    "refresh_requests_coalesced_total": ("counter", "Display refreshes that were requested while another one was still waiting to be sent"),
+    "loop_seconds": ("histogram", "Time spent in one iteration of the main loop, without the time it sleeps"),
+    "loop_overruns_total": ("counter", "Iterations of the main loop that took longer than a frame"),
+    "mode_switch_seconds": ("histogram", "Time to deactivate the previous mode and activate the new one, by mode"),
+    "process_scan_seconds": ("histogram", "Time to update the list of running processes"),
+    "window_query_seconds": ("histogram", "Time to ask for the active window"),
+    "connects_total": ("counter", "Successful connections to the device"),
+    "disconnects_total": ("counter", "Connections to the device that were lost"),
+    "reconnect_seconds": ("histogram", "Time from losing the device until it was connected again"),
+}
+
+class Metrics:
+
+    def __init__(self, prefix=METRICS_PREFIX):
+        self.prefix = prefix
+        self.lock = Lock()
+        self.counters = {}      #Value for each (name, labels)
+        self.histograms = {}    #[count of each bucket, sum, count] for each (name, labels)
+        self.traceFile = None
+
+    # Write all timings and events to a file as json lines from now on
+    def openTrace(self, path):
+        self.traceFile = open(path, "a", buffering=1)
+
+    def closeTrace(self):
+        if self.traceFile != None:
+            self.traceFile.close()
+            self.traceFile = None
+
+    def count(self, name, value=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    # Add a timing. Unless trace is False, it is also written to the trace file.
+    def observe(self, name, seconds, trace=True, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            histogram = self.histograms.get(key)
+            if histogram == None:
+                histogram = self.histograms[key] = [[0]*len(DURATION_BUCKETS), 0.0, 0]
+            for i, bound in enumerate(DURATION_BUCKETS):
+                if seconds <= bound:
+                    histogram[0][i] += 1
+                    break
+            histogram[1] += seconds
+            histogram[2] += 1
+        if trace:
+            self.trace(name, seconds=seconds, **labels)
+
+    # Something happened that is worth a line in the trace, but not a metric of its own
+    def trace(self, event, **fields):
+        if self.traceFile != None:
+            line = json.dumps({"time": time.time(), "event": event, **fields})
+            with self.lock:
+                if self.traceFile != None:
+                    self.traceFile.write(line + "\n")
+
+    # Everything in the Prometheus text format
+    def render(self):
+        with self.lock:
+            counters = sorted(self.counters.items())
+            histograms = sorted((key, (list(buckets), total, n)) for key, (buckets, total, n) in self.histograms.items())
+        lines = []
+        described = set()
+        def describe(name, kind):
+            if name not in described:
+                described.add(name)
+                kind, description = METRICS.get(name, (kind, None))
+                if description != None:
+                    lines.append(f"# HELP {self.prefix}{name} {description}")
+                lines.append(f"# TYPE {self.prefix}{name} {kind}")
+        for (name, labels), value in counters:
+            describe(name, "counter")
+            lines.append(f"{self.prefix}{name}{formatLabels(labels)} {value}")
+        for (name, labels), (buckets, total, n) in histograms:
+            describe(name, "histogram")
+            cumulative = 0
+            for bound, count in zip(DURATION_BUCKETS, buckets):
+                cumulative += count
+                lines.append(f"{self.prefix}{name}_bucket{formatLabels(labels + (('le', str(bound)),))} {cumulative}")
+            lines.append(f"{self.prefix}{name}_bucket{formatLabels(labels + (('le', '+Inf'),))} {n}")
+            lines.append(f"{self.prefix}{name}_sum{formatLabels(labels)} {total}")
+            lines.append(f"{self.prefix}{name}_count{formatLabels(labels)} {n}")
+        return "\n".join(lines) + "\n"
+
+def formatLabels(labels):
+    if not labels:
+        return ""
+    escaped = (str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n") for _, value in labels)
+    return "{" + ",".join(f'{name}="{value}"' for (name, _), value in zip(labels, escaped)) + "}"
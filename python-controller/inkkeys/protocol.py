@@ -1,5 +1,4 @@
 from enum import Enum
-from PIL import Image
 
 def event(device, keycode, value=""):
     if device == DELAY:
@@ -18,6 +17,14 @@ class CommandCode(Enum):
     REFRESH = "R"
     INFO = "I"
     ANIMATE = "N"
+    DISPLAY_COMPRESSED = "C" #Like DISPLAY, but the image data is PackBits encoded. Only if the device reports CapabilityCode.RLE
+    LED_PIXELS = "P"         #Set only some LEDs: "P <index> <rrggbb> <index> <rrggbb> ...". Only if the device reports CapabilityCode.LED_PIXELS
+
+#Optional features reported by the device in the "CAPS" line of the info command
+class CapabilityCode(Enum):
+    RLE = "RLE"
+    LED_PIXELS = "LEDP"
+    RAINBOW = "RAINBOW"     #Animation 3 of the ANIMATE command (rotating rainbow)
 
 class RefreshTypeCode(Enum):
     PARTIAL = "p"
@@ -0,0 +1,127 @@
+import time
+import struct
+from threading import Lock, Condition
+
+#Recording of the serial traffic of a device, to look at problems from the field offline and to benchmark changes of
+#the protocol against real sessions (see replay.py).
+#The Transport writes a record for every item it sends (a command, possibly with its binary payload) and every line it
+#receives. The file starts with RECORDING_MAGIC, followed by the records, each of them
+#  kind (1 byte), microseconds since the previous record (8 bytes), length (2 bytes), data
+#with numbers in little endian. Data longer than 65535 bytes is split into several records of the same kind.
+#Version 1 of the format had only 4 bytes for the delay, so gaps of more than 71 minutes were cut short. Such
+#recordings can still be read.
+
+RECORDING_MAGIC = b"INKREC\x02"
+RECORD_OUT = 0          #Data sent to the device
+RECORD_OUT_ACK = 1      #Data sent to the device, which answers with "ok" when it is done (display refreshes)
+RECORD_IN = 2           #Line received from the device, without the line end
+
+_header = struct.Struct("<BQH")
+_headers = {RECORDING_MAGIC: _header, b"INKREC\x01": struct.Struct("<BIH")}   #Record header of each version
+
+class Recorder:
+
+    def __init__(self, path):
+        self.file = open(path, "wb")
+        self.file.write(RECORDING_MAGIC)
+        self.lock = Lock()      #Records come from the writer and the reader of the transport
+        self.last = time.time()
+
+    def record(self, kind, data):
+        with self.lock:
+            if self.file == None:
+                return
+            now = time.time()
+            delay = max(0, round((now - self.last)*1e6))
+            self.last = now
+            data = memoryview(data)
+            for start in range(0, max(len(data), 1), 0xffff):
+                part = data[start:start+0xffff]
+                self.file.write(_header.pack(kind, delay, len(part)))
+                self.file.write(part)
+                delay = 0
+
+    def flush(self):
+        with self.lock:
+            if self.file != None:
+                self.file.flush()
+
+    def close(self):
+        with self.lock:
+            if self.file != None:
+                self.file.close()
+                self.file = None
+
+# All records of a recording as a list of (seconds since the start, kind, data)
+def readRecording(path):
+    with open(path, "rb") as f:
+        data = f.read()
+    header = _headers.get(data[:len(RECORDING_MAGIC)])
+    if header == None:
+        raise ValueError(path + " is not a recording.")
+    records = []
+    t = 0.0
+    position = len(RECORDING_MAGIC)
+    while position + header.size <= len(data):
+        kind, delay, length = header.unpack_from(data, position)
+        position += header.size
+        t += delay/1e6
+        records.append((t, kind, data[position:position+length]))
+        position += length
+    return records
+
+#Stand-in for a serial port that answers with the lines of a recording at the time they were received originally,
+#speed times faster. Data written to it is only counted. The clock starts with the first read or with start().
+class ReplaySerial:
+
+    def __init__(self, records, speed=1.0):
+        self.name = "replay"
+        self.timeout = 1
+        self.speed = speed
+        self.lines = [(t, data + b"\r\n") for t, kind, data in records if kind == RECORD_IN]
+        self.next = 0           #Index of the next line to be read
+        self.outbuffer = bytearray()
+        self.cv = Condition()
+        self.started = None
+        self.bytesWritten = 0
+
+    def start(self):
+        if self.started == None:
+            self.started = time.time()
+
+    # Move the lines that are due to the buffer and return the seconds until the next one is
+    def due(self):
+        self.start()
+        elapsed = (time.time() - self.started)*self.speed
+        while self.next < len(self.lines) and self.lines[self.next][0] <= elapsed:
+            self.outbuffer += self.lines[self.next][1]
+            self.next += 1
+        return (self.lines[self.next][0] - elapsed)/self.speed if self.next < len(self.lines) else None
+
+    def done(self):
+        return self.next >= len(self.lines) and not self.outbuffer
+
+    @property
+    def in_waiting(self):
+        with self.cv:
+            self.due()
+            return len(self.outbuffer)
+
+    def read(self, size=1):
+        with self.cv:
+            wait = self.due()
+            if not self.outbuffer and self.timeout != 0:
+                self.cv.wait(min(wait, self.timeout) if wait != None else self.timeout)
+                self.due()
+            data = bytes(self.outbuffer[:size])
+            del self.outbuffer[:size]
+        return data
+
+    def write(self, data):
+        self.bytesWritten += len(data)
+        return len(data)
+
+    def close(self):
+        with self.cv:
+            self.next = len(self.lines)
+            self.cv.notify_all()
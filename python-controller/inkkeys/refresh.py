@@ -0,0 +1,144 @@
+from .framebuffer import *
+import time
+from concurrent.futures import Future
+
+#Collects the images and refresh requests of the modes and sends them in as few display refreshes as possible. Enabled
+#by setting Device.refreshDelay, otherwise everything is sent right away as before.
+#When the active window changes several times in a row, every mode on the way draws its tiles and asks for a refresh,
+#but only the last one will ever be seen. So:
+#- Images are drawn into a framebuffer and only sent when the refresh is due. An area that is drawn several times is
+#  sent once and whatever ends up as it was on the display is not sent at all (see Device.writePackedImage).
+#- A refresh is due refreshDelay seconds after the last request, but not later than refreshMaxDelay after the first.
+#- While the display is busy with a refresh, nothing is sent. Everything requested in the meantime is sent as a single
+#  refresh once the device acknowledged the previous one.
+#- Partial refreshes leave ghosts of earlier content behind, so after fullRefreshAfter partial refreshes the next one
+#  is a full refresh (see Device.refreshDisplay, this also applies without the scheduler).
+#update() has to be called regularly (the controller does this in its main loop) and returns the time in seconds until
+#it needs to be called again or None if it only has to be called after Device.displayIdle().
+
+FULL_REFRESH_AFTER = 10     #Partial refreshes before a full refresh
+
+# Resolve target with the result of source once it is done
+def chainFuture(source, target):
+    source.add_done_callback(lambda f: target.done() or target.set_result(f.exception() == None and f.result()))
+
+class RefreshScheduler:
+
+    def __init__(self, device):
+        self.device = device
+        self.target = None      #ImageBuffer with the images that have not been sent yet
+        self.written = []       #Futures returned for these images
+        self.waiting = []       #Futures returned for refresh requests that have not been sent yet
+        self.fullRefresh = False
+        self.timeout = 5
+        self.first = None       #Time of the first image or request that has not been sent yet, None if nothing is pending
+        self.last = None        #Time of the last one
+        self.busy = None        #Future of the refresh the device is working on
+
+    # Draw packed image data. Returns a future that resolves once it has been written to the device.
+    def image(self, x, y, w, h, data):
+        device = self.device
+        if device.dispW <= 0 or device.dispH <= 0:
+            return device.writePackedImage(x, y, w, h, data)    #Size of the display unknown, nothing to draw into
+        if self.target == None or (self.target.width, self.target.height) != (device.dispW, device.dispH):
+            self.target = ImageBuffer(device.dispW, device.dispH)
+        self.target.blit(x, y, w, h, data)
+        self.touch()
+        future = Future()
+        self.written.append(future)
+        return future
+
+    # Ask for a refresh. Returns a future that resolves to True once the device confirmed the refresh that includes it.
+    def request(self, fullRefresh=False, timeout=5):
+        if self.waiting:
+            self.device.metrics.count("refresh_requests_coalesced_total")
+            self.timeout = max(self.timeout, timeout)
+        else:
+            self.timeout = timeout
+        self.fullRefresh = self.fullRefresh or fullRefresh
+        self.touch()
+        future = Future()
+        self.waiting.append(future)
+        return future
+
+    # Blank out the display with the next refresh
+    def clear(self, timeout=5):
+        device = self.device
+        self.image(0, 0, device.dispW, device.dispH, bytes([WHITE])*(rowBytes(device.dispW)*device.dispH))
+        return self.request(False, timeout)
+
+    def touch(self):
+        now = time.time()
+        if self.first == None:
+            self.first = now
+        self.last = now
+
+    # Time at which everything pending should be sent, None if nothing is pending
+    def due(self):
+        if self.first == None:
+            return None
+        delay = self.device.refreshDelay or 0
+        return min(self.last + delay, self.first + max(delay, self.device.refreshMaxDelay))
+
+    # Send whatever is due and return the seconds until the next call is needed
+    def update(self, now=None):
+        if now == None:
+            now = time.time()
+        due = self.due()
+        if due == None:
+            return None
+        if self.busy != None and not self.busy.done():
+            return None     #Device.displayIdle() is called when the device is done
+        if now < due:
+            return due - now
+        self.flush()
+        return None
+
+    # Send everything that is pending right away
+    def flush(self):
+        self.writeImages()
+        if self.waiting:
+            waiting = self.waiting
+            self.waiting = []
+            refreshed = self.device.refreshDisplay(self.fullRefresh, self.timeout)
+            self.fullRefresh = False
+            for future in waiting:
+                chainFuture(refreshed, future)
+            refreshed.add_done_callback(lambda f: self.device.displayIdle())
+            self.busy = refreshed
+        self.first = None
+        self.last = None
+
+    # Send the images drawn so far without a refresh, each run of rows with the same width as one image
+    def writeImages(self):
+        written = self.written
+        self.written = []
+        if self.target == None:
+            return
+        last = None
+        for x, y, w, h, data in self.target.regions():
+            last = self.device.writePackedImage(x, y, w, h, bytes(data))   #A copy, the buffer changes with the next image
+        self.target.clear()
+        for future in written:
+            if last != None:
+                chainFuture(last, future)   #Images are written in order, so the last one is written after all others
+            else:
+                future.set_result(True)
+
+    # Forget the images drawn so far, i.e. because the display is blanked out anyway
+    def discard(self):
+        if self.target != None:
+            self.target.clear()
+        for future in self.written:
+            future.set_result(True)
+        self.written = []
+
+    # Give up on everything pending, i.e. because the connection is lost
+    def cancel(self):
+        for future in self.written + self.waiting:
+            future.set_result(False)
+        self.written = []
+        self.waiting = []
+        self.first = None
+        self.last = None
+        self.busy = None
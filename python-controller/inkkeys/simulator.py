@@ -0,0 +1,164 @@
+from .protocol import *
+from .framebuffer import *
+from .compression import *
+import time
+from collections import Counter
+from threading import Condition, Timer
+
+#Seconds the simulated display is busy for each type of refresh
+REFRESH_TIMES = {RefreshTypeCode.PARTIAL.value: 0.3, RefreshTypeCode.FULL.value: 2.0, RefreshTypeCode.RESET.value: 2.0, RefreshTypeCode.OFF.value: 0.0}
+
+#Stand-in for a serial port with an inkkeys device on the other end. It understands the same commands as the firmware
+#(see serialinput.ino), keeps the display content in a Framebuffer and answers refresh commands with "ok" after the time
+#a real display would need. With realtime set, writing takes as long as it would at the given baud rate and the
+#writer is blocked while the display refreshes, just like the real device stops reading during a refresh.
+#This allows running the controller code (i.e. for benchmarks) without any hardware.
+class SimulatedSerial:
+
+    def __init__(self, baudrate=115200, nLeds=12, dispW=128, dispH=296, rotCircleSteps=20, refreshTimes=REFRESH_TIMES, realtime=True, capabilities=(CapabilityCode.RLE.value, CapabilityCode.LED_PIXELS.value, CapabilityCode.RAINBOW.value)):
+        self.name = "simulated"
+        self.timeout = 1
+        self.baudrate = baudrate
+        self.nLeds = nLeds
+        self.dispW = dispW
+        self.dispH = dispH
+        self.rotCircleSteps = rotCircleSteps
+        self.refreshTimes = refreshTimes
+        self.realtime = realtime
+        self.capabilities = capabilities
+
+        self.display = Framebuffer(dispW, dispH)
+        self.assignments = {}   #Last assignment for each key, i.e. {"2p": "k224p k227p k30p"}
+        self.leds = None        #Last LED command
+        self.animation = None   #Last animation command
+
+        self.cv = Condition()
+        self.outbuffer = bytearray()    #Data waiting to be read by the host
+        self.inbuffer = bytearray()     #Data written by the host but not processed yet
+        self.expectingImageData = 0
+        self.image = None               #x, y, w, h of the image that is currently being received
+        self.imageRow = 0
+        self.imageRowData = bytearray() #Decoded data of the current row
+        self.decoder = None             #PackBitsDecoder if the current image is compressed
+        self.busyUntil = 0              #The device does not read anything while the display refreshes
+        self.resetStats()
+
+    def resetStats(self):
+        self.bytesWritten = 0
+        self.bytesRead = 0
+        self.commands = Counter()       #Number of commands by their command code
+        self.commandBytes = Counter()   #Bytes sent by command code, including image data
+        self.transferTime = 0.0         #Time the serial line was busy with data from the host
+        self.refreshTime = 0.0          #Time the display spent refreshing
+
+    @property
+    def in_waiting(self):
+        return len(self.outbuffer)
+
+    def write(self, data):
+        now = time.time()
+        if self.realtime and self.busyUntil > now:
+            time.sleep(self.busyUntil - now)
+        transfer = len(data)*10/self.baudrate #8 data bits, start and stop bit
+        if self.realtime:
+            time.sleep(transfer)
+        self.transferTime += transfer
+        self.bytesWritten += len(data)
+        self.inbuffer += data
+        self.process()
+        return len(data)
+
+    def read(self, size=1):
+        with self.cv:
+            if not self.outbuffer and self.timeout != 0:
+                self.cv.wait(self.timeout)
+            data = bytes(self.outbuffer[:size])
+            del self.outbuffer[:size]
+        self.bytesRead += len(data)
+        return data
+
+    def close(self):
+        pass
+
+    # Send lines from the device to the host
+    def respond(self, *lines):
+        with self.cv:
+            for line in lines:
+                self.outbuffer += (line + "\r\n").encode()
+            self.cv.notify_all()
+
+    # Simulate a key press or the jog dial, i.e. press("2p") or press("R-1")
+    def press(self, key):
+        self.respond(key)
+
+    def process(self):
+        while self.inbuffer:
+            if self.expectingImageData > 0:
+                x, y, w, h = self.image
+                rb = rowBytes(w)
+                if self.decoder != None:
+                    self.commandBytes[CommandCode.DISPLAY_COMPRESSED.value] += 1
+                    self.imageRowData += self.decoder.feed(self.inbuffer.pop(0))
+                else:
+                    n = min(len(self.inbuffer), rb - len(self.imageRowData))
+                    self.commandBytes[CommandCode.DISPLAY.value] += n
+                    self.imageRowData += self.inbuffer[:n]
+                    del self.inbuffer[:n]
+                while len(self.imageRowData) >= rb and self.expectingImageData > 0:
+                    self.display.blit(x, y + self.imageRow, w, 1, self.imageRowData[:rb])
+                    del self.imageRowData[:rb]
+                    self.imageRow += 1
+                    self.expectingImageData -= rb
+                if self.expectingImageData <= 0:
+                    self.expectingImageData = 0
+                    self.imageRowData = bytearray()
+                    self.decoder = None
+                continue
+            end = self.inbuffer.find(b"\n")
+            if end < 0:
+                return
+            line = self.inbuffer[:end].decode("ISO-8859-1")
+            del self.inbuffer[:end+1]
+            if line:
+                self.command(line)
+
+    def command(self, line):
+        code = line[0]
+        self.commands[code] += 1
+        self.commandBytes[code] += len(line) + 1
+        args = line[2:].split(" ") if len(line) > 2 else []
+        if code == CommandCode.INFO.value:
+            self.respond("Inkkeys", "TEST 0", f"N_LED {self.nLeds}", f"DISP_W {self.dispW}", f"DISP_H {self.dispH}", f"ROT_CIRCLE_STEPS {self.rotCircleSteps}", "CAPS " + " ".join(self.capabilities), "Done")
+        elif code == CommandCode.ASSIGN.value and len(args) > 0:
+            self.assignments[args[0]] = " ".join(args[1:])
+        elif code in (CommandCode.DISPLAY.value, CommandCode.DISPLAY_COMPRESSED.value) and len(args) == 4:
+            if code == CommandCode.DISPLAY_COMPRESSED.value and CapabilityCode.RLE.value not in self.capabilities:
+                self.respond("E: Unknown command: " + line)
+                return
+            x, y, w, h = (int(a) for a in args)
+            self.image = (x, y, w, h)
+            self.imageRow = 0
+            self.imageRowData = bytearray()
+            self.decoder = PackBitsDecoder() if code == CommandCode.DISPLAY_COMPRESSED.value else None
+            self.expectingImageData = rowBytes(w)*h
+        elif code == CommandCode.LED.value:
+            self.leds = args
+        elif code == CommandCode.LED_PIXELS.value and CapabilityCode.LED_PIXELS.value in self.capabilities and len(args) % 2 == 0:
+            leds = list(self.leds) if self.leds != None else ["000000"] * self.nLeds
+            for i in range(0, len(args), 2):
+                leds[int(args[i])] = args[i+1]
+            self.leds = leds
+        elif code == CommandCode.ANIMATE.value:
+            self.animation = args
+        elif code == CommandCode.REFRESH.value and len(args) == 1:
+            if args[0] == RefreshTypeCode.RESET.value:
+                self.display.fill()
+            duration = self.refreshTimes.get(args[0], 0)
+            self.refreshTime += duration
+            if self.realtime and duration > 0:
+                self.busyUntil = time.time() + duration
+                Timer(duration, self.respond, args=("ok",)).start()
+            else:
+                self.respond("ok")
+        else:
+            self.respond("E: Unknown command: " + line)
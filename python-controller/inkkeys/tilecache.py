@@ -0,0 +1,135 @@
+import os
+import hashlib
+from collections import OrderedDict
+from threading import Lock
+
+TILE_CACHE_SIZE = 256 #Number of packed tiles kept in memory. A full mode uses about ten, so this covers plenty of modes.
+TILE_CACHE_FILES = 4096 #Number of tiles kept on disk. Beyond that, the least recently used quarter is deleted.
+
+#Cache for fully rendered tiles. It holds the final packed 1-bit payload (exactly the bytes sent after a "D" command),
+#so a cache hit skips every PIL operation. Keys are built from everything that affects the rendered tile (source file
+#and its modification time, function slot, rendering options and display geometry) and are hashed, so they can also
+#be used as file names for the optional on-disk store.
+#Tiles of changed icons or fonts are never asked for again, so the on-disk store is limited to maxFiles tiles. Reading
+#a tile from disk updates the modification time of its file, so the files that have not been used for the longest time
+#are deleted first.
+class TileCache:
+
+    def __init__(self, maxEntries=TILE_CACHE_SIZE, directory=None, maxFiles=TILE_CACHE_FILES):
+        self.maxEntries = maxEntries
+        self.maxFiles = maxFiles
+        self.directory = directory  #None = Memory only, otherwise packed tiles are also stored as files in this directory
+        self.entries = OrderedDict()
+        self.lock = Lock()          #Tiles might be rendered from other threads
+        self.hits = 0
+        self.misses = 0
+        self.files = 0              #Number of tiles in the directory
+        if directory != None:
+            os.makedirs(directory, exist_ok=True)
+            self.files = len(self.storedFiles())
+
+    # Modification time of a source file, so changed icons or fonts invalidate their tiles
+    @staticmethod
+    def mtime(path):
+        try:
+            return os.stat(path).st_mtime_ns
+        except OSError:
+            return None
+
+    # Build a key from any number of hashable parts
+    @staticmethod
+    def key(*parts):
+        return hashlib.sha1(repr(parts).encode()).hexdigest()
+
+    def get(self, key):
+        with self.lock:
+            data = self.entries.get(key)
+            if data != None:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return data
+        if self.directory != None:
+            try:
+                with open(os.path.join(self.directory, key + ".bin"), "rb") as f:
+                    data = f.read()
+            except OSError:
+                data = None
+            if data != None:
+                self.touch(key)
+                self.put(key, data, store=False)
+                with self.lock:
+                    self.hits += 1
+                return data
+        with self.lock:
+            self.misses += 1
+        return None
+
+    # True if the tile is cached, without counting it as a hit or miss
+    def contains(self, key):
+        with self.lock:
+            if key in self.entries:
+                return True
+        return self.directory != None and os.path.exists(os.path.join(self.directory, key + ".bin"))
+
+    def put(self, key, data, store=True):
+        data = bytes(data)
+        with self.lock:
+            self.entries[key] = data
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.maxEntries:
+                self.entries.popitem(last=False) #Evict the least recently used tile
+        if store and self.directory != None:
+            path = os.path.join(self.directory, key + ".bin")
+            try:
+                new = not os.path.exists(path)
+                with open(path + ".tmp", "wb") as f:
+                    f.write(data)
+                os.replace(path + ".tmp", path) #Atomic, so a concurrent reader never sees a partial tile
+            except OSError as e:
+                print("Could not store tile: ", e)
+                return
+            if new:
+                with self.lock:
+                    self.files += 1
+                    full = self.files > self.maxFiles
+                if full:
+                    self.prune()
+
+    # Paths of the tiles in the directory
+    def storedFiles(self):
+        try:
+            return [entry.path for entry in os.scandir(self.directory) if entry.name.endswith(".bin")]
+        except OSError:
+            return []
+
+    # Mark a tile on disk as recently used
+    def touch(self, key):
+        try:
+            os.utime(os.path.join(self.directory, key + ".bin"))
+        except OSError:
+            pass
+
+    # Delete the least recently used tiles on disk, so a quarter of maxFiles is free again
+    def prune(self):
+        files = []
+        for path in self.storedFiles():
+            try:
+                files.append((os.stat(path).st_mtime_ns, path))
+            except OSError:
+                pass
+        files.sort()
+        keep = self.maxFiles*3//4
+        for mtime, path in files[:max(0, len(files) - keep)]:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+        with self.lock:
+            self.files = min(len(files), keep)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def __len__(self):
+        return len(self.entries)
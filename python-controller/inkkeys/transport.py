@@ -0,0 +1,250 @@
+import time
+import queue
+import itertools
+from collections import deque, Counter
+from threading import Thread, Lock
+from concurrent.futures import Future
+from serial import SerialException  #Serial functions
+from .metrics import *
+from .recorder import *
+
+CHUNK_SIZE = 100
+RECEIVE_BUFFER_SIZE = 4096  #Longest line that can be received, everything the device sends is much shorter
+LINE_ENCODING = "ISO-8859-16"
+
+#Priorities of outbound traffic. Lower values are sent first, traffic of the same priority keeps its order.
+PRIORITY_CONTROL = 0    #Key assignments, LEDs and everything else that is small and should feel immediate
+PRIORITY_DISPLAY = 1    #Image data and display refreshes, which take a while and can wait
+
+# Text of a line received from the device. Key presses are handled as bytes (see Device.handleInput), this is only
+# needed for everything else.
+def decodeLine(line):
+    return line.decode(LINE_ENCODING)
+
+#Splits received data into lines without building a new string for every chunk.
+#Data is copied into a buffer that is allocated once. Only the newly received data is searched for the end of a line,
+#so every byte is looked at once no matter in how many chunks a line arrives, and all lines completed by a chunk are
+#split off in one go and returned as bytes (without "\r\n"). The rest of an incomplete line is moved to the start of
+#the buffer when there is no room left at its end, which keeps lines in one piece. A line that does not fit into the
+#buffer at all is dropped. Data that consists of complete lines (the usual case) is split right away without copying it.
+class LineBuffer:
+
+    def __init__(self, size=RECEIVE_BUFFER_SIZE):
+        self.buffer = bytearray(size)
+        self.view = memoryview(self.buffer)
+        self.start = 0      #Start of the incomplete line
+        self.end = 0        #End of the received data
+        self.overflow = False   #Part of the current line has been dropped, so drop the rest of it as well
+
+    # Add received data and return the lines it completed
+    def feed(self, data):
+        if self.end == 0 and data[-1:] == b"\n" and not self.overflow:    #Only complete lines, nothing has to be kept
+            lines = bytes(data).replace(b"\r", b"").split(b"\n")
+            lines.pop()
+            return lines
+        if len(data) <= len(self.buffer) - self.end:
+            return self.append(data)
+        lines = []
+        data = memoryview(data)
+        while len(data) > 0:
+            if self.end == len(self.buffer):
+                self.compact()
+                if self.end == len(self.buffer):    #The buffer is full with a single line, which can only be garbage
+                    self.start = self.end = 0
+                    self.overflow = True
+            n = min(len(data), len(self.buffer) - self.end)
+            lines += self.append(data[:n])
+            data = data[n:]
+        return lines
+
+    # Add data that fits behind the end of the buffer
+    def append(self, data):
+        start = self.end
+        self.end += len(data)
+        self.buffer[start:self.end] = data
+        last = self.buffer.rfind(b"\n", start, self.end)     #Only the new data can contain a new line end
+        if last < 0:
+            return []
+        lines = bytes(self.view[self.start:last]).replace(b"\r", b"").split(b"\n")
+        if self.overflow:
+            del lines[0]
+            self.overflow = False
+        self.start = last + 1
+        if self.start == self.end:
+            self.start = self.end = 0
+        return lines
+
+    def compact(self):
+        n = self.end - self.start
+        self.view[:n] = self.view[self.start:self.end]
+        self.start = 0
+        self.end = n
+
+#Moves all serial traffic to two background threads, so the main loop never blocks on the device.
+#The writer sends queued items in order of their priority. An item is always written as a whole, so binary image data
+#is never interrupted by other commands. The reader collects incoming lines, resolves futures of commands that are
+#acknowledged with "ok" (display refreshes) and hands everything else to the onLine function as bytes. Without the reader thread
+#(reader=False), incoming data has to be passed to received() by whoever watches the serial port (see AsyncDevice).
+class Transport:
+
+    def __init__(self, ser, onLine, debug=False, reader=True, onError=None, metrics=None, recorder=None):
+        self.ser = ser
+        self.recorder = recorder        #Recorder that gets all traffic, None if nothing is recorded (see recorder.py)
+        self.metrics = metrics if metrics != None else Metrics()  #Bytes and messages in each direction and acknowledgement times
+        self.onLine = onLine
+        self.onError = onError          #Called with the exception if the transport stops because of an error
+        self.debug = debug
+        self.error = None               #Exception that stopped the transport, raised again in the main thread by check()
+        self.outbound = queue.PriorityQueue()
+        self.counter = itertools.count() #Keeps items of the same priority in order
+        self.pendingAcks = deque()      #[future, timeout, deadline, command, time written] for each command waiting for its "ok"
+        self.lateAcks = 0               #Commands that timed out and still have their "ok" coming
+        self.ackLock = Lock()
+        self.inbuffer = LineBuffer()
+        self.running = True
+        self.writer = Thread(target=self.writeLoop, daemon=True)
+        self.reader = Thread(target=self.readLoop, daemon=True) if reader else None
+        self.writer.start()
+        if self.reader != None:
+            self.reader.start()
+
+    # Queue data to be sent. Returns a future that resolves to True once the data has been written.
+    # If ack is set, it instead resolves to True when the device answers with "ok" or to False if this does not happen
+    # within timeout seconds after the data has been written. command is only used to label the metrics.
+    def send(self, data, priority=PRIORITY_CONTROL, ack=False, timeout=5, command="other"):
+        future = Future()
+        self.outbound.put((priority, next(self.counter), data, future, ack, timeout, command))
+        return future
+
+    def close(self):
+        self.running = False
+        self.outbound.put((-1, -1, None, None, False, 0, None)) #Wake up the writer
+        for thread in (self.writer, self.reader):
+            if thread != None:
+                thread.join(2)
+        self.failAcks()
+
+    # Raise any error that occured in one of the threads
+    def check(self):
+        if self.error != None:
+            raise self.error
+
+    def stop(self, error):
+        if self.running:
+            self.error = error
+            self.running = False
+            print("Serial error: ", error)
+            if self.onError != None:
+                self.onError(error)
+        self.failAcks()
+
+    def failAcks(self):
+        with self.ackLock:
+            self.lateAcks = 0
+            while self.pendingAcks:
+                future = self.pendingAcks.popleft()[0]
+                if not future.done():
+                    future.set_result(False)
+
+    def writeLoop(self):
+        while self.running:
+            priority, _, data, future, ack, timeout, command = self.outbound.get()
+            if data == None:
+                break
+            if ack:
+                with self.ackLock:  #Register before writing, so the reader cannot miss a quick answer
+                    self.pendingAcks.append([future, timeout, None, command, None])
+            try:
+                parts = data if isinstance(data, list) else [data]
+                for part in parts:
+                    # Send binary data in chunks to prevent killing the serial connection
+                    for startIx in range(0, len(part), CHUNK_SIZE):
+                        self.ser.write(part[startIx:startIx+CHUNK_SIZE])
+            except (SerialException, OSError) as e:
+                future.set_result(False)
+                self.stop(e)
+                break
+            if self.recorder != None:
+                self.recorder.record(RECORD_OUT_ACK if ack else RECORD_OUT, b"".join(parts))
+            self.metrics.count("serial_bytes_total", sum(len(part) for part in parts), direction="out", command=command)
+            self.metrics.count("serial_messages_total", direction="out", command=command)
+            if ack:
+                with self.ackLock:
+                    for pending in self.pendingAcks:
+                        if pending[0] is future:
+                            pending[4] = time.time()
+                            pending[2] = pending[4] + pending[1]
+            else:
+                future.set_result(True)
+
+    def readLoop(self):
+        while self.running:
+            try:
+                data = self.ser.read(max(1, self.ser.in_waiting)) #Blocks until data arrives or the serial timeout is up
+            except (SerialException, OSError, TypeError) as e:
+                self.stop(e)
+                break
+            self.received(data)
+            self.expireAcks()
+
+    # Handle data received from the device
+    def received(self, data):
+        if not data:
+            return
+        lines = self.inbuffer.feed(data)
+        self.countReceived(lines)
+        if self.recorder != None:
+            for line in lines:
+                self.recorder.record(RECORD_IN, line)
+        for line in lines:
+            if line == b"ok":
+                self.acknowledge(True)
+            else:
+                self.onLine(line)
+
+    # Count received lines by their kind: "ok", "R" (jog dial), "key" and "other" (i.e. the answer to the info command)
+    def countReceived(self, lines):
+        kinds = Counter()
+        sizes = Counter()
+        for line in lines:
+            kind = "ok" if line == b"ok" else "R" if line[:1] == b"R" else "key" if line[:1].isdigit() else "other"
+            kinds[kind] += 1
+            sizes[kind] += len(line) + 2    #Lines end with "\r\n"
+        for kind, n in kinds.items():
+            self.metrics.count("serial_messages_total", n, direction="in", command=kind)
+            self.metrics.count("serial_bytes_total", sizes[kind], direction="in", command=kind)
+
+    # The device answers every acknowledged command in order, also those that already timed out. So the first "ok"s
+    # after a timeout belong to the commands that timed out and are skipped, each other "ok" is for the oldest command
+    # that still waits for it.
+    def acknowledge(self, result):
+        with self.ackLock:
+            if self.lateAcks > 0:
+                self.lateAcks -= 1
+                self.metrics.count("late_acks_total")
+                return
+            if not self.pendingAcks:
+                return
+            future, _, _, command, written = self.pendingAcks.popleft()
+        if written != None:
+            self.metrics.observe("ack_seconds", time.time() - written, command=command)
+        if self.debug:
+            print("Received: ok")
+        future.set_result(result)
+
+    # Resolve acknowledgements that took too long. Returns the deadline of the next one or None if there is none.
+    def expireAcks(self):
+        now = time.time()
+        expired = []
+        with self.ackLock:
+            while self.pendingAcks and self.pendingAcks[0][2] != None and self.pendingAcks[0][2] < now:
+                pending = self.pendingAcks.popleft()
+                expired.append(pending[0])
+                self.lateAcks += 1
+                self.metrics.count("ack_timeouts_total", command=pending[3])
+            deadline = self.pendingAcks[0][2] if self.pendingAcks else None
+        for future in expired:
+            if self.debug:
+                print("Timed out...")
+            future.set_result(False)
+        return deadline
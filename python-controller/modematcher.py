@@ -0,0 +1,103 @@
+import re
+
+#Decides which mode to use, based on the modes table of the controller.
+#The table is compiled once: Hostname rules are decided right away (the hostname does not change while we are running),
+#everything behind a mode that always matches is dropped and all activeWindow patterns are merged into a single regular
+#expression with one named group per mode, so finding the first matching window rule is a single match call no matter
+#how many modes there are. Results are remembered for each active window and generation of the process index (see
+#ProcessIndex), so asking again without a change of either is a dictionary lookup.
+#The priority stays the same as before: The first entry in the table with a running process, a matching hostname, a
+#matching active window or no rule at all wins.
+#The mode of an entry can be an instance or a class. Classes are only instantiated when the mode is selected for the
+#first time, so modes that are never used cost nothing at startup.
+
+MATCH_CACHE_SIZE = 1024
+
+class ModeMatcher:
+
+    def __init__(self, modes, hostname):
+        self.modes = []         #Mode (or class of the mode) of each remaining entry in the table
+        self.processRules = []  #(index, process name) in order of priority
+        self.windowRules = []   #(index, pattern) for patterns that could not be merged
+        self.fallback = None    #Index of the first entry that always matches
+        merged = []
+        for entry in modes:
+            index = len(self.modes)
+            self.modes.append(entry["mode"])
+            rules = [rule for rule in ("process", "activeWindow", "hostname") if rule in entry]
+            if not rules or ("hostname" in entry and entry["hostname"].match(hostname)):
+                self.fallback = index
+                break           #Nothing after this entry can ever be used
+            if "process" in entry:
+                self.processRules.append((index, entry["process"]))
+            if "activeWindow" in entry:
+                pattern = entry["activeWindow"]
+                if self.mergeable(pattern) != None:
+                    merged.append((index, pattern))
+                else:
+                    self.windowRules.append((index, pattern))
+        self.windowPattern = None
+        if merged:
+            try:
+                self.windowPattern = re.compile("|".join(f"(?P<m{index}>{self.mergeable(pattern)})" for index, pattern in merged))
+            except re.error:
+                self.windowRules = sorted(self.windowRules + merged, key=lambda rule: rule[0])   #Match them one by one then
+        self.cache = {}
+        self.generation = None
+
+    # Pattern as part of the merged expression or None if it has to be matched on its own. Patterns with groups of
+    # their own (which might be referenced by number) or flags that cannot be limited to a part are kept separate.
+    @staticmethod
+    def mergeable(pattern):
+        if not isinstance(pattern.pattern, str) or pattern.groups > 0:
+            return None
+        flags = pattern.flags & ~re.UNICODE
+        if flags & ~(re.IGNORECASE | re.MULTILINE | re.DOTALL | re.VERBOSE):
+            return None
+        letters = "".join(letter for flag, letter in ((re.IGNORECASE, "i"), (re.MULTILINE, "m"), (re.DOTALL, "s"), (re.VERBOSE, "x")) if flags & flag)
+        return f"(?{letters}:{pattern.pattern})" if letters else pattern.pattern
+
+    # Index of the first entry matching the window, or None
+    def matchWindow(self, window):
+        best = None
+        if window != None:
+            if self.windowPattern != None:
+                match = self.windowPattern.match(window)
+                if match != None:
+                    best = int(match.lastgroup[1:])
+            for index, pattern in self.windowRules:
+                if best != None and index > best:
+                    break
+                if pattern.match(window):
+                    best = index
+                    break
+        return best
+
+    # Index of the first entry with a running process, or None
+    def matchProcess(self, processes):
+        for index, process in self.processRules:
+            if process in processes:
+                return index
+        return None
+
+    # Returns the mode to use for the active window and running processes (usually a ProcessIndex) or None.
+    def select(self, window, processes):
+        generation = getattr(processes, "generation", None)
+        if generation == None:      #Cannot tell if the processes changed, so do not remember anything
+            return self.lookup(window, processes)
+        if generation != self.generation or len(self.cache) >= MATCH_CACHE_SIZE:
+            self.cache.clear()
+            self.generation = generation
+        if window not in self.cache:
+            self.cache[window] = self.lookup(window, processes)
+        return self.cache[window]
+
+    def lookup(self, window, processes):
+        candidates = [index for index in (self.matchWindow(window), self.matchProcess(processes), self.fallback) if index != None]
+        return self.mode(min(candidates)) if candidates else None
+
+    # Mode of an entry, instantiated first if the table only has its class. Always returns the same instance.
+    def mode(self, index):
+        if isinstance(self.modes[index], type):
+            self.modes[index] = self.modes[index]()
+        return self.modes[index]
@@ -4,9 +4,9 @@
 #- activate
 #Called when the mode becomes active. Usually used to set up static key assignment and icons
 #- poll
-#Called periodically and typically used to poll a state which you need to monitor. At the end you have to return an interval in seconds before the function is to be called again - otherwise it is not called a second time
+#Called periodically and typically used to poll a state which you need to monitor. At the end you have to return an interval in seconds before the function is to be called again - otherwise it is not called a second time (except when the status of the device is set via http)
 #- animate
-#Called up to 30 times per second, used for LED animation
+#Called up to 30 times per second, used for LED animation. Return the seconds until it needs to be called again or False if there is nothing to animate, so the controller can sleep in between. If nothing is returned, it is called 30 times per second.
 #- deactivate
 #Called when the mode becomes inactive. Used to clean up callback functions and images on the screen that are outside commonly overwritten areas.
 
@@ -15,79 +15,22 @@
 from inkkeys import *
 import time
 from threading import Timer
-from PIL import Image, ImageDraw, ImageFont
-from colorsys import hsv_to_rgb
 
 
         ############# Simple example. For Blender we just set up a few key assignments with corresponding images.
         ## Blender ## To be honest: Blender is just the minimalistic example here. Blender is very keyboard centric
         ############# and you should get used to the real shortcuts as it is much more efficient to stay on the keyboard all the time.
 
-class ModeBlender:
+#As it does not need any logic, the Blender mode is not a class but a declarative mode in "modes.json". Modes like this
+#are compiled into a bundle of ready-made commands and display tiles, see inkkeys/bundle.py.
 
-    def activate(self, device):
-        device.sendTextFor("title", "Blender", inverted=True) #Title
-
-        #Button1 (Jog dial press)
-        device.sendTextFor(1, "<   Play/Pause   >")
-        device.assignKey(KeyCode.SW1_PRESS, [event(DeviceCode.KEYBOARD, KeyboardKeycode.KEY_SPACE, ActionCode.PRESS)]) #Play/pause
-        device.assignKey(KeyCode.SW1_RELEASE, [event(DeviceCode.KEYBOARD, KeyboardKeycode.KEY_SPACE, ActionCode.RELEASE)])
-
-        #Jog dial rotation
-        device.assignKey(KeyCode.JOG_CW, [event(DeviceCode.KEYBOARD, KeyboardKeycode.KEY_RIGHT)]) #CW = Clock-wise, one frame forward
-        device.assignKey(KeyCode.JOG_CCW, [event(DeviceCode.KEYBOARD, KeyboardKeycode.KEY_LEFT)]) #CCW = Counter clock-wise, one frame back
-
-        #Button2 (top left)
-        device.sendIconFor(2, "icons/camera-reels.png")
-        device.assignKey(KeyCode.SW2_PRESS, [event(DeviceCode.KEYBOARD, KeyboardKeycode.KEYPAD_0, ActionCode.PRESS)]) #Set view to camera
-        device.assignKey(KeyCode.SW2_RELEASE, [event(DeviceCode.KEYBOARD, KeyboardKeycode.KEYPAD_0, ActionCode.RELEASE)])
-
-        #Button3 (left, second from top)
-        device.sendIconFor(3, "icons/person-bounding-box.png")
-        device.assignKey(KeyCode.SW3_PRESS, [event(DeviceCode.KEYBOARD, KeyboardKeycode.KEYPAD_DIVIDE, ActionCode.PRESS)]) #Isolation view
-        device.assignKey(KeyCode.SW3_RELEASE, [event(DeviceCode.KEYBOARD, KeyboardKeycode.KEYPAD_DIVIDE, ActionCode.RELEASE)])
-
-        #Button4 (left, third from top)
-        device.sendIconFor(4, "icons/dot.png")
-        device.assignKey(KeyCode.SW4_PRESS, []) #Not used, set to nothing.
-        device.assignKey(KeyCode.SW4_RELEASE, [])
-
-        #Button5 (bottom left)
-        device.sendIconFor(5, "icons/dot.png")
-        device.assignKey(KeyCode.SW5_PRESS, []) #Not used, set to nothing.
-        device.assignKey(KeyCode.SW5_RELEASE, [])
-
-        #Button6 (top right)
-        device.sendIconFor(6, "icons/aspect-ratio.png")
-        device.assignKey(KeyCode.SW6_PRESS, [event(DeviceCode.KEYBOARD, KeyboardKeycode.KEYPAD_DOT, ActionCode.PRESS)]) #Center on selection
-        device.assignKey(KeyCode.SW6_RELEASE, [event(DeviceCode.KEYBOARD, KeyboardKeycode.KEYPAD_DOT, ActionCode.RELEASE)])
-
-        #Button7 (right, second from top)
-        #Button4 (left, third from top)
-        device.sendIconFor(7, "icons/collection.png")
-        device.assignKey(KeyCode.SW7_PRESS, [event(DeviceCode.KEYBOARD, KeyboardKeycode.KEY_LEFT_CTRL, ActionCode.PRESS), event(DeviceCode.KEYBOARD, KeyboardKeycode.KEY_F12), event(DeviceCode.KEYBOARD, KeyboardKeycode.KEY_LEFT_CTRL, ActionCode.RELEASE)]) #Render sequence
-        device.assignKey(KeyCode.SW7_RELEASE, [])
-
-        #Button8 (right, third from top)
-        device.sendIconFor(8, "icons/dot.png")
-        device.assignKey(KeyCode.SW8_PRESS, []) #Not used, set to nothing.
-        device.assignKey(KeyCode.SW8_RELEASE, [])
-
-        #Button9 (bottom right)
-        device.sendIconFor(9, "icons/dot.png")
-        device.assignKey(KeyCode.SW9_PRESS, []) #Not used, set to nothing.
-        device.assignKey(KeyCode.SW9_RELEASE, [])
+#ModeBlender is kept for configurations that still refer to the class. It is the "Blender" mode of the bundle compiled
+#from "modes.json" (the default MODE_DEFINITIONS and MODE_BUNDLE of controller.py), taken from the bundle the
+#controller has loaded already.
+class ModeBlender(BundledMode):
 
-        device.updateDisplay()
-
-    def poll(self, device):
-        return False    # No polling in this example
-
-    def animate(self, device):
-        device.fadeLeds() #No LED animation is used in this mode, but we call "fadeLeds" anyway to fade colors that have been set in another mode before switching
-
-    def deactivate(self, device):
-        pass            # Nothing to clean up in this example
+    def __init__(self):
+        super().__init__(ModeBundle.load("modes.json", "modes.bundle"), "Blender")
 
 
 
@@ -156,7 +99,7 @@ class ModeGimp:
         return False #Nothing to poll
 
     def animate(self, device):
-        device.fadeLeds() #No LED animation is used in this mode, but we call "fadeLeds" anyway to fade colors that have been set in another mode before switching
+        return device.fadeLeds() #No LED animation is used in this mode, but we call "fadeLeds" anyway to fade colors that have been set in another mode before switching
 
     def deactivate(self, device):
         device.clearCallbacks() #Remove our callbacks if we switch to a different mode
@@ -238,36 +181,33 @@ class ModeFallback:
 
     def animate(self, device):
         if self.demoActive: #In demo mode, we animate the LEDs here
-            def rgbTupleToInt(rgb):
-                return (int(rgb[0]*255) << 16) | (int(rgb[1]*255) << 8) | int(rgb[2]*255)
-
-            t = time.time()
-            leds = [rgbTupleToInt(hsv_to_rgb(t + i/device.nLeds, 1, 1)) for i in range(device.nLeds)]
+            leds = rainbowFrame(device.nLeds, time.time()) #All LEDs around the hue circle, rotating once per second
             device.setLeds(leds)
+            return FRAME_TIME
         else:               #If not in demo mode, we call "fadeLeds" to create a fade animation for any color set anywhere in this mode
-            device.fadeLeds()
+            return device.fadeLeds()
 
     def poll(self, device):
         return False    #No polling required
 
     def animate(self, device):
-        pass    #In this mode we want permanent LED illumination. Do not fade or animate otherwise.
+        return False    #In this mode we want permanent LED illumination. Do not fade or animate otherwise.
 
     def deactivate(self, device):
         device.clearCallbacks() #Clear our callbacks if we switch to a different mode
 
     def poll(self, device):
         if device.status == "Error":
-            device.sendLedAnimation(2, 50, 20, r=255, iteration=10)
+            device.playAnimation(Pulse(0xff0000, repeat=10))
         if device.status == "Warning":
-            device.sendLedAnimation(2, 50, 20, r=247, g=160, b=0, iteration=10)
+            device.playAnimation(Pulse(0xf7a000, repeat=10))
         if device.status == "Done":
-            device.sendLedAnimation(2, 50, 20, g=255, iteration=2)
+            device.playAnimation(Pulse(0x00ff00, repeat=2))
         if device.status == "Working":
-            device.sendLedAnimation(2, 50, 20, r=0, g=156, b=247, iteration=10)
+            device.playAnimation(Pulse(0x009cf7, repeat=10))
         if device.status:
             device.setStatus("")
-        return 1 
+        return False    #Called again when the status changes
 
 class ModeMiniFallback:
 
@@ -328,19 +268,19 @@ class ModeMiniFallback:
 
     def poll(self, device):
         if device.status == "Error":
-            device.sendLedAnimation(2, 50, 20, r=255, iteration=10)
+            device.playAnimation(Pulse(0xff0000, repeat=10))
         if device.status == "Warning":
-            device.sendLedAnimation(2, 50, 20, r=247, g=160, b=0, iteration=10)
+            device.playAnimation(Pulse(0xf7a000, repeat=10))
         if device.status == "Done":
-            device.sendLedAnimation(2, 50, 20, g=255, iteration=2)
+            device.playAnimation(Pulse(0x00ff00, repeat=2))
         if device.status == "Working":
-            device.sendLedAnimation(2, 50, 20, r=0, g=156, b=247, iteration=10)
+            device.playAnimation(Pulse(0x009cf7, repeat=10))
         if device.status:
             device.setStatus("")
-        return 1    
+        return False    #Called again when the status changes
 
     def animate(self, device):
-        pass    #In this mode we want permanent LED illumination. Do not fade or animate otherwise.
+        return False    #In this mode we want permanent LED illumination. Do not fade or animate otherwise.
 
     def deactivate(self, device):
         device.clearCallbacks() #Clear our callbacks if we switch to a different mode
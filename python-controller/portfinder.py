@@ -0,0 +1,159 @@
+import os
+import sys
+import time
+import asyncio
+import threading
+from inkkeys.protocol import CommandCode
+from inkkeys.metrics import Metrics
+
+#Finds the serial port of the inkkeys and notices when it (re)appears, see main() in controller.py.
+#- The port that worked last time is tried first, so reconnecting usually does not need to probe anything.
+#- If there are several candidates, they are probed in parallel (each one gets an info request and has to answer with
+#  the complete info) instead of one after another with a timeout of several seconds each. As soon as one of them
+#  answers, the other probes are stopped and close their ports. The info of the winner is handed to the device, so it
+#  does not have to ask again.
+#- Instead of trying again every few seconds, waitForChange() returns as soon as the serial ports change. On Linux it
+#  is told about new device nodes by inotify on /dev, elsewhere it compares the list of ports a few times per second.
+#The time from losing the device to being connected again is kept in reconnectTimes and reported as reconnect_seconds.
+
+PROBE_TIMEOUT = 3       #Seconds a port has to answer the probe
+RETRY_INTERVAL = 3      #Try again after this many seconds even if the ports did not change (i.e. the device was busy)
+POLL_INTERVAL = 0.5     #Interval to compare the ports if there are no change notifications
+SETTLE_TIME = 0.05      #udev creates the device node and sets its permissions in separate steps, wait for both
+
+#inotify(7)
+IN_ATTRIB = 0x004
+IN_CREATE = 0x100
+IN_DELETE = 0x200
+
+# Ask a port for the info of the device. Returns the lines of the info (between "Inkkeys" and "Done") if it answers like
+# an inkkeys, otherwise None. Gives up early once the threading.Event cancelled is set. Blocks, so run it in a thread.
+def probePort(port, timeout=PROBE_TIMEOUT, cancelled=None):
+    import serial
+    try:
+        with serial.Serial(port, 115200, timeout=0.1, write_timeout=1) as ser:
+            ser.write((CommandCode.INFO.value + "\n").encode())
+            start = time.time()
+            data = b""
+            info = None     #Lines of the info once the header has been seen
+            while time.time() - start < timeout and not (cancelled != None and cancelled.is_set()):
+                data += ser.readline()
+                if not data.endswith(b"\n"):   #Nothing or only a part of a line within the read timeout
+                    continue
+                line = data.strip().decode(errors="replace")
+                data = b""
+                if line == "Inkkeys":
+                    info = []
+                elif info != None and line == "Done":
+                    return info
+                elif info != None:
+                    info.append(line)
+    except (serial.SerialException, OSError, ValueError):
+        pass
+    return None
+
+class PortFinder:
+
+    def __init__(self, vid, pid, metrics=None):
+        self.vid = vid
+        self.pid = pid
+        self.metrics = metrics if metrics != None else Metrics()
+        self.lastPort = None        #Port of the last successful connection
+        self.lostAt = None          #Time the connection was lost, None while connected or before the first connection
+        self.reconnectTimes = []    #Seconds from losing the device to being connected again, for each reconnect
+        self.changed = None         #Set by inotify when something in /dev changed, None without notifications
+        self.inotify = None
+
+    # Serial ports with the VID and PID of the inkkeys, the last good one first
+    def candidates(self):
+        import serial.tools.list_ports
+        ports = [port.device for port in serial.tools.list_ports.comports() if port.vid == self.vid and port.pid == self.pid]
+        if self.lastPort in ports:
+            ports.remove(self.lastPort)
+            ports.insert(0, self.lastPort)
+        return ports
+
+    # Ports to try, in this order, as (port, info) with the lines of the info if the port has been probed already and
+    # None otherwise. The last good port is returned right away. Otherwise several candidates are probed in parallel and
+    # the first one that answers is returned without waiting for the others, which are told to give up.
+    async def find(self):
+        ports = self.candidates()
+        if len(ports) <= 1 or ports[0] == self.lastPort:
+            return [(port, None) for port in ports]
+        loop = asyncio.get_running_loop()
+        cancelled = threading.Event()
+        probes = {loop.run_in_executor(None, probePort, port, PROBE_TIMEOUT, cancelled): port for port in ports}
+        pending = set(probes)
+        try:
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for probe in done:
+                    if probe.result() != None:
+                        return [(probes[probe], probe.result())]
+            return []
+        finally:
+            cancelled.set()         #Probes that are still running close their port within their read timeout...
+            for probe in pending:
+                probe.cancel()      #...and those that did not start yet do not open it at all
+
+    def connected(self, port):
+        self.lastPort = port
+        if self.lostAt != None:
+            self.reconnectTimes.append(time.time() - self.lostAt)
+            self.metrics.observe("reconnect_seconds", self.reconnectTimes[-1])
+            print(f"Reconnected after {self.reconnectTimes[-1]:.2f} seconds.")
+            self.lostAt = None
+        if self.changed != None:
+            self.changed.clear()    #Only changes after this connection matter for the next search
+
+    def disconnected(self):
+        if self.lostAt == None:
+            self.lostAt = time.time()
+
+    # Wait until the serial ports might have changed or RETRY_INTERVAL has passed
+    async def waitForChange(self):
+        if self.watch():
+            try:
+                await asyncio.wait_for(self.changed.wait(), RETRY_INTERVAL)
+            except asyncio.TimeoutError:
+                return
+            await asyncio.sleep(SETTLE_TIME)
+            self.changed.clear()
+            return
+        before = self.candidates()
+        start = time.time()
+        while time.time() - start < RETRY_INTERVAL:
+            await asyncio.sleep(POLL_INTERVAL)
+            if self.candidates() != before:
+                return
+
+    # Start watching /dev with inotify. Returns False if this is not possible on this system.
+    def watch(self):
+        if self.changed != None:
+            return True
+        if not sys.platform.startswith("linux"):
+            return False
+        try:
+            import ctypes
+            import ctypes.util
+            libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+            fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+            if fd < 0:
+                return False
+            if libc.inotify_add_watch(fd, b"/dev", IN_CREATE | IN_ATTRIB | IN_DELETE) < 0:
+                os.close(fd)
+                return False
+            asyncio.get_running_loop().add_reader(fd, self.notified)
+        except (OSError, AttributeError, NotImplementedError):
+            return False
+        self.inotify = fd
+        self.changed = asyncio.Event()
+        return True
+
+    def notified(self):
+        try:
+            while os.read(self.inotify, 4096):    #Only the fact that something changed matters, not what it was
+                pass
+        except BlockingIOError:
+            pass
+        self.changed.set()
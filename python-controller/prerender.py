@@ -0,0 +1,162 @@
+import os
+import copy
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor, Future
+from inkkeys.tilecache import TileCache
+
+#Renders the display tiles of all modes in the background, so activating a mode only has to send them (see main loop in
+#controller.py).
+#Modes do not declare their tiles, they send them in activate(). So each mode is activated once on a TileCollector,
+#which stands in for the device and only notes the tiles, and every tile that is not in the tile cache yet is rendered
+#into it. This runs in a single worker thread as a pass over all modes, which only happens when it might find something:
+#after connecting (the tiles depend on the display), after a mode has been activated for the first time and when a font
+#or a directory with icons changed since the last pass. Replacing or adding an icon changes the modification time of
+#its directory. An icon that is changed in place is not noticed, but activating a mode renders whatever is missing anyway.
+#Modes that were activated often recently are rendered first. This is remembered across restarts if there is a file
+#for it (next to the tile cache in controller.py).
+#The modes are those of the ModeMatcher, which only creates a mode given as class when it is selected for the first
+#time. Until then, the class is activated as an instance that is created without calling __init__, so prerendering
+#does not repeat whatever __init__ does (i.e. connecting somewhere). The modes in modes.py keep their state in class
+#attributes, so this works for them. A mode that cannot be activated like this is rendered once it has been created.
+#Modes that have been created are activated as a deep copy, so whatever activate() changes does not touch the mode in use.
+
+ACTIVATION_HALF_LIFE = 3600     #Seconds after which an activation only counts half for the order of the modes
+
+# Name of a mode (or of the class of a mode) to keep track of its activations
+def modeName(mode):
+    if isinstance(mode, type):
+        return mode.__name__
+    return getattr(mode, "name", type(mode).__name__)
+
+#Stands in for the device while a mode is activated to find out which tiles it sends. Everything else it does to the
+#device is ignored, attributes like the size of the display are those of the device.
+class TileCollector:
+
+    def __init__(self, device):
+        self.device = device
+        self.tiles = []     #(key function, render function, args, kwargs) of each tile
+        self.sources = set()    #The font and the directory of each icon, see Prerenderer.update
+
+    def sendIconFor(self, function, icon, *args, **kwargs):
+        self.tiles.append((self.device.iconTileKey, self.device.iconTileFor, (function, icon) + args, kwargs))
+        self.sources.add(os.path.dirname(icon) or ".")
+
+    def sendTextFor(self, function, text, *args, **kwargs):
+        self.tiles.append((self.device.textTileKey, self.device.textTileFor, (function, text) + args, kwargs))
+        self.sources.add(self.device.font)
+
+    def __getattr__(self, name):
+        value = getattr(self.device, name)
+        return self.ignore if callable(value) else value
+
+    def ignore(self, *args, **kwargs):
+        done = Future()
+        done.set_result(True)
+        return done
+
+class Prerenderer:
+
+    def __init__(self, device, modes, statsPath=None):
+        self.device = device
+        self.modes = modes              #Modes or classes of modes as in the modes table, see ModeMatcher.modes
+        self.statsPath = statsPath      #File to keep the activations in, None to start over with every restart
+        self.activations = self.loadActivations()  #[score, time of the last activation] by mode name
+        self.changed = False            #Activations that have not been saved yet
+        self.executor = None
+        self.job = None
+        self.pending = False            #A pass is due, see update()
+        self.seen = set()               #Names of the modes that have been activated since the start
+        self.sources = {}               #Modification time of the font and icon directories used by the last pass
+        self.rendered = 0               #Tiles rendered in the background so far
+        self.stopped = False            #Set by stop() to end a pass that is still running
+
+    def loadActivations(self):
+        if self.statsPath == None:
+            return {}
+        try:
+            with open(self.statsPath) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def saveActivations(self):
+        self.changed = False
+        try:
+            with open(self.statsPath + ".tmp", "w") as f:
+                json.dump(dict(self.activations), f)    #A copy, the main thread might add to it meanwhile
+            os.replace(self.statsPath + ".tmp", self.statsPath)
+        except OSError as e:
+            print("Could not store mode activations: ", e)
+
+    # A mode given as class has just been created when it is activated for the first time, so look at its tiles again
+    def activated(self, mode, now=None):
+        if now == None:
+            now = time.time()
+        name = modeName(mode)
+        self.activations[name] = [self.score(mode, now) + 1, now]
+        self.changed = self.statsPath != None
+        if name not in self.seen:
+            self.seen.add(name)
+            self.pending = True
+
+    # Activations of a mode, each one counting less the longer ago it was
+    def score(self, mode, now):
+        score, last = self.activations.get(modeName(mode), (0, now))
+        return score * 0.5**((now - last)/ACTIVATION_HALF_LIFE)
+
+    # Look for missing tiles with the next update(), i.e. after connecting to a device
+    def start(self):
+        self.pending = True
+
+    # Start a pass in the background if one is due. Unless a font or icon directory changed, this only compares a few
+    # modification times, so it is called with every iteration of the main loop and does not need a deadline of its own.
+    def update(self):
+        if not self.pending and any(TileCache.mtime(path) != mtime for path, mtime in self.sources.items()):
+            self.pending = True
+        if not self.pending or self.device.dispW <= 0 or self.device.dispH <= 0:
+            return      #Nothing to do or not connected, the tiles depend on the display
+        self.pending = False
+        if self.job != None and not self.job.running() and not self.job.done():
+            return      #The next pass has not started yet, so it will notice the changes as well
+        if self.executor == None:
+            self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="prerender")
+            self.stopped = False
+        self.job = self.executor.submit(self.render)
+
+    def render(self):
+        now = time.time()
+        modes = sorted(self.modes, key=lambda mode: -self.score(mode, now))    #Stable, so equal scores keep the order of the table
+        sources = {}
+        for mode in modes:
+            try:
+                collector = self.collect(mode)
+                for source in collector.sources - sources.keys():
+                    sources[source] = TileCache.mtime(source)   #Before rendering, so changes while rendering count
+                for key, tileFor, args, kwargs in collector.tiles:
+                    if self.stopped:
+                        return
+                    if not self.device.tileCache.contains(key(*args, **kwargs)):
+                        tileFor(*args, **kwargs)
+                        self.rendered += 1
+            except Exception as e:  #Only costs the head start, activating the mode renders whatever is missing
+                print("Could not prerender tiles of " + modeName(mode) + ": ", e)
+        self.sources = sources
+        if self.changed:
+            self.saveActivations()
+
+    # TileCollector with the tiles a mode sends when it is activated. The mode is activated as a deep copy, so the
+    # actual mode does not notice. A class is activated as an instance that has not been initialized.
+    def collect(self, mode):
+        collector = TileCollector(self.device)
+        if isinstance(mode, type):
+            mode.__new__(mode).activate(collector)
+        else:
+            copy.deepcopy(mode, {id(self.device): self.device}).activate(collector)    #A mode that keeps the device keeps the same one
+        return collector
+
+    def stop(self):
+        self.stopped = True
+        if self.executor != None:
+            self.executor.shutdown(wait=False, cancel_futures=True)
+            self.executor = None
@@ -1,35 +1,189 @@
 import sys
-import psutil
-
-if sys.platform in ['linux', 'linux2']:
-    import Xlib
-    import Xlib.display
-    display = Xlib.display.Display()
-    root = display.screen().root
-elif sys.platform in ['Windows', 'win32', 'cygwin']:
-    import win32gui
-elif sys.platform in ['Mac', 'darwin', 'os2', 'os2emx']:
-    from AppKit import NSWorkspace
-else:
+from threading import Thread
+from collections import Counter
+
+#psutil and the platform specific modules are only imported when they are used for the first time and the connection
+#to the X server is only opened by the first call to getActiveWindow, so importing this module does not slow down the
+#start of the controller. A controller that does not track any processes never imports psutil at all.
+
+if sys.platform not in ['linux', 'linux2', 'Windows', 'win32', 'cygwin', 'Mac', 'darwin', 'os2', 'os2emx']:
     print("Unknown platform: " + sys.platform)
 
+display = None  #Connection to the X server used by getActiveWindow, see xDisplay()
+root = None
+
+# Connection to the X server, opened on first use
+def xDisplay():
+    global display, root
+    if display == None:
+        import Xlib.display
+        display = Xlib.display.Display()
+        root = display.screen().root
+    return display, root
+
+# Forget the connection to the X server after it broke (i.e. because the X server restarted), the next call to
+# xDisplay() connects again
+def resetXDisplay():
+    global display, root
+    display = None
+    root = None
+
 def getActiveProcesses():
+    import psutil
     return {p.name() for p in psutil.process_iter(["name"])}
 
+#Keeps track of running processes without looking at all of them every time.
+#Only the names given to the constructor are tracked (usually the processes referenced by the modes). Each update only
+#compares the PIDs and their creation times to the previous ones and asks for the names of new processes, so apart from
+#the first update the expensive lookups depend on the number of processes that were started or ended. A process is known
+#by its PID and creation time, so a PID that the OS reused for a new process counts as a new process.
+#Use "name in index" to check if a process is running.
+class ProcessIndex:
+
+    def __init__(self, names):
+        self.names = set(names)
+        self.pids = {}          #Name of every known (PID, creation time), None if it is not one we are interested in
+        self.running = Counter() #Number of running processes for each tracked name
+        self.generation = 0     #Incremented whenever a tracked process started or the last one of a name ended
+
+    def __contains__(self, name):
+        return name in self.running
+
+    # Look for started and ended processes. Returns True if this changed the set of running tracked processes.
+    def update(self):
+        if not self.names:
+            return False        #Nothing to track, so there is no need to look at the processes at all
+        import psutil
+        processes = {}
+        for pid in psutil.pids():
+            try:
+                process = psutil.Process(pid)
+                processes[(pid, process.create_time())] = process
+            except psutil.Error:
+                continue        #Already gone or not accessible, try again next time
+        changed = False
+        for key in self.pids.keys() - processes.keys():
+            name = self.pids.pop(key)
+            if name != None:
+                self.running[name] -= 1
+                if self.running[name] == 0:
+                    del self.running[name]
+                    changed = True
+        for key in processes.keys() - self.pids.keys():
+            try:
+                name = processes[key].name()
+            except psutil.Error:
+                continue
+            if name not in self.names:
+                name = None
+            self.pids[key] = name
+            if name != None:
+                self.running[name] += 1
+                changed = changed or self.running[name] == 1
+        if changed:
+            self.generation += 1
+        return changed
+
+# Class of the window that has the focus on an X display
+def getActiveWindowClass(display, root):
+    import Xlib.X
+    windowID = root.get_full_property(display.intern_atom('_NET_ACTIVE_WINDOW'), Xlib.X.AnyPropertyType).value[0]
+    window = display.create_resource_object('window', windowID)
+    return window.get_wm_class()[0]
+
 # Adapted from Martin Thoma on stackoverflow
 # https://stackoverflow.com/a/36419702/8068814
 def getActiveWindow():
     active_window_name = None
     try:
         if sys.platform in ['linux', 'linux2']:
-            windowID = root.get_full_property(display.intern_atom('_NET_ACTIVE_WINDOW'), Xlib.X.AnyPropertyType).value[0]
-            window = display.create_resource_object('window', windowID)
-            return window.get_wm_class()[0]
+            import Xlib.error
+            try:
+                return getActiveWindowClass(*xDisplay())
+            except Xlib.error.ConnectionClosedError:
+                resetXDisplay()
+                raise
         elif sys.platform in ['Windows', 'win32', 'cygwin']:
+            import win32gui
             window = win32gui.GetForegroundWindow()
             active_window_name = win32gui.GetWindowText(window)
         elif sys.platform in ['Mac', 'darwin', 'os2', 'os2emx']:
+            from AppKit import NSWorkspace
             active_window_name = (NSWorkspace.sharedWorkspace().activeApplication()['NSApplicationName'])
     except:
         print("Could not get active window: ", sys.exc_info()[0])
     return active_window_name
+
+#Reports changes of the active window as they happen instead of having to poll getActiveWindow.
+#On X11 this listens for PropertyNotify events of _NET_ACTIVE_WINDOW on the root window, using a separate connection
+#to the X server in a background thread. onChange is called from that thread with the new window (or None if no window
+#has the focus). On other platforms start() returns False and getActiveWindow needs to be polled instead.
+#If the connection to the X server breaks, the watcher stops, sets failed and calls onStop (also from the thread), so
+#getActiveWindow can be polled from then on.
+class WindowWatcher:
+
+    def __init__(self, onChange, onStop=None):
+        self.onChange = onChange
+        self.onStop = onStop
+        self.running = False
+        self.failed = False
+        self.display = None
+        self.lastWindow = None      #Active window as of the last event, already known when start() returns
+
+    # Start watching. Returns False if there is no event source on this platform.
+    def start(self):
+        if sys.platform not in ['linux', 'linux2']:
+            return False
+        try:
+            import Xlib.X
+            import Xlib.display
+            self.display = Xlib.display.Display()
+            self.root = self.display.screen().root
+            self.atom = self.display.intern_atom('_NET_ACTIVE_WINDOW')
+            self.root.change_attributes(event_mask=Xlib.X.PropertyChangeMask)
+        except:
+            print("Cannot watch the active window: ", sys.exc_info()[0])
+            return False
+        self.lastWindow = self.activeWindow()
+        self.running = True
+        self.failed = False
+        Thread(target=self.run, daemon=True).start()
+        return True
+
+    def stop(self):
+        self.running = False
+        if self.display != None:
+            try:
+                self.display.close()    #Also ends a blocking next_event() in the thread
+            except:
+                pass
+            self.display = None
+
+    def run(self):
+        import Xlib.X
+        self.report()   #In case it changed since start()
+        while self.running:
+            try:
+                event = self.display.next_event()   #Blocks until the X server sends something
+            except:
+                if self.running:
+                    print("Stopped watching the active window: ", sys.exc_info()[0])
+                    self.failed = True
+                    self.stop()
+                    if self.onStop != None:
+                        self.onStop()
+                break
+            if event.type == Xlib.X.PropertyNotify and event.atom == self.atom:
+                self.report()
+
+    def activeWindow(self):
+        try:
+            return getActiveWindowClass(self.display, self.root)
+        except:
+            return None     #No window with focus or it disappeared while we asked for its class
+
+    def report(self):
+        window = self.activeWindow()
+        if window != self.lastWindow:
+            self.lastWindow = window
+            self.onChange(window)
@@ -0,0 +1,92 @@
+#Plays back a recording of the serial traffic of a device (see RECORD_FILE in controller.py and inkkeys/recorder.py).
+#Everything the controller sent is sent again at the same time (or speed times faster) through the Transport of a
+#Device, so the whole serial path is used just like in the original session. The answers come either from the
+#recording itself, which reproduces the timing of the original device including any hitches (i.e. an "ok" after a
+#display refresh that took far too long), or with --simulate from a simulated device, to see how the same session
+#performs with changes of the protocol or the simulated firmware.
+#
+#Usage: python3 replay.py RECORDING [--speed S] [--simulate [--baud B] [--instant] [--raw]]
+#
+#Reported are the duration of the replay, the time until each acknowledged command (display refreshes) was answered
+#and the data sent by command.
+
+import sys
+import time
+import argparse
+from collections import Counter, defaultdict
+
+from inkkeys import *
+
+parser = argparse.ArgumentParser(description="Replay a recording of the serial traffic of an inkkeys device.")
+parser.add_argument("recording", help="File written by Device.record()")
+parser.add_argument("--speed", type=float, default=1.0, help="Play back this many times faster than the original session")
+parser.add_argument("--simulate", action="store_true", help="Send the traffic to a simulated device instead of replaying the recorded answers")
+parser.add_argument("--baud", type=int, default=115200, help="Simulated baud rate (with --simulate)")
+parser.add_argument("--instant", action="store_true", help="Do not simulate transfer and refresh times (with --simulate)")
+parser.add_argument("--raw", action="store_true", help="Simulate a firmware without any of the optional features (with --simulate)")
+parser.add_argument("--stall", type=float, default=1.0, help="Report acknowledgements that took longer than this many seconds")
+args = parser.parse_args()
+
+# Label of the data of a record, the command code or, for refreshes, the command with the refresh type
+def commandLabel(data):
+    code = data[:1].decode("ISO-8859-1")
+    if code == CommandCode.REFRESH.value:
+        return data[:3].decode("ISO-8859-1")
+    return code if code.isalpha() else "binary"
+
+records = readRecording(args.recording)
+outbound = [(t, kind, data) for t, kind, data in records if kind in (RECORD_OUT, RECORD_OUT_ACK)]
+if not records:
+    print("The recording is empty.")
+    sys.exit(1)
+print(f"{len(outbound)} commands sent and {len(records) - len(outbound)} lines received in {records[-1][0]:.1f} seconds")
+
+if args.simulate:
+    ser = SimulatedSerial(baudrate=args.baud, realtime=not args.instant, capabilities=() if args.raw else (CapabilityCode.RLE.value, CapabilityCode.LED_PIXELS.value, CapabilityCode.RAINBOW.value))
+else:
+    ser = ReplaySerial(records, speed=args.speed)
+
+device = Device()
+device.debug = False
+device.attach(ser)
+
+acks = defaultdict(list)    #(time in the recording, seconds until the ok or None if it timed out) by command
+byCommand = Counter()
+pending = []
+
+def acknowledged(label, t, sent):
+    def done(future):
+        acks[label].append((t, time.time() - sent if future.result() else None))
+    return done
+
+start = time.time()
+if not args.simulate:
+    ser.start()     #Answers are due relative to this
+for t, kind, data in outbound:
+    delay = start + t/args.speed - time.time()
+    if delay > 0:
+        time.sleep(delay)
+    label = commandLabel(data)
+    byCommand[label] += len(data)
+    future = device.transport.send(data, PRIORITY_CONTROL, ack=kind == RECORD_OUT_ACK, command=label)   #One priority keeps the recorded order
+    if kind == RECORD_OUT_ACK:
+        future.add_done_callback(acknowledged(label, t, time.time()))
+        pending.append(future)
+for future in pending:
+    future.result()
+if not args.simulate:
+    while not ser.done():
+        time.sleep(0.01)
+duration = time.time() - start
+device.disconnect()
+
+print(f"Replayed in {duration:.2f} seconds ({records[-1][0]/args.speed:.2f} expected at speed {args.speed:g})" + (", simulated device" if args.simulate else ", recorded answers"))
+print(f"{'command':<10}{'count':>7}{'mean ms':>10}{'max ms':>10}{'timeouts':>10}")
+for label, times in sorted(acks.items()):
+    answered = [seconds for t, seconds in times if seconds != None]
+    mean = sum(answered)/len(answered)*1000 if answered else 0
+    print(f"{label:<10}{len(times):>7}{mean:>10.1f}{max(answered, default=0)*1000:>10.1f}{len(times) - len(answered):>10}")
+stalls = sorted((t, label, seconds) for label, times in acks.items() for t, seconds in times if seconds == None or seconds > args.stall)
+for t, label, seconds in stalls:
+    print(f"Stall at {t:.2f}s: {label} " + (f"took {seconds:.2f} seconds" if seconds != None else "was never acknowledged"))
+print("Bytes sent by command: " + ", ".join(f"{code}: {count}" for code, count in sorted(byCommand.items())))
@@ -0,0 +1,42 @@
+import sys
+import time
+from contextlib import contextmanager
+
+#Measures where the controller spends its time until it is ready, enabled with "controller.py --profile-startup".
+#The startup is split into phases (imports and initialization steps). For each phase, the report lists the packages
+#that were imported during it, which shows which dependency makes a phase expensive. The report is printed once, when
+#the device is connected and the first mode is active. Disabled, a phase costs nothing but the call itself.
+
+STANDARD_LIBRARY = getattr(sys, "stdlib_module_names", frozenset())    #Not listed as imported packages (Python 3.10+)
+
+class StartupProfile:
+
+    def __init__(self, enabled):
+        self.enabled = enabled
+        self.start = time.perf_counter()
+        self.phases = []    #(name, seconds, packages imported during the phase)
+
+    @contextmanager
+    def phase(self, name):
+        if not self.enabled:
+            yield
+            return
+        modules = set(sys.modules)
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            packages = sorted({module.partition(".")[0] for module in sys.modules.keys() - modules} - STANDARD_LIBRARY)
+            self.phases.append((name, time.perf_counter() - start, packages))
+
+    # Print the phases and the total time since the profile was created, only the first time this is called
+    def report(self, what):
+        if not self.enabled:
+            return
+        self.enabled = False
+        total = time.perf_counter() - self.start
+        print("Startup profile:")
+        for name, duration, packages in self.phases:
+            print(f"{duration*1000:9.1f} ms  {name}" + (" (imported " + ", ".join(packages) + ")" if packages else ""))
+        print(f"{(total - sum(phase[1] for phase in self.phases))*1000:9.1f} ms  everything else")
+        print(f"{total*1000:9.1f} ms  until {what}")
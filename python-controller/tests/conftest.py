@@ -0,0 +1,13 @@
+import os
+import sys
+import pytest
+
+#The tests import inkkeys and the helper modules like controller.py does and load icons and fonts relative to
+#python-controller, so they can be run from anywhere with "python -m pytest python-controller/tests".
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+@pytest.fixture(autouse=True)
+def inRoot(monkeypatch):
+    monkeypatch.chdir(ROOT)
@@ -0,0 +1,110 @@
+import pytest
+from inkkeys import *
+
+#Stands in for the device and notes what the player sends
+class LedDevice:
+
+    def __init__(self, capabilities=()):
+        self.nLeds = 2
+        self.capabilities = set(capabilities)
+        self.frames = []
+        self.animations = []
+
+    def sendLedFrame(self, frame):
+        self.frames.append(list(frame))
+
+    def sendLedAnimation(self, animation, steps, delay=0, brightness=0, r=0, g=0, b=0, iteration=1):
+        self.animations.append((animation, iteration))
+
+def colors(device):
+    return [frame[0] for frame in device.frames]
+
+def test_static_colors_are_sent_once():
+    device = LedDevice()
+    player = AnimationPlayer(device)
+    assert player.play(Sequence(Solid(1, 1.0), Solid(2, 1.0)), now=0) == 1.0
+    assert player.update(0.5) == 0.5
+    assert player.update(1.5) == 0.5
+    assert player.update(2.0) == None
+    assert colors(device) == [1, 2]
+    assert not player.playing()
+
+def test_pulse_runs_on_the_firmware():
+    device = LedDevice()
+    player = AnimationPlayer(device)
+    pulse = Pulse(0x0000ff, repeat=3)
+    player.play(pulse, now=0)
+    assert device.animations == [(FIRMWARE_BLINK, 3)]
+    assert device.frames == []
+    player.update(pulse.duration)
+    assert not player.playing()
+
+def test_forever_restarts_the_firmware():
+    device = LedDevice()
+    player = AnimationPlayer(device)
+    pulse = Pulse(0x0000ff, repeat=None)
+    wait = player.play(pulse, now=0)
+    assert wait == MAX_ITERATIONS*pulse.period()
+    player.update(wait)
+    assert device.animations == [(FIRMWARE_BLINK, MAX_ITERATIONS), (FIRMWARE_STOP, 1), (FIRMWARE_BLINK, MAX_ITERATIONS)]
+
+def test_rainbow_is_streamed_without_the_capability():
+    device = LedDevice()
+    player = AnimationPlayer(device)
+    assert player.play(Rainbow(repeat=1), now=0) == FRAME_TIME
+    assert device.animations == [] and len(device.frames) == 1
+    device = LedDevice([CapabilityCode.RAINBOW.value])
+    AnimationPlayer(device).play(Rainbow(repeat=1), now=0)
+    assert device.animations[0][0] == FIRMWARE_RAINBOW
+
+def test_fade_reaches_its_target():
+    device = LedDevice()
+    player = AnimationPlayer(device)
+    player.play(Fade(0x000000, 0x0000ff, 1.0), now=0)
+    player.update(0.5)
+    player.update(1.2)
+    assert colors(device) == [0, 0x7f, 0xff]
+
+def test_sequence_repeats_forever():
+    device = LedDevice()
+    player = AnimationPlayer(device)
+    player.play(Sequence(Solid(1, 1.0), Solid(2, 1.0), repeat=None), now=0)
+    for t in range(1, 5):
+        player.update(t)
+    assert colors(device) == [1, 2, 1, 2, 1]
+
+def test_nested_forever_only_repeats_itself():
+    device = LedDevice()
+    player = AnimationPlayer(device)
+    player.play(Sequence(Solid(1, 1.0), Sequence(Solid(2, 1.0), Solid(3, 1.0), repeat=None), Solid(4, 1.0)), now=0)
+    for t in range(1, 6):
+        player.update(t)
+    assert colors(device) == [1, 2, 3, 2, 3, 2]
+
+def test_nested_sequence_repeats():
+    device = LedDevice()
+    player = AnimationPlayer(device)
+    animation = Sequence(Solid(1, 1.0), Sequence(Solid(2, 1.0), repeat=2), repeat=2)
+    assert animation.duration == 6.0
+    player.play(animation, now=0)
+    for t in range(1, 7):
+        player.update(t)
+    assert colors(device) == [1, 2, 2, 1, 2, 2]
+    assert not player.playing()
+
+def test_empty_forever_sequence_plays_nothing():
+    player = AnimationPlayer(LedDevice())
+    assert player.play(Sequence(repeat=None), now=0) == None
+
+def test_forever_sequence_needs_a_duration():
+    with pytest.raises(ValueError):
+        Sequence(Solid(1, 0), Solid(2, 0), repeat=None)
+    with pytest.raises(ValueError):
+        Sequence(Sequence(Solid(1, 0), repeat=3), repeat=None)
+    Sequence(Solid(1, 0), Solid(2), repeat=None)        #Stays at the second color forever
+    Sequence(Solid(1, 0), Solid(2, 0))                  #Played only once
+
+def test_default_frame_keeps_the_leds():
+    device = Device()
+    device.ledFrame = ledFrame([1, 2])
+    assert Animation().frame(device, 0.5) == device.ledFrame
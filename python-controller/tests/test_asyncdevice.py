@@ -0,0 +1,64 @@
+import asyncio
+import sys
+import serial
+from inkkeys import *
+
+#Simulated device with the hardware test firmware
+class HardwareTestSerial(SimulatedSerial):
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(realtime=False)
+        self.closed = False
+
+    def respond(self, *lines):
+        super().respond(*("TEST 1" if line == "TEST 0" else line for line in lines))
+
+    def close(self):
+        self.closed = True
+
+def test_request_info():
+    async def run():
+        device = AsyncDevice()
+        device.debug = False
+        device.attach(SimulatedSerial(realtime=False))
+        assert device.readerThread != None     #The simulator cannot be watched by the event loop
+        assert await device.request_info(3)
+        assert (device.dispW, device.dispH) == (128, 296)
+        device.disconnect()
+    asyncio.run(run())
+
+def test_lines_arrive_as_callbacks():
+    async def run():
+        device = AsyncDevice()
+        device.debug = False
+        sim = SimulatedSerial(realtime=False)
+        device.attach(sim)
+        pressed = asyncio.Event()
+        device.registerCallback(lambda: pressed.set(), KeyCode.SW2_PRESS)
+        sim.press("2p")
+        await asyncio.wait_for(pressed.wait(), 2)
+        device.disconnect()
+    asyncio.run(run())
+
+def test_test_firmware_is_disconnected(monkeypatch):
+    ports = []
+    monkeypatch.setattr(serial, "Serial", lambda *args, **kwargs: ports.append(HardwareTestSerial()) or ports[-1])
+    async def run():
+        device = AsyncDevice()
+        device.debug = False
+        assert not await device.open("test")
+        assert device.transport == None and device.ser == None
+        assert ports[0].closed
+    asyncio.run(run())
+
+def test_received_is_not_shared():
+    assert AsyncDevice().received is not AsyncDevice().received
+
+def test_only_file_descriptors_are_watched():
+    async def run():
+        device = AsyncDevice()
+        device.loop = asyncio.get_running_loop()
+        assert not device.canWatch(SimulatedSerial(realtime=False))
+        with open(__file__) as f:
+            assert device.canWatch(f) == (sys.platform not in ['Windows', 'win32', 'cygwin'])
+    asyncio.run(run())
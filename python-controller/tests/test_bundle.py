@@ -0,0 +1,118 @@
+import os
+import json
+import time
+from inkkeys import *
+
+DEFINITIONS = {
+    "Test": {
+        "title": {"text": "Test", "inverted": True},
+        "display": {"2": {"icon": "icons/alarm.png"}, "3": {"text": "Three"}},
+        "keys": {"SW2_PRESS": ["KEYBOARD KEY_A PRESS", "DELAY 10"], "SW2_RELEASE": ["KEYBOARD KEY_A RELEASE"], "JOG_CW": ["CONSUMER MEDIA_VOLUME_UP"], "SW3_PRESS": []}
+    }
+}
+
+#Stands in for the device and notes what a mode sends
+class ModeDevice:
+
+    def __init__(self, geometry=BUNDLE_GEOMETRY):
+        self.dispW, self.dispH, self.bannerHeight = geometry
+        self.commands = []
+        self.images = []
+        self.texts = []
+
+    def assignCommand(self, key, command):
+        self.commands.append(command)
+
+    def sendPackedImage(self, x, y, w, h, data):
+        self.images.append((x, y, w, h, bytes(data)))
+
+    def sendIconFor(self, function, icon, **kwargs):
+        self.texts.append((function, icon))
+
+    def sendTextFor(self, function, text, **kwargs):
+        self.texts.append((function, text))
+
+    def updateDisplay(self):
+        pass
+
+def test_parse_event():
+    assert parseEvent("KEYBOARD KEY_SPACE PRESS") == event(DeviceCode.KEYBOARD, KeyboardKeycode.KEY_SPACE, ActionCode.PRESS)
+    assert parseEvent("MOUSE MOUSE_WHEEL -1") == event(DeviceCode.MOUSE, MouseAxisCode.MOUSE_WHEEL, -1)
+    assert parseEvent("DELAY 10") == event(DELAY, 10)
+
+def test_round_trip(tmp_path):
+    path = str(tmp_path / "test.bundle")
+    compileModes(DEFINITIONS, path)
+    bundle = ModeBundle(path)
+    assert bundle.names() == ["Test"]
+    assert not bundle.stale()
+    device = ModeDevice()
+    bundle.mode("Test").activate(device)
+    assert device.commands[0] == "A 2p k4p d10"
+    assert "A 3p" in device.commands
+    renderer = Device()
+    renderer.dispW, renderer.dispH, renderer.bannerHeight = BUNDLE_GEOMETRY
+    assert device.images == [renderer.textTileFor("title", "Test", inverted=True), renderer.iconTileFor(2, "icons/alarm.png"), renderer.textTileFor(3, "Three")]
+    assert bundle.mode("Test") is bundle.mode("Test")
+
+def test_other_geometry_renders_the_tiles(tmp_path):
+    path = str(tmp_path / "test.bundle")
+    compileModes(DEFINITIONS, path)
+    device = ModeDevice((64, 148, 10))
+    ModeBundle(path).mode("Test").activate(device)
+    assert device.images == []
+    assert device.texts == [("title", "Test"), (2, "icons/alarm.png"), (3, "Three")]
+
+def test_load_compiles_again_when_a_source_changes(tmp_path):
+    definitions = str(tmp_path / "modes.json")
+    path = str(tmp_path / "modes.bundle")
+    with open(definitions, "w") as f:
+        json.dump(DEFINITIONS, f)
+    bundle = ModeBundle.load(definitions, path)
+    assert not bundle.stale()
+    later = time.time() + 10
+    os.utime(definitions, (later, later))
+    assert bundle.stale()
+    bundle = ModeBundle.load(definitions, path)
+    assert not bundle.stale()
+
+def test_load_returns_the_loaded_bundle(tmp_path):
+    definitions = str(tmp_path / "modes.json")
+    path = str(tmp_path / "modes.bundle")
+    with open(definitions, "w") as f:
+        json.dump(DEFINITIONS, f)
+    bundle = ModeBundle.load(definitions, path)
+    assert ModeBundle.load(definitions, path) is bundle
+    bundle.close()
+    assert ModeBundle.load(definitions, path) is not bundle
+
+def test_other_renderer_is_stale(tmp_path, monkeypatch):
+    from inkkeys import bundle as bundleModule
+    definitions = str(tmp_path / "modes.json")
+    path = str(tmp_path / "modes.bundle")
+    with open(definitions, "w") as f:
+        json.dump(DEFINITIONS, f)
+    bundle = ModeBundle.load(definitions, path)
+    monkeypatch.setattr(bundleModule, "RENDER_VERSION", RENDER_VERSION + 1)
+    assert bundle.stale()
+    bundle = ModeBundle.load(definitions, path)
+    assert bundle.index["renderer"] == RENDER_VERSION + 1
+
+def test_load_replaces_a_broken_bundle(tmp_path):
+    definitions = str(tmp_path / "modes.json")
+    path = str(tmp_path / "modes.bundle")
+    with open(definitions, "w") as f:
+        json.dump(DEFINITIONS, f)
+    with open(path, "wb") as f:
+        f.write(b"garbage")
+    assert ModeBundle.load(definitions, path).names() == ["Test"]
+
+def test_mode_blender_is_the_bundled_mode():
+    from modes import ModeBlender
+    bundle = ModeBundle.load("modes.json", "modes.bundle")    #Like the controller does
+    mode = ModeBlender()
+    assert all(tile[4].obj is bundle.data for tile in mode.tiles)
+    assert mode.name == "Blender"
+    device = ModeDevice()
+    mode.activate(device)
+    assert len(device.images) == 10
@@ -0,0 +1,41 @@
+import random
+from inkkeys import *
+
+def test_runs_and_literals():
+    data = b"\xff"*10 + b"abc" + b"\x00"*3
+    packed = packbits(data)
+    assert packed == bytes([256 - 9, 0xff, 2]) + b"abc" + bytes([256 - 2, 0])
+    assert unpackbits(packed) == data
+
+def test_long_runs_and_literals_are_split():
+    data = b"\x00"*300 + bytes(range(256))*2
+    packed = packbits(data)
+    assert unpackbits(packed) == data
+    decoder = PackBitsDecoder()
+    assert max(len(decoder.feed(byte)) for byte in packed) <= MAX_BLOCK
+
+def test_leftover_single_byte_of_a_run():
+    data = b"\x00"*129 + b"x"
+    assert unpackbits(packbits(data)) == data
+
+def test_round_trip():
+    rng = random.Random(1)
+    for _ in range(200):
+        data = bytes(rng.choice((0, 0xff, rng.randrange(256))) for _ in range(rng.randrange(300)))
+        assert unpackbits(packbits(data)) == data
+
+def test_decoder_stops_at_size():
+    assert unpackbits(packbits(b"\x00"*8) + b"\x80garbage", 8) == b"\x00"*8
+
+def test_compressed_image_on_the_simulated_display():
+    sim = SimulatedSerial(realtime=False)
+    sim.timeout = 0.05
+    device = Device()
+    device.debug = False
+    device.attach(sim)
+    assert device.requestInfo(3)
+    data = bytes([WHITE])*40 + bytes(range(8)) + bytes(16)
+    device.sendPackedImage(0, 10, 64, 8, data).result(2)
+    assert sim.commands[CommandCode.DISPLAY_COMPRESSED.value] == 1
+    assert cropPacked(sim.display.data, rowBytes(128), 10, 17, 0, 7) == data
+    device.disconnect()
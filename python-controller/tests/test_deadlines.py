@@ -0,0 +1,90 @@
+import pytest
+import time
+from inkkeys import *
+from deadlines import *
+
+#Mode that returns the given values from poll() and animate() and counts the calls
+class ScheduledMode:
+
+    def __init__(self, polls=(), animations=()):
+        self.polls = list(polls)
+        self.animations = list(animations)
+        self.polled = 0
+
+    def poll(self, device):
+        self.polled += 1
+        return self.polls.pop(0)
+
+    def animate(self, device):
+        return self.animations.pop(0)
+
+class StatusDevice:
+    status = False
+
+def test_nothing_due_sleeps_until_woken_up():
+    deadlines = Deadlines()
+    deadlines.add(None)
+    assert deadlines.timeout(100, 100) == None
+
+def test_earliest_deadline_but_never_faster_than_30fps():
+    deadlines = Deadlines()
+    deadlines.add(105)
+    deadlines.add(102)
+    assert deadlines.timeout(100, 100.5) == 1.5
+    deadlines.add(100)
+    assert deadlines.timeout(100, 100) == pytest.approx(FRAME_TIME)
+    assert deadlines.timeout(100, 101) == 0     #Overdue
+
+def test_poll_delay_is_honored():
+    mode = ScheduledMode(polls=[2.0, 1.0])
+    poller = ModePoller(StatusDevice())
+    assert poller.update(mode, 10) == 12.0
+    assert poller.update(mode, 11) == 12.0
+    assert mode.polled == 1
+    assert poller.update(mode, 12) == 13.0
+    assert mode.polled == 2
+
+def test_false_stops_polling():
+    mode = ScheduledMode(polls=[False, None])
+    poller = ModePoller(StatusDevice())
+    assert poller.update(mode, 10) == None
+    assert poller.update(mode, 100) == None
+    assert mode.polled == 1
+    poller.reset()                              #A new mode is polled once
+    assert poller.update(mode, 101) == None
+    assert mode.polled == 2
+
+def test_status_change_forces_a_poll():
+    device = StatusDevice()
+    mode = ScheduledMode(polls=[False, 60.0, 60.0])
+    poller = ModePoller(device)
+    poller.update(mode, 10)
+    device.status = "Error"
+    assert poller.update(mode, 11) == 71.0
+    assert poller.update(mode, 12) == 71.0
+    device.status = "Done"
+    assert poller.update(mode, 13) == 73.0
+    assert mode.polled == 3
+
+def test_animation_deadlines():
+    device = StatusDevice()
+    mode = ScheduledMode(animations=[None, False, 0.25])
+    assert animateMode(mode, device, 10) == 10 + FRAME_TIME   #Modes that do not tell us are animated at 30fps
+    assert animateMode(mode, device, 10) == None
+    assert animateMode(mode, device, 10) == 10.25
+
+def test_fading_leds_wake_up_only_while_fading(monkeypatch):
+    device = Device()
+    device.nLeds = 2
+    sent = []
+    device.sendLedFrame = sent.append
+    assert device.fadeLeds() == False           #Nothing set
+    clock = [100.0]
+    monkeypatch.setattr(time, "time", lambda: clock[0])
+    device.setLeds([0xff0000, 0x00ff00])
+    assert device.fadeLeds() == 3.0             #On for 3 seconds
+    clock[0] = 103.25
+    assert device.fadeLeds() == FRAME_TIME      #Fading
+    clock[0] = 104.0
+    assert device.fadeLeds() == False           #Faded out
+    assert list(sent[-1]) == [0, 0]
@@ -0,0 +1,110 @@
+import queue
+import time
+from concurrent.futures import Future
+from inkkeys import *
+
+#Transport that only collects what is sent, as (command, data)
+class SentTransport:
+
+    def __init__(self):
+        self.sent = []
+
+    def send(self, data, priority=PRIORITY_CONTROL, ack=False, timeout=5, command="other"):
+        self.sent.append((command, data))
+        future = Future()
+        future.set_result(True)
+        return future
+
+    def check(self):
+        pass
+
+    def close(self):
+        pass
+
+def quietDevice():
+    device = Device()
+    device.debug = False
+    device.transport = SentTransport()
+    return device
+
+A = [event(DeviceCode.KEYBOARD, KeyboardKeycode.KEY_A)]
+B = [event(DeviceCode.KEYBOARD, KeyboardKeycode.KEY_B)]
+
+def test_unchanged_assignments_are_skipped():
+    device = quietDevice()
+    device.assignKey(KeyCode.SW2_PRESS, A)
+    device.flushKeys()
+    assert device.transport.sent == [("A", b"A 2p k4\n")]
+    device.assignKey(KeyCode.SW2_PRESS, A)
+    assert device.flushKeys() == None
+    device.assignKey(KeyCode.SW2_PRESS, B)     #Changed and changed back before being sent
+    device.assignKey(KeyCode.SW2_PRESS, A)
+    assert device.flushKeys() == None
+    assert len(device.transport.sent) == 1
+
+def test_pending_assignments_are_sent_in_one_write():
+    device = quietDevice()
+    device.assignKey(KeyCode.SW2_PRESS, A)
+    device.assignKey(KeyCode.SW3_PRESS, B)
+    device.assignKey(KeyCode.SW4_PRESS, [])
+    device.flushKeys()
+    assert device.transport.sent == [("A", b"A 2p k4\nA 3p k5\nA 4p\n")]
+
+def test_assignments_are_sent_before_the_next_command():
+    device = quietDevice()
+    device.assignKey(KeyCode.SW2_PRESS, A)
+    device.sendToDevice("R p")
+    assert device.transport.sent == [("A", b"A 2p k4\n"), ("R p", b"R p\n")]
+    device.assignKey(KeyCode.SW3_PRESS, B)
+    device.inbound = queue.Queue()
+    device.poll()                           #Polling sends them as well
+    assert device.transport.sent[-1] == ("A", b"A 3p k5\n")
+
+def test_keymap_is_reset_on_attach():
+    device = Device()
+    device.debug = False
+    first = SimulatedSerial(realtime=False)
+    first.timeout = 0.05
+    device.attach(first)
+    device.assignKey(KeyCode.SW2_PRESS, A)
+    assert device.requestInfo(3)
+    assert first.assignments["2p"] == "k4"
+    device.disconnect()
+    second = SimulatedSerial(realtime=False)   #Another device, or the same one after a reset
+    second.timeout = 0.05
+    device.attach(second)
+    assert device.keymap == {}
+    device.assignKey(KeyCode.SW2_PRESS, A)
+    assert device.requestInfo(3)
+    assert second.assignments["2p"] == "k4"
+    device.disconnect()
+
+def jogDevice(events):
+    device = quietDevice()
+    device.registerCallback(lambda: events.append("2p"), KeyCode.SW2_PRESS)
+    device.registerCallback(events.append, KeyCode.JOG)
+    return device
+
+def test_consecutive_jog_steps_are_one_callback():
+    events = []
+    jogDevice(events).handleLines([b"R1", b"R2", b"R-1", b"R1"])
+    assert events == [3]
+
+def test_key_presses_between_jog_steps_keep_their_order():
+    events = []
+    jogDevice(events).handleLines([b"R1", b"R1", b"2p", b"R-1", b"Rx", b"R-2", b"2p"])
+    assert events == [2, "2p", -1, -2, "2p"]   #Rx is not a jog step, so it ends the first run of steps
+
+def test_jog_steps_depend_on_the_speed(monkeypatch):
+    clock = [100.0]
+    monkeypatch.setattr(time, "time", lambda: clock[0])
+    device = jogDevice([])
+    device.handleLines([b"R1"])                 #5 steps per second
+    assert device.jogSteps(2) == 2
+    device.handleLines([b"R1"]*9)               #9 more steps right away: coarse
+    assert device.jogSteps(2) == 20
+    assert device.jogSteps(-1, fine=1, coarse=5) == -5
+    assert device.jogSteps(1, speed=100) == 1
+    clock[0] += 1.0                             #The speed decays after a second without steps
+    device.handleLines([b"R1"])
+    assert device.jogSteps(2) == 2
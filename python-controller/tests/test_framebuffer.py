@@ -0,0 +1,106 @@
+from inkkeys import *
+
+def test_row_bytes():
+    assert [rowBytes(w) for w in (1, 8, 9, 16, 17)] == [1, 1, 2, 2, 3]
+
+def test_crop_packed():
+    data = bytes(range(12))     #3 rows of 4 bytes
+    assert cropPacked(data, 4, 0, 2, 0, 3) == data
+    assert cropPacked(data, 4, 1, 2, 1, 2) == bytes([5, 6, 9, 10])
+
+def test_unchanged_image_has_no_diff():
+    fb = Framebuffer(32, 4)
+    assert fb.diff(0, 0, 32, 4, bytes([WHITE])*16) == None
+
+def test_diff_is_the_changed_area():
+    fb = Framebuffer(32, 4)
+    data = bytearray([WHITE])*16
+    data[1*4+2] = 0
+    data[2*4+1] = 0x0f
+    assert fb.diff(0, 0, 32, 4, data) == (1, 2, 1, 2)
+    fb.blit(0, 0, 32, 4, data)
+    assert fb.diff(0, 0, 32, 4, data) == None
+    assert fb.data == data
+
+def test_x_is_aligned_down_like_the_firmware():
+    fb = Framebuffer(32, 2)
+    fb.blit(13, 1, 8, 1, b"\x00")
+    assert fb.data[4:] == bytes([WHITE, 0, WHITE, WHITE])
+    assert fb.diff(8, 1, 8, 1, b"\x00") == None
+
+def test_outside_of_the_display_is_clipped():
+    fb = Framebuffer(16, 2)
+    assert fb.visible(8, 1, 16, 4) == (1, 1)
+    fb.blit(8, 1, 16, 4, bytes(8))
+    assert fb.data == bytes([WHITE, WHITE, WHITE, 0])
+    assert fb.diff(8, 1, 16, 4, bytes([0, WHITE])*4) == None   #Only the visible byte counts
+
+def test_device_only_sends_changes():
+    device = Device()
+    device.debug = False
+    device.dispW, device.dispH = 32, 4
+    device.shadow = Framebuffer(32, 4)
+    sent = []
+    device.sendImageToDevice = lambda x, y, w, h, data: sent.append((x, y, w, h, bytes(data)))
+    data = bytearray([WHITE])*16
+    data[2*4+3] = 0
+    device.writePackedImage(0, 0, 32, 4, data)
+    assert sent == [(24, 2, 8, 1, b"\x00")]
+    assert device.writePackedImage(0, 0, 32, 4, data).result() == True
+    assert len(sent) == 1
+
+def test_image_buffer_without_writes_has_no_regions():
+    assert list(ImageBuffer(32, 4).regions()) == []
+
+def test_image_buffer_regions_group_rows_of_the_same_span():
+    buffer = ImageBuffer(32, 6)
+    buffer.blit(8, 0, 16, 2, bytes([1, 2, 3, 4]))
+    buffer.blit(0, 3, 32, 2, bytes(range(8)))
+    buffer.blit(20, 5, 8, 1, b"\x07")      #Aligned down to x 16
+    regions = [(x, y, w, h, bytes(data)) for x, y, w, h, data in buffer.regions()]
+    assert regions == [
+        (8, 0, 16, 2, bytes([1, 2, 3, 4])),
+        (0, 3, 32, 2, bytes(range(8))),
+        (16, 5, 8, 1, b"\x07"),
+    ]
+
+def test_image_buffer_spans_grow_with_overlapping_writes():
+    buffer = ImageBuffer(32, 2)
+    buffer.blit(0, 0, 8, 2, b"\x01\x02")
+    buffer.blit(16, 1, 8, 1, b"\x03")
+    regions = [(x, y, w, h, bytes(data)) for x, y, w, h, data in buffer.regions()]
+    assert regions == [(0, 0, 8, 1, b"\x01"), (0, 1, 24, 1, bytes([2, WHITE, 3]))]
+
+def test_full_rows_are_not_copied():
+    buffer = ImageBuffer(16, 2)
+    buffer.blit(0, 0, 16, 2, bytes(4))
+    (x, y, w, h, data), = buffer.regions()
+    assert isinstance(data, memoryview)
+    buffer.data[0] = 0x55                   #Shows what is in the buffer when it is sent
+    assert bytes(data) == bytes([0x55, 0, 0, 0])
+    data.release()
+
+def test_image_buffer_clear_and_clipping():
+    buffer = ImageBuffer(16, 2)
+    buffer.blit(8, 1, 16, 4, bytes(8))      #Only one byte of one row is visible
+    assert [(x, y, w, h) for x, y, w, h, data in buffer.regions()] == [(8, 1, 8, 1)]
+    buffer.clear()
+    assert list(buffer.regions()) == []
+    assert buffer.data == bytes([WHITE, WHITE, WHITE, 0])   #Clearing only forgets what was written
+    buffer.blit(32, 0, 8, 1, b"\x00")       #Entirely outside
+    assert list(buffer.regions()) == []
+
+def test_device_resends_buffered_regions():
+    device = Device()
+    device.debug = False
+    device.dispW, device.dispH = 32, 4
+    sent = []
+    device.sendImageToDevice = lambda x, y, w, h, data: sent.append((x, y, w, h, bytes(data)))
+    device.writePackedImage(8, 1, 8, 2, b"\x00\x01")
+    device.writePackedImage(0, 3, 32, 1, bytes(4))
+    sent.clear()
+    device.resendImageData()
+    assert sent == [(8, 1, 8, 2, b"\x00\x01"), (0, 3, 32, 1, bytes(4))]
+    sent.clear()
+    device.resendImageData()
+    assert sent == []
@@ -0,0 +1,50 @@
+import glob
+import random
+import warnings
+import pytest
+from inkkeys import *
+
+FONTS = sorted(glob.glob("font/*.ttf"))
+TEXTS = ["", "Default", "12:34:56", "Volume 42%", "a_b c_", "<Back> `x`", "Grüße", "gjpqy|[]", "Wi Fi!"]
+TILES = [(40, 296), (56, 74), (8, 100), (296, 84)]
+
+def test_all_fonts_are_tested():
+    assert len(FONTS) == 5
+
+@pytest.mark.parametrize("path", FONTS)
+def test_atlas_matches_pil(path):
+    rng = random.Random(path)
+    chars = [chr(code) for code in range(32, 127)] + list("äöüß")
+    for size in (8, 10, 13, 16):
+        atlas = GlyphAtlas(path, size)
+        assert atlas.exact
+        texts = TEXTS + ["".join(rng.choice(chars) for _ in range(rng.randint(1, 12))) for _ in range(20)]
+        for i, text in enumerate(texts):
+            w, h = TILES[i % len(TILES)]
+            inverted = i % 3 == 0
+            assert atlas.renderPacked(w, h, text, inverted) == renderTextWithPIL(atlas.font, w, h, text, inverted), (size, text)
+
+def test_pil_rendering_is_the_old_rendering():
+    from PIL import Image, ImageDraw, ImageFont
+    font = ImageFont.truetype("font/Munro.ttf", 10)
+    if not hasattr(font, "getsize"):
+        pytest.skip("getsize was removed from Pillow")
+    for text in TEXTS:
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore")
+            fW, fH = font.getsize(text)
+        img = Image.new("1", (296, 40), color=1)
+        ImageDraw.Draw(img).text((296//2,(40-fH)//2), text, anchor="mt", font=font, fill=0)
+        assert renderTextWithPIL(font, 40, 296, text) == img.rotate(270, expand=1).convert("1").rotate(180).tobytes()
+
+def test_characters_pil_draws_depending_on_neighbours_use_pil():
+    atlas = GlyphAtlas("font/Munro.ttf", 10)
+    assert {"<", ">", "`", "_"} <= atlas.unsafe
+    assert atlas.unsafe.isdisjoint("Default 0123456789")
+
+def test_device_renders_text_with_the_atlas():
+    device = Device()
+    device.font = "font/Munro.ttf"
+    device.fontSize = 10
+    assert device.renderText(40, 296, "Default") == renderTextWithPIL(device.getFont(device.font, 10).font, 40, 296, "Default")
+    assert device.getFont(device.font, 10) is device.getFont(device.font, 10)
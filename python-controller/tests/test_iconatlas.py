@@ -0,0 +1,78 @@
+import os
+import shutil
+import pytest
+from inkkeys import *
+from inkkeys import iconatlas
+
+ICONS = ["alarm.png", "alt.png", "align-top.png"]
+
+@pytest.fixture
+def directory(tmp_path):
+    icons = tmp_path / "icons"
+    icons.mkdir()
+    for name in ICONS:
+        shutil.copy(os.path.join("icons", name), icons / name)
+    (icons / "README.txt").write_text("not an icon")
+    return str(icons)
+
+def later(path, seconds=10):
+    mtime = os.stat(path).st_mtime + seconds
+    os.utime(path, (mtime, mtime))
+
+def test_packed_icons_are_drawn_like_pil(directory, tmp_path):
+    atlas = IconAtlas.load(directory, str(tmp_path / "icons.atlas"))
+    assert len(atlas) == len(ICONS)
+    device = Device()
+    for name in ICONS:
+        icon = os.path.join(directory, name)
+        for w, h in ((64, 74), (20, 30)):       #The second one is smaller than the icons
+            for function in (1, 7):
+                for inverted in (False, True):
+                    device.iconAtlas = None
+                    expected = device.renderPackedIcon(w, h, function, icon, inverted)
+                    device.iconAtlas = atlas
+                    assert device.renderPackedIcon(w, h, function, icon, inverted) == expected, (name, w, h, function, inverted)
+    atlas.close()
+
+def test_only_changed_icons_are_decoded(directory, tmp_path, monkeypatch):
+    path = str(tmp_path / "icons.atlas")
+    IconAtlas.load(directory, path).close()
+    decoded = []
+    packIcon = iconatlas.packIcon
+    monkeypatch.setattr(iconatlas, "packIcon", lambda icon: decoded.append(os.path.basename(icon)) or packIcon(icon))
+    atlas = IconAtlas.load(directory, path)
+    assert decoded == []
+    shutil.copy(os.path.join("icons", "alarm-fill.png"), os.path.join(directory, "alarm.png"))
+    later(os.path.join(directory, "alarm.png"))
+    assert atlas.stale(directory)
+    compileIcons(directory, path, atlas)
+    assert decoded == ["alarm.png"]
+    assert atlas.data.closed                 #Closed before its file was replaced
+    rebuilt = IconAtlas.load(directory, path)
+    assert decoded == ["alarm.png"]
+    icon = os.path.join(directory, "alarm.png")
+    assert rebuilt.icon(icon, TileCache.mtime(icon))[2] == iconatlas.packIcon(icon)[2]
+    rebuilt.close()
+
+def test_removed_icons_are_dropped(directory, tmp_path):
+    path = str(tmp_path / "icons.atlas")
+    atlas = IconAtlas.load(directory, path)
+    removed = os.path.join(directory, "alt.png")
+    os.remove(removed)
+    later(directory)
+    assert atlas.stale(directory)
+    rebuilt = IconAtlas.load(directory, path)
+    assert len(rebuilt) == len(ICONS) - 1
+    assert rebuilt.mtime(removed) == None
+    assert rebuilt.renderPacked(64, 74, removed, None, 0, 0) == None
+    rebuilt.close()
+
+def test_broken_atlas_is_rebuilt(directory, tmp_path):
+    path = str(tmp_path / "icons.atlas")
+    with open(path, "wb") as f:
+        f.write(b"garbage")
+    with pytest.raises(ValueError):
+        IconAtlas(path)
+    atlas = IconAtlas.load(directory, path)
+    assert len(atlas) == len(ICONS)
+    atlas.close()
@@ -0,0 +1,35 @@
+from colorsys import hsv_to_rgb
+from inkkeys import *
+
+def test_encode():
+    assert encodeFrame(ledFrame([0xff0000, 0x00ff00, 0x0000ff])) == "ff0000 00ff00 0000ff"
+    assert encodeFrame(ledFrame([])) == ""
+
+def test_dim_and_blend():
+    frame = ledFrame([0xff8040, 0x000000])
+    assert list(dimFrame(frame, 0.5)) == [0x7f4020, 0]
+    assert list(blendFrames(frame, ledFrame([0x000000, 0xffffff]), 0.5)) == [0x7f4020, 0x7f7f7f]
+    assert list(blendFrames(frame, ledFrame([0, 0]), 2)) == [0, 0]
+
+def test_rainbow_matches_hsv():
+    for n, phase in ((12, 0), (12, 0.25), (7, 0.5)):
+        frame = rainbowFrame(n, phase)
+        assert len(frame) == n
+        start = int(phase*WHEEL_SIZE)
+        for i, color in enumerate(frame):
+            r, g, b = hsv_to_rgb(((start + i*WHEEL_SIZE//n) % WHEEL_SIZE)/WHEEL_SIZE, 1, 1)
+            assert color == (int(r*255) << 16) | (int(g*255) << 8) | int(b*255)
+
+def test_changed_leds():
+    assert changedLeds(ledFrame([1, 2, 3]), ledFrame([1, 5, 3])) == [1]
+
+def test_device_sends_only_changes():
+    device = Device()
+    device.debug = False
+    sent = []
+    device.sendToDevice = lambda command, *args, **kwargs: sent.append(command)
+    device.capabilities = {CapabilityCode.LED_PIXELS.value}
+    device.sendLedFrame(ledFrame([0]*12))
+    device.sendLedFrame(ledFrame([0]*12))
+    device.sendLedFrame(ledFrame([0]*11 + [0xff0000]))
+    assert sent == [CommandCode.LED.value + " " + " ".join(["000000"]*12), CommandCode.LED_PIXELS.value + " 11 ff0000"]
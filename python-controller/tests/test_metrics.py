@@ -0,0 +1,63 @@
+import json
+from inkkeys import *
+
+def test_counters_are_kept_per_label_set():
+    metrics = Metrics()
+    metrics.count("serial_bytes_total", 12, direction="out", command="A")
+    metrics.count("serial_bytes_total", 3, command="A", direction="out")    #Order of the labels does not matter
+    metrics.count("serial_bytes_total", 5, direction="in", command="ok")
+    metrics.count("connects_total")
+    assert metrics.counters[("serial_bytes_total", (("command", "A"), ("direction", "out")))] == 15
+    assert metrics.counters[("serial_bytes_total", (("command", "ok"), ("direction", "in")))] == 5
+    assert metrics.counters[("connects_total", ())] == 1
+
+def test_histogram_buckets():
+    metrics = Metrics()
+    for seconds in (0.0005, 0.001, 0.3, 60):
+        metrics.observe("ack_seconds", seconds, command="D")
+    buckets, total, n = metrics.histograms[("ack_seconds", (("command", "D"),))]
+    assert buckets[0] == 2                                  #Upper bounds are inclusive
+    assert buckets[DURATION_BUCKETS.index(0.5)] == 1
+    assert sum(buckets) == 3                                #60 seconds is only in +Inf
+    assert (round(total, 4), n) == (60.3015, 4)
+
+def test_render():
+    metrics = Metrics()
+    metrics.count("ack_timeouts_total", command="R")
+    metrics.count("custom_total", 2, text='a "b"\n')
+    metrics.observe("loop_seconds", 0.002)
+    lines = metrics.render().splitlines()
+    assert "# HELP inkkeys_ack_timeouts_total " + METRICS["ack_timeouts_total"][1] in lines
+    assert "# TYPE inkkeys_ack_timeouts_total counter" in lines
+    assert 'inkkeys_ack_timeouts_total{command="R"} 1' in lines
+    assert "# TYPE inkkeys_custom_total counter" in lines    #Not in METRICS, so without HELP
+    assert not any(line.startswith("# HELP inkkeys_custom_total") for line in lines)
+    assert 'inkkeys_custom_total{text="a \\"b\\"\\n"} 2' in lines
+    assert "# TYPE inkkeys_loop_seconds histogram" in lines
+    assert 'inkkeys_loop_seconds_bucket{le="0.001"} 0' in lines
+    assert 'inkkeys_loop_seconds_bucket{le="0.0025"} 1' in lines
+    assert 'inkkeys_loop_seconds_bucket{le="10.0"} 1' in lines
+    assert 'inkkeys_loop_seconds_bucket{le="+Inf"} 1' in lines
+    assert "inkkeys_loop_seconds_sum 0.002" in lines
+    assert "inkkeys_loop_seconds_count 1" in lines
+
+def test_histogram_labels_come_before_le():
+    metrics = Metrics("test_")
+    metrics.observe("mode_switch_seconds", 0.1, mode="ModeGimp")
+    assert 'test_mode_switch_seconds_bucket{mode="ModeGimp",le="0.1"} 1' in metrics.render().splitlines()
+
+def test_trace(tmp_path):
+    path = str(tmp_path / "trace.jsonl")
+    metrics = Metrics()
+    metrics.trace("ignored")        #No trace file yet
+    metrics.openTrace(path)
+    metrics.observe("ack_seconds", 0.01, command="D")
+    metrics.observe("loop_seconds", 0.001, trace=False)
+    metrics.trace("mode", mode="ModeGimp")
+    metrics.closeTrace()
+    metrics.trace("ignored")
+    with open(path) as f:
+        events = [json.loads(line) for line in f]
+    assert [event["event"] for event in events] == ["ack_seconds", "mode"]
+    assert events[0]["seconds"] == 0.01 and events[0]["command"] == "D"
+    assert events[1]["mode"] == "ModeGimp" and "time" in events[1]
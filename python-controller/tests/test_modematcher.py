@@ -0,0 +1,70 @@
+import re
+from modematcher import *
+
+class Processes(set):
+    generation = 0
+
+TABLE = [
+    {"mode": "blender", "activeWindow": re.compile("^Blender")},
+    {"mode": "gimp", "activeWindow": re.compile("^gimp", re.IGNORECASE)},
+    {"mode": "grouped", "activeWindow": re.compile(r"^(\w+) - Editor$")},
+    {"mode": "obs", "process": "obs"},
+    {"mode": "mac", "hostname": re.compile("^Mac-Min.*")},
+    {"mode": "fallback"},
+    {"mode": "never"},
+]
+
+def test_first_matching_entry_wins():
+    matcher = ModeMatcher(TABLE, "pc")
+    processes = Processes()
+    assert matcher.select("Blender 3.6", processes) == "blender"
+    assert matcher.select("GIMP-2.10", processes) == "gimp"
+    assert matcher.select("notes - Editor", processes) == "grouped"
+    assert matcher.select("Terminal", processes) == "fallback"
+    assert matcher.select(None, processes) == "fallback"
+    processes.add("obs")
+    processes.generation += 1
+    assert matcher.select("Terminal", processes) == "obs"
+    assert matcher.select("Blender", processes) == "blender"
+
+def test_patterns_are_merged_unless_they_have_groups():
+    matcher = ModeMatcher(TABLE, "pc")
+    assert matcher.windowPattern != None
+    assert [index for index, pattern in matcher.windowRules] == [2]
+
+def test_hostname_ends_the_table():
+    matcher = ModeMatcher(TABLE, "Mac-Mini")
+    assert matcher.select("Terminal", Processes()) == "mac"
+    assert matcher.modes == ["blender", "gimp", "grouped", "obs", "mac"]
+
+def test_results_are_remembered_per_generation():
+    matcher = ModeMatcher(TABLE, "pc")
+    processes = Processes()
+    assert matcher.select("Terminal", processes) == "fallback"
+    processes.add("obs")        #Not noticed without a new generation
+    assert matcher.select("Terminal", processes) == "fallback"
+    processes.generation += 1
+    assert matcher.select("Terminal", processes) == "obs"
+
+def test_without_generation_nothing_is_remembered():
+    matcher = ModeMatcher(TABLE, "pc")
+    processes = set()
+    assert matcher.select("Terminal", processes) == "fallback"
+    processes.add("obs")
+    assert matcher.select("Terminal", processes) == "obs"
+
+class Counted:
+    created = 0
+    def __init__(self):
+        Counted.created += 1
+
+def test_classes_are_instantiated_once_when_selected():
+    Counted.created = 0
+    instance = object()
+    matcher = ModeMatcher([{"mode": Counted, "process": "obs"}, {"mode": instance}], "pc")
+    assert Counted.created == 0
+    assert matcher.mode(1) is instance
+    first = matcher.mode(0)
+    assert isinstance(first, Counted)
+    assert matcher.mode(0) is first
+    assert Counted.created == 1
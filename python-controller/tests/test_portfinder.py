@@ -0,0 +1,93 @@
+import asyncio
+import threading
+import time
+import pytest
+import serial
+import portfinder
+from portfinder import *
+from inkkeys import *
+
+INFO = ["TEST 0", "N_LED 12", "DISP_W 128", "DISP_H 296", "ROT_CIRCLE_STEPS 20", "CAPS RLE"]
+
+#Serial port that answers the info request with the given chunks (a chunk can end in the middle of a line)
+class ProbedSerial:
+
+    def __init__(self, chunks):
+        self.chunks = list(chunks)
+        self.written = b""
+        self.closed = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.closed = True
+
+    def write(self, data):
+        self.written += data
+
+    def readline(self):
+        if not self.chunks:
+            time.sleep(0.01)    #Like the read timeout
+            return b""
+        return self.chunks.pop(0)
+
+def answer(*lines):
+    return [(line + "\r\n").encode() for line in lines]
+
+def test_probe_returns_the_info(monkeypatch):
+    port = ProbedSerial([b"noise\r\n", b"Ink", b"keys\r\n"] + answer(*INFO, "Done"))
+    monkeypatch.setattr(serial, "Serial", lambda *args, **kwargs: port)
+    assert probePort("test", 1) == INFO
+    assert port.written == b"I\n" and port.closed
+
+def test_probe_gives_up(monkeypatch):
+    monkeypatch.setattr(serial, "Serial", lambda *args, **kwargs: ProbedSerial(answer("Inkkeys", "TEST 0")))
+    assert probePort("test", 0.1) == None
+    cancelled = threading.Event()
+    cancelled.set()
+    start = time.time()
+    assert probePort("test", 3, cancelled) == None
+    assert time.time() - start < 1
+
+def test_last_port_is_not_probed(monkeypatch):
+    finder = PortFinder(0, 0)
+    finder.lastPort = "b"
+    monkeypatch.setattr(finder, "candidates", lambda: ["b", "a"])
+    monkeypatch.setattr(portfinder, "probePort", lambda *args: pytest.fail("probed"))
+    assert asyncio.run(finder.find()) == [("b", None), ("a", None)]
+
+def test_losing_probes_stop_when_one_answers(monkeypatch):
+    finder = PortFinder(0, 0)
+    monkeypatch.setattr(finder, "candidates", lambda: ["slow", "fast"])
+    stopped = threading.Event()
+    def probe(port, timeout, cancelled):
+        if port == "fast":
+            return INFO
+        cancelled.wait(timeout)
+        if cancelled.is_set():
+            stopped.set()
+        return None
+    monkeypatch.setattr(portfinder, "probePort", probe)
+    start = time.time()
+    assert asyncio.run(finder.find()) == [("fast", INFO)]
+    assert stopped.wait(1)
+    assert time.time() - start < 1
+
+def test_no_port_answers(monkeypatch):
+    finder = PortFinder(0, 0)
+    monkeypatch.setattr(finder, "candidates", lambda: ["a", "b"])
+    monkeypatch.setattr(portfinder, "probePort", lambda *args: None)
+    assert asyncio.run(finder.find()) == []
+
+def test_probed_info_is_not_requested_again(monkeypatch):
+    sim = SimulatedSerial(realtime=False)
+    monkeypatch.setattr(serial, "Serial", lambda *args, **kwargs: sim)
+    async def run():
+        device = AsyncDevice()
+        device.debug = False
+        assert await device.open("test", INFO)
+        assert (device.dispW, device.dispH, device.capabilities) == (128, 296, {"RLE"})
+        assert sim.commands["I"] == 0
+        device.disconnect()
+    asyncio.run(run())
@@ -0,0 +1,169 @@
+import os
+import copy
+import time
+from inkkeys import *
+from prerender import *
+
+#Renders tiles into a set instead of images
+class TileDevice:
+    dispW = 128
+    dispH = 296
+    font = "font/Munro.ttf"
+
+    def __init__(self):
+        self.tileCache = self
+        self.cached = set()
+        self.assigned = []
+
+    def contains(self, key):
+        return key in self.cached
+
+    def textTileKey(self, function, text, **kwargs):
+        return ("text", function, text)
+
+    def textTileFor(self, function, text, **kwargs):
+        self.cached.add(self.textTileKey(function, text))
+
+    def iconTileKey(self, function, icon, **kwargs):
+        return ("icon", function, icon)
+
+    def iconTileFor(self, function, icon, **kwargs):
+        self.cached.add(self.iconTileKey(function, icon))
+
+    def assignKey(self, key, sequence):
+        self.assigned.append(key)
+
+    def assignCommand(self, key, command):
+        self.assigned.append(key)
+
+    def updateDisplay(self):
+        pass
+
+class Counted:
+    created = 0
+
+    def __init__(self):
+        Counted.created += 1
+        self.activations = []
+
+    def activate(self, device):
+        self.activations.append(device)     #Changes the mode, which the mode in use must not see
+        device.sendTextFor("title", "Counted")
+        device.sendIconFor(2, "icons/alarm.png", centered=False)
+        device.assignKey(KeyCode.SW2_PRESS, [])
+
+class Broken:
+    def activate(self, device):
+        raise RuntimeError("broken")
+
+def prerenderer(modes):
+    device = TileDevice()
+    return device, Prerenderer(device, modes)
+
+def test_collector_notes_tiles_and_ignores_the_rest():
+    device, renderer = prerenderer([])
+    mode = Counted()
+    collector = renderer.collect(mode)
+    assert [args for key, tileFor, args, kwargs in collector.tiles] == [("title", "Counted"), (2, "icons/alarm.png")]
+    assert collector.tiles[1][3] == {"centered": False}
+    assert collector.sources == {"font/Munro.ttf", "icons"}
+    assert device.assigned == []
+    assert mode.activations == []           #Activated as a deep copy
+
+#Keeps its state in class attributes like the modes in modes.py
+class Lazy:
+    created = 0
+    title = "Lazy"
+
+    def __init__(self):
+        Lazy.created += 1
+
+    def activate(self, device):
+        device.sendTextFor("title", self.title)
+
+def test_classes_are_rendered_without_creating_them():
+    Lazy.created = Counted.created = 0
+    device, renderer = prerenderer([Lazy, Counted])
+    renderer.start()
+    renderer.update()
+    renderer.job.result()
+    assert Lazy.created == 0 and Counted.created == 0     #__init__ is not called...
+    assert device.cached == {("text", "title", "Lazy")}     #...which Counted needs, so it has to wait until it is created
+    renderer.modes[1] = Counted()
+    renderer.activated(renderer.modes[1], now=0)
+    renderer.update()
+    renderer.job.result()
+    assert ("icon", 2, "icons/alarm.png") in device.cached
+    assert renderer.rendered == 3
+    renderer.stop()
+
+def test_passes_only_when_something_changed(tmp_path):
+    icons = tmp_path / "icons"
+    icons.mkdir()
+    icon = str(icons / "icon.png")
+    class Icon:
+        def activate(self, device):
+            device.sendIconFor(2, icon)
+    device, renderer = prerenderer([Icon])
+    renderer.update()
+    assert renderer.job == None             #Not started yet
+    renderer.start()
+    renderer.update()
+    renderer.job.result()
+    assert renderer.rendered == 1 and renderer.sources == {str(icons): TileCache.mtime(str(icons))}
+    first = renderer.job
+    renderer.update()
+    assert renderer.job is first            #Nothing changed, nothing to do
+    renderer.modes[0] = Icon()              #Like ModeMatcher.mode once the mode is selected...
+    renderer.activated(renderer.modes[0], now=0)
+    renderer.update()                       #...which might send other tiles than the class
+    assert renderer.job is not first
+    renderer.job.result()
+    second = renderer.job
+    renderer.activated(renderer.modes[0], now=1)
+    renderer.update()
+    assert renderer.job is second           #Only the first activation counts
+    later = time.time() + 10
+    os.utime(str(icons), (later, later))    #An icon was replaced or added
+    renderer.update()
+    assert renderer.job is not second
+    renderer.job.result()
+    renderer.stop()
+
+def test_only_missing_tiles_are_rendered_and_broken_modes_are_skipped():
+    device, renderer = prerenderer([Broken(), Counted()])
+    device.cached.add(("text", "title", "Counted"))
+    renderer.render()
+    assert renderer.rendered == 1
+    assert ("icon", 2, "icons/alarm.png") in device.cached
+
+def test_stopped_pass_ends():
+    device, renderer = prerenderer([Counted()])
+    renderer.start()
+    renderer.update()
+    renderer.stop()
+    assert renderer.executor == None
+    device.cached.clear()
+    renderer.render()
+    assert device.cached == set()
+
+def test_often_used_modes_come_first():
+    rare, often, instance = Broken, Counted, Counted()
+    device, renderer = prerenderer([])
+    renderer.activated(rare, now=0)
+    renderer.activated(often, now=0)
+    renderer.activated(instance, now=0)     #Counts for the class as well
+    assert renderer.score(often, 0) == 2
+    assert renderer.score(often, ACTIVATION_HALF_LIFE) == 1
+    assert renderer.score(Counted(), 0) == 2
+    assert renderer.score(rare(), 0) == 1
+
+def test_bundled_modes_are_not_copied(tmp_path):
+    path = str(tmp_path / "modes.bundle")
+    compileModes({"Test": {"title": {"text": "Test"}, "display": {"3": {"text": "Three"}}}}, path)
+    bundle = ModeBundle(path)
+    mode = bundle.mode("Test")
+    assert copy.deepcopy(mode) is mode      #The tiles are views of the bundle
+    device, renderer = prerenderer([mode])
+    device.bannerHeight = 0                 #Not the geometry of the bundle, so the tiles are rendered
+    assert [args for key, tileFor, args, kwargs in renderer.collect(mode).tiles] == [("title", "Test"), (3, "Three")]
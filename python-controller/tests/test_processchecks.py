@@ -0,0 +1,126 @@
+import sys
+import pytest
+import processchecks
+from processchecks import *
+
+linux = pytest.mark.skipif(sys.platform not in ['linux', 'linux2'], reason="X11 only")
+
+#Connection to the X server that delivers the given events and then breaks
+class BrokenDisplay:
+
+    def __init__(self, events):
+        self.events = list(events)
+        self.closed = False
+
+    def next_event(self):
+        import Xlib.error
+        if not self.events:
+            raise Xlib.error.ConnectionClosedError("server")
+        return self.events.pop(0)
+
+    def close(self):
+        self.closed = True
+
+class PropertyNotify:
+    atom = "_NET_ACTIVE_WINDOW"
+
+    def __init__(self):
+        import Xlib.X
+        self.type = Xlib.X.PropertyNotify
+
+def startedWatcher(display, changes, stops):
+    watcher = WindowWatcher(changes.append, lambda: stops.append(True))
+    watcher.display = display
+    watcher.root = None
+    watcher.atom = PropertyNotify.atom
+    watcher.running = True
+    return watcher
+
+@linux
+def test_watcher_reports_changes(monkeypatch):
+    windows = ["Blender", "Blender", "GIMP"]
+    monkeypatch.setattr(processchecks, "getActiveWindowClass", lambda display, root: windows.pop(0))
+    changes, stops = [], []
+    watcher = startedWatcher(BrokenDisplay([PropertyNotify(), PropertyNotify()]), changes, stops)
+    watcher.run()
+    assert changes == ["Blender", "GIMP"]
+
+@linux
+def test_watcher_reports_a_broken_connection(monkeypatch):
+    monkeypatch.setattr(processchecks, "getActiveWindowClass", lambda display, root: "Blender")
+    changes, stops = [], []
+    display = BrokenDisplay([])
+    watcher = startedWatcher(display, changes, stops)
+    watcher.lastWindow = "Blender"     #As found by start()
+    watcher.run()
+    assert changes == []
+    assert watcher.failed and not watcher.running
+    assert stops == [True] and display.closed
+
+@linux
+def test_active_window_reconnects_after_a_broken_connection(monkeypatch):
+    import Xlib.error
+    def broken(display, root):
+        raise Xlib.error.ConnectionClosedError("server")
+    monkeypatch.setattr(processchecks, "getActiveWindowClass", broken)
+    monkeypatch.setattr(processchecks, "display", object())
+    assert getActiveWindow() == None
+    assert processchecks.display == None
+
+#Processes by PID, standing in for psutil
+class Processes:
+
+    def __init__(self, monkeypatch, running):
+        import psutil
+        self.running = dict(running)
+        self.created = {}       #Creation time of each PID, 0 if not given
+        self.asked = []
+        monkeypatch.setattr(psutil, "pids", lambda: list(self.running))
+        monkeypatch.setattr(psutil, "Process", self.process)
+
+    def process(self, pid):
+        import psutil
+        if pid not in self.running:
+            raise psutil.NoSuchProcess(pid)
+        name = self.running[pid]
+        created = self.created.get(pid, 0)
+        asked = self.asked
+        return type("Process", (), {"name": lambda self: asked.append(pid) or name, "create_time": lambda self: created})()
+
+def test_process_index(monkeypatch):
+    processes = Processes(monkeypatch, {1: "init", 2: "blender", 3: "bash"})
+    index = ProcessIndex(["blender", "gimp"])
+    assert index.update()
+    assert "blender" in index and "gimp" not in index
+    processes.asked.clear()
+    processes.running[4] = "gimp"
+    processes.running[5] = "blender"
+    assert index.update()
+    assert sorted(processes.asked) == [4, 5]    #Only new processes are looked at
+    assert "gimp" in index
+    del processes.running[2]
+    assert not index.update()           #Another blender is still running
+    del processes.running[5]
+    assert index.update()
+    assert "blender" not in index
+    assert index.generation == 3
+
+def test_process_index_without_names(monkeypatch):
+    processes = Processes(monkeypatch, {1: "init"})
+    assert not ProcessIndex([]).update()
+    assert processes.asked == []
+
+def test_process_index_with_a_reused_pid(monkeypatch):
+    processes = Processes(monkeypatch, {1: "init", 2: "blender"})
+    index = ProcessIndex(["blender", "gimp"])
+    assert index.update()
+    processes.running[2] = "gimp"       #Blender ended and its PID was given to a new process
+    processes.created[2] = 10
+    processes.asked.clear()
+    assert index.update()
+    assert processes.asked == [2]
+    assert "gimp" in index and "blender" not in index
+    processes.running[2] = "bash"
+    processes.created[2] = 20
+    assert index.update()
+    assert "gimp" not in index
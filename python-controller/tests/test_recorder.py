@@ -0,0 +1,73 @@
+import struct
+import time
+from inkkeys import *
+from inkkeys import recorder
+
+class Clock:
+    now = 1000.0
+    def time(self):
+        return self.now
+
+def test_round_trip_with_long_gap(tmp_path, monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(recorder, "time", clock)
+    path = str(tmp_path / "session.rec")
+    rec = Recorder(path)
+    clock.now += 0.25
+    rec.record(RECORD_OUT, b"A 1p k4\n")
+    clock.now += 3*3600         #Longer than the 71 minutes the first version could store
+    rec.record(RECORD_IN, b"ok")
+    rec.record(RECORD_OUT_ACK, b"R p\n")
+    rec.close()
+    rec.record(RECORD_IN, b"ignored")
+    records = readRecording(path)
+    assert [(kind, data) for t, kind, data in records] == [(RECORD_OUT, b"A 1p k4\n"), (RECORD_IN, b"ok"), (RECORD_OUT_ACK, b"R p\n")]
+    assert abs(records[0][0] - 0.25) < 1e-6
+    assert abs(records[1][0] - (0.25 + 3*3600)) < 1e-6
+    assert records[2][0] == records[1][0]
+
+def test_long_data_is_split(tmp_path):
+    path = str(tmp_path / "session.rec")
+    rec = Recorder(path)
+    rec.record(RECORD_OUT, bytes(0x10000))
+    rec.record(RECORD_IN, b"")
+    rec.close()
+    records = readRecording(path)
+    assert [(kind, len(data)) for t, kind, data in records] == [(RECORD_OUT, 0xffff), (RECORD_OUT, 1), (RECORD_IN, 0)]
+    assert records[1][0] == records[0][0]
+
+def test_first_version_is_read(tmp_path):
+    path = tmp_path / "old.rec"
+    path.write_bytes(b"INKREC\x01" + struct.pack("<BIH", RECORD_IN, 1500000, 2) + b"ok" + struct.pack("<BIH", RECORD_OUT, 500000, 0))
+    assert readRecording(str(path)) == [(1.5, RECORD_IN, b"ok"), (2.0, RECORD_OUT, b"")]
+
+def test_other_files_are_rejected(tmp_path):
+    path = tmp_path / "other.rec"
+    path.write_bytes(b"INKREC\x09")
+    try:
+        readRecording(str(path))
+        assert False
+    except ValueError:
+        pass
+
+def test_replay_answers_in_time():
+    records = [(0.0, RECORD_OUT, b"I\n"), (0.0, RECORD_IN, b"Inkkeys"), (0.5, RECORD_IN, b"Done")]
+    ser = ReplaySerial(records, speed=10)
+    ser.timeout = 0
+    ser.start()
+    assert ser.read(100) == b"Inkkeys\r\n"
+    assert ser.read(100) == b""
+    assert not ser.done()
+    ser.timeout = 1
+    start = time.time()
+    assert ser.read(100) == b"Done\r\n"
+    assert 0.03 < time.time() - start < 0.5
+    assert ser.done()
+    assert ser.write(b"I\n") == 2 and ser.bytesWritten == 2
+
+def test_replay_close_ends_the_recording():
+    ser = ReplaySerial([(60.0, RECORD_IN, b"late")])
+    ser.timeout = 0
+    ser.close()
+    assert ser.done()
+    assert ser.read(10) == b""
@@ -0,0 +1,116 @@
+import pytest
+from concurrent.futures import Future
+from inkkeys import *
+
+#Records what the scheduler sends, refreshes are acknowledged with ack()
+class RefreshDevice:
+    dispW = 32
+    dispH = 4
+    refreshDelay = 0.1
+    refreshMaxDelay = 0.5
+
+    def __init__(self):
+        self.metrics = Metrics()
+        self.images = []
+        self.refreshes = []     #(fullRefresh, timeout, future)
+        self.idle = 0
+
+    def writePackedImage(self, x, y, w, h, data):
+        self.images.append((x, y, w, h, data))
+        future = Future()
+        future.set_result(True)
+        return future
+
+    def refreshDisplay(self, fullRefresh=False, timeout=5):
+        self.refreshes.append((fullRefresh, timeout, Future()))
+        return self.refreshes[-1][2]
+
+    def displayIdle(self):
+        self.idle += 1
+
+    def ack(self, result=True):
+        self.refreshes[-1][2].set_result(result)
+
+def test_nothing_pending():
+    scheduler = RefreshScheduler(RefreshDevice())
+    assert scheduler.due() == None
+    assert scheduler.update() == None
+
+def test_refresh_is_due_after_the_last_request_but_not_too_late():
+    device = RefreshDevice()
+    scheduler = RefreshScheduler(device)
+    scheduler.request()
+    start = scheduler.first
+    scheduler.last = start + 0.2
+    assert scheduler.due() == pytest.approx(start + 0.3)
+    scheduler.last = start + 0.45       #A request every now and then does not delay the refresh forever
+    assert scheduler.due() == pytest.approx(start + 0.5)
+    assert scheduler.update(start + 0.4) == pytest.approx(0.1, abs=1e-6)
+    assert device.refreshes == []
+    assert scheduler.update(start + 0.5) == None
+    assert len(device.refreshes) == 1
+
+def test_requests_and_images_are_coalesced():
+    device = RefreshDevice()
+    scheduler = RefreshScheduler(device)
+    written = [scheduler.image(0, 0, 8, 1, b"\x00"), scheduler.image(0, 0, 8, 1, b"\x0f"), scheduler.image(8, 2, 8, 1, b"\x01")]
+    refreshed = [scheduler.request(timeout=2), scheduler.request(True, timeout=7)]
+    assert device.metrics.counters[("refresh_requests_coalesced_total", ())] == 1
+    scheduler.flush()
+    assert [(x, y, w, h, bytes(data)) for x, y, w, h, data in device.images] == [(0, 0, 8, 1, b"\x0f"), (8, 2, 8, 1, b"\x01")]
+    assert all(future.result() for future in written)
+    assert [(full, timeout) for full, timeout, future in device.refreshes] == [(True, 7)]
+    assert not any(future.done() for future in refreshed)
+    device.ack()
+    assert all(future.result() for future in refreshed)
+    assert device.idle == 1
+
+def test_nothing_is_sent_while_the_display_is_busy():
+    device = RefreshDevice()
+    scheduler = RefreshScheduler(device)
+    scheduler.request()
+    scheduler.flush()
+    second = scheduler.request()
+    assert scheduler.update(scheduler.first + 10) == None
+    assert len(device.refreshes) == 1
+    device.ack()
+    scheduler.update(scheduler.first + 10)
+    assert len(device.refreshes) == 2
+    assert not second.done()
+    device.ack(False)
+    assert second.result() == False
+
+def test_clear_draws_white():
+    device = RefreshDevice()
+    scheduler = RefreshScheduler(device)
+    scheduler.image(0, 0, 8, 1, b"\x00")
+    scheduler.clear()
+    scheduler.flush()
+    assert [(x, y, w, h, bytes(data)) for x, y, w, h, data in device.images] == [(0, 0, 32, 4, bytes([WHITE])*16)]
+    assert device.refreshes[0][0] == False
+
+def test_discard_and_cancel():
+    device = RefreshDevice()
+    scheduler = RefreshScheduler(device)
+    image = scheduler.image(0, 0, 8, 1, b"\x00")
+    scheduler.discard()
+    assert image.result() == True
+    image = scheduler.image(0, 0, 8, 1, b"\x00")
+    refreshed = scheduler.request()
+    scheduler.cancel()
+    assert image.result() == False and refreshed.result() == False
+    assert scheduler.due() == None
+    scheduler.flush()
+    assert device.refreshes == []
+
+def test_full_refresh_after_partial_refreshes():
+    device = Device()
+    device.debug = False
+    sent = []
+    device.sendToDevice = lambda command, priority=None, ack=False, timeout=5: sent.append(command) or Future()
+    device.fullRefreshAfter = 3
+    for i in range(5):
+        device.refreshDisplay()
+    device.refreshDisplay(True)
+    device.refreshDisplay()
+    assert sent == ["R p", "R p", "R p", "R f", "R p", "R f", "R p"]
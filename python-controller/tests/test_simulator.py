@@ -0,0 +1,43 @@
+from inkkeys import *
+
+def connect(**kwargs):
+    sim = SimulatedSerial(realtime=False, **kwargs)
+    sim.timeout = 0.05      #The reader waits this long when closing
+    device = Device()
+    device.debug = False
+    device.attach(sim)
+    assert device.requestInfo(3)
+    return device, sim
+
+def test_info():
+    device, sim = connect(nLeds=4, dispW=64, dispH=32)
+    assert (device.nLeds, device.dispW, device.dispH) == (4, 64, 32)
+    assert CapabilityCode.RLE.value in device.capabilities
+    device.disconnect()
+
+def test_image_ends_up_on_the_display():
+    device, sim = connect(capabilities=())
+    data = bytes(range(16))
+    device.sendPackedImage(8, 3, 32, 4, data).result(2)
+    assert cropPacked(sim.display.data, rowBytes(128), 3, 6, 1, 4) == data
+    assert sim.commands[CommandCode.DISPLAY.value] == 1
+    device.disconnect()
+
+def test_refresh_is_acknowledged():
+    device, sim = connect()
+    assert device.updateDisplay().result(2) == True
+    assert device.resetDisplay().result(2) == True
+    assert sim.refreshTime == REFRESH_TIMES[RefreshTypeCode.PARTIAL.value] + REFRESH_TIMES[RefreshTypeCode.RESET.value]
+    device.disconnect()
+
+def test_assignments():
+    device, sim = connect()
+    device.assignKey(KeyCode.SW2_PRESS, [event(DeviceCode.KEYBOARD, KeyboardKeycode.KEY_A)])
+    device.requestInfo(3)   #Sending anything sends the assignments first
+    assert sim.assignments["2p"] == "k4"
+    device.disconnect()
+
+def test_unknown_commands_are_reported():
+    sim = SimulatedSerial(realtime=False)
+    sim.write(b"Q\n")
+    assert sim.read(100).startswith(b"E: Unknown command")
@@ -0,0 +1,36 @@
+import sys
+from startupprofile import *
+
+def test_disabled_profile_records_and_prints_nothing(capsys):
+    profile = StartupProfile(False)
+    with profile.phase("imports"):
+        pass
+    profile.report("ready")
+    assert profile.phases == []
+    assert capsys.readouterr().out == ""
+
+def test_phases_list_imported_packages(monkeypatch, capsys):
+    profile = StartupProfile(True)
+    with profile.phase("nothing"):
+        pass
+    with profile.phase("imports"):
+        monkeypatch.setitem(sys.modules, "fakepackage.sub", object())
+        monkeypatch.setitem(sys.modules, "json.fake", object())     #Standard library, not listed
+    assert [phase[0] for phase in profile.phases] == ["nothing", "imports"]
+    assert profile.phases[0][2] == []
+    assert profile.phases[1][2] == ["fakepackage"]
+    profile.report("ready")
+    out = capsys.readouterr().out
+    assert "imports (imported fakepackage)" in out
+    assert "until ready" in out
+    profile.report("ready")         #Only reported once
+    assert capsys.readouterr().out == ""
+
+def test_phase_is_recorded_when_it_raises():
+    profile = StartupProfile(True)
+    try:
+        with profile.phase("failing"):
+            raise RuntimeError()
+    except RuntimeError:
+        pass
+    assert profile.phases[0][0] == "failing"
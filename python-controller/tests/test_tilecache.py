@@ -0,0 +1,43 @@
+import os
+from inkkeys import *
+
+def test_key_depends_on_all_parts():
+    assert TileCache.key("icon", "a.png", 1) == TileCache.key("icon", "a.png", 1)
+    assert TileCache.key("icon", "a.png", 1) != TileCache.key("icon", "a.png", 2)
+
+def test_evicts_least_recently_used():
+    cache = TileCache(maxEntries=2)
+    cache.put("a", b"1")
+    cache.put("b", b"2")
+    assert cache.get("a") == b"1"
+    cache.put("c", b"3")
+    assert cache.get("b") == None
+    assert cache.get("a") == b"1" and cache.get("c") == b"3"
+    assert (cache.hits, cache.misses) == (3, 1)
+
+def test_directory_survives_restart(tmp_path):
+    TileCache(directory=str(tmp_path)).put("a", b"tile")
+    cache = TileCache(directory=str(tmp_path))
+    assert cache.contains("a")
+    assert cache.get("a") == b"tile"
+    assert not cache.contains("b")
+
+def test_directory_is_limited(tmp_path):
+    cache = TileCache(directory=str(tmp_path), maxFiles=8)
+    for i in range(8):
+        cache.put(str(i), b"tile")
+        os.utime(os.path.join(str(tmp_path), str(i) + ".bin"), ns=(i*10**9, i*10**9))
+    cache.get("0")      #Read from memory, does not count as use on disk
+    TileCache(directory=str(tmp_path)).get("1")    #Read from disk, so it is kept
+    cache.put("8", b"tile")
+    stored = sorted(name for name in os.listdir(str(tmp_path)) if name.endswith(".bin"))
+    assert len(stored) == 6
+    assert "1.bin" in stored and "8.bin" in stored and "0.bin" not in stored
+    assert cache.files == 6
+
+def test_devices_do_not_share_state():
+    a, b = Device(), Device()
+    assert a.tileCache is not b.tileCache
+    assert a.metrics is not b.metrics
+    a.keymap["1p"] = "x"
+    assert b.keymap == {}
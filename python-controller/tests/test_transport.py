@@ -0,0 +1,77 @@
+import time
+from threading import Event
+from inkkeys import *
+
+#Serial port that only collects what is written, the tests feed the answers to Transport.received themselves
+class WrittenSerial:
+
+    def __init__(self):
+        self.written = []
+
+    def write(self, data):
+        self.written.append(bytes(data))
+        return len(data)
+
+def waitFor(condition, timeout=2):
+    end = time.time() + timeout
+    while not condition():
+        assert time.time() < end
+        time.sleep(0.001)
+
+def test_complete_lines_are_split_right_away():
+    assert LineBuffer().feed(b"1p\r\n2r\r\nok\r\n") == [b"1p", b"2r", b"ok"]
+
+def test_lines_across_chunks():
+    buffer = LineBuffer(24)
+    assert buffer.feed(b"Ink") == []
+    assert buffer.feed(b"keys\r\nDisp") == [b"Inkkeys"]
+    assert buffer.feed(b"lay width: 128\r\n") == [b"Display width: 128"]
+    assert buffer.feed(b"ok\r\n") == [b"ok"]
+
+def test_overlong_line_is_dropped():
+    buffer = LineBuffer(8)
+    assert buffer.feed(b"0123456789abcdef") == []
+    assert buffer.feed(b"xyz\r\n1p\r\n") == [b"1p"]
+
+def test_control_before_display():
+    ser = WrittenSerial()
+    release = Event()
+    write = ser.write
+    ser.write = lambda data: release.wait(2) and write(data)    #Hold the writer until everything is queued
+    transport = Transport(ser, lambda line: None, reader=False)
+    futures = [transport.send(b"X", PRIORITY_CONTROL)]
+    time.sleep(0.01)
+    futures += [transport.send(b"D", PRIORITY_DISPLAY), transport.send(b"A1", PRIORITY_CONTROL), transport.send(b"A2", PRIORITY_CONTROL)]
+    release.set()
+    assert all(future.result(2) for future in futures)
+    assert ser.written == [b"X", b"A1", b"A2", b"D"]
+    transport.close()
+
+def test_acks_are_matched_in_order():
+    lines = []
+    transport = Transport(WrittenSerial(), lines.append, reader=False)
+    first = transport.send(b"R p", ack=True)
+    second = transport.send(b"R f", ack=True)
+    waitFor(lambda: len(transport.pendingAcks) == 2 and transport.pendingAcks[1][2] != None)
+    transport.received(b"ok\r\n1p\r\n")
+    assert first.result(0) == True and not second.done()
+    assert lines == [b"1p"]
+    transport.received(b"ok\r\n")
+    assert second.result(0) == True
+    transport.close()
+
+def test_late_ack_does_not_resolve_the_next_command():
+    transport = Transport(WrittenSerial(), lambda line: None, reader=False)
+    first = transport.send(b"R p", ack=True, timeout=0.01)
+    waitFor(lambda: transport.pendingAcks and transport.pendingAcks[0][2] != None)
+    time.sleep(0.02)
+    transport.expireAcks()
+    assert first.result(0) == False
+    second = transport.send(b"R f", ack=True)
+    waitFor(lambda: transport.pendingAcks and transport.pendingAcks[0][2] != None)
+    transport.received(b"ok\r\n")      #Answer to the first command, which already timed out
+    assert not second.done()
+    transport.received(b"ok\r\n")
+    assert second.result(0) == True
+    assert transport.metrics.counters[("late_acks_total", ())] == 1
+    transport.close()